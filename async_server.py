@@ -0,0 +1,620 @@
+"""Async entry point for the mobile and dashboard hot paths.
+
+Serves /register, /login, /logout, /refresh-token, /validate-token, /upload,
+/api/stats and /api/user-stats with the same JSON contracts as server.py, on
+Quart with SQLAlchemy's asyncio engine (asyncpg on PostgreSQL, aiosqlite for
+local SQLite). A request waiting on the database holds neither a thread nor
+a connection it is not using, and independent aggregate queries run
+concurrently on connections from the one shared pool.
+
+Models, validation, query builders and caches come from server.py, which
+keeps serving everything else (dashboard, exports, CLI). Its background
+workers run here too, as threads on the synchronous engine.
+
+Run with:  hypercorn async_server:app --bind 0.0.0.0:5000
+"""
+import os
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from quart import Quart, request, jsonify, g, Response, has_request_context
+from sqlalchemy import select, func, distinct, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+import server
+from server import (CellData, CellDataRollup, StatsRollupState, Token, User, UserLatestState,
+                    DeviceLatestState, HyperLogLog, PasswordHasherBusy, PERIOD_MAPPING, as_utc, log, log_extra)
+
+app = Quart(__name__)
+config = server.app.config
+
+def route_label():
+    """The Quart counterpart of server.metrics_route_label, so per-route log levels apply here too."""
+    if not has_request_context():
+        return 'background'
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+server.log_route_filter.route_label = route_label
+
+# --- Async Database Engine ---
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'postgres': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+def async_database_url(url):
+    """Maps DATABASE_URL onto the asyncio driver for the same database."""
+    url = make_url(url)
+    backend = url.drivername.split('+', 1)[0]
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"❌ No asyncio driver known for '{backend}'. Set ASYNC_DATABASE_URL explicitly.")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+engine_url = make_url(config['ASYNC_DATABASE_URL'] or async_database_url(config['SQLALCHEMY_DATABASE_URI']))
+engine_options = {}
+if engine_url.get_backend_name() != 'sqlite':  # aiosqlite opens a connection per checkout
+    engine_options = {'pool_size': config['ASYNC_POOL_SIZE'], 'max_overflow': config['ASYNC_MAX_OVERFLOW'],
+                      'pool_timeout': 30, 'pool_recycle': 1800}
+engine = create_async_engine(engine_url, **engine_options)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+IS_POSTGRESQL = engine.dialect.name == 'postgresql'
+ROLLUP_UPSERT = server.upsert_increment_statement(CellDataRollup.__table__, engine.dialect.name,
+                                                  server.ROLLUP_KEY_COLUMNS, server.ROLLUP_SUM_COLUMNS)
+LATEST_STATE_UPSERTS = {table: server.latest_state_upsert_statement(table, engine.dialect.name)
+                        for table in (UserLatestState.__table__, DeviceLatestState.__table__)}
+
+# Each helper checks out its own connection, so statements passed to
+# asyncio.gather() run concurrently rather than queueing on one connection.
+async def fetch_all(statement):
+    async with Session() as session:
+        return (await session.execute(statement)).all()
+
+async def fetch_scalars(statement):
+    async with Session() as session:
+        return (await session.execute(statement)).scalars().all()
+
+async def fetch_scalar(statement):
+    async with Session() as session:
+        return (await session.execute(statement)).scalar()
+
+# --- Stats Response Cache ---
+class AsyncSingleFlightCache:
+    """asyncio counterpart of server.SingleFlightCache.
+
+    Concurrent misses for the same key await the first caller's computation,
+    which is shielded so a client disconnecting does not cancel it for others.
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._values = {}
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    async def get_or_compute(self, key, compute):
+        entry = self._values.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.ensure_future(self._compute(key, compute))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    async def _compute(self, key, compute):
+        try:
+            value = await compute()
+            self._values[key] = (time.monotonic() + self.ttl_seconds, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+stats_cache = AsyncSingleFlightCache(config['STATS_CACHE_TTL'])
+
+# --- Identity ---
+# Shares server.py's per-process identity caches and their TTL semantics.
+async def lookup_token(token_value):
+    """Returns a CachedToken for the token string, or None if it does not exist."""
+    cached = server.token_cache.get(token_value)
+    if cached is None:
+        rows = await fetch_all(server.token_lookup_statement(token_value))
+        if not rows:
+            return None
+        cached = server.cache_token_row(token_value, rows[0])
+    return cached
+
+async def lookup_user_by_email(email):
+    """Returns a CachedUser for the email, or None if no such user exists."""
+    cached = server.user_email_cache.get(email)
+    if cached is None:
+        rows = await fetch_all(select(User.id, User.name, User.email).where(User.email == email).limit(1))
+        if not rows:
+            return None
+        cached = server.CachedUser(*rows[0])
+        server.user_email_cache.set(email, cached)
+    return cached
+
+def bearer_token():
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header.split(' ')[1]
+    return None
+
+def token_required(f):
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        token = bearer_token()
+        if not token:
+            return jsonify({'status': 'error', 'message': 'Authentication token is missing!'}), 401
+        try:
+            token_record = await lookup_token(token)
+        except Exception as e:
+            log.error("Error validating token", extra=log_extra(error=str(e)))
+            return jsonify({'status': 'error', 'message': 'Token authentication failed'}), 401
+        if not server.is_cached_token_valid(token_record):
+            return jsonify({'status': 'error', 'message': 'Invalid or expired token!'}), 401
+        g.current_user_id = token_record.user_id
+        return await f(*args, **kwargs)
+
+    return decorated
+
+async def resolve_upload_identity():
+    """Returns (user_id, email) for the optional Bearer token, or the guest identity."""
+    token = bearer_token()
+    if token:
+        token_record = await lookup_token(token)
+        if server.is_cached_token_valid(token_record):
+            return str(token_record.user_id), token_record.email
+    return "guest", "guest@example.com"
+
+async def enforce_token_cap(session, user_id):
+    statement = server.surplus_tokens_statement(user_id)
+    if statement is None:
+        return 0
+    return server.revoke_surplus_tokens((await session.execute(statement)).scalars().all())
+
+def password_hasher_busy_response():
+    response = jsonify({'status': 'error', 'message': 'Authentication is busy, retry shortly.'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def encode_response(payload, encoding, status=200):
+    if encoding == 'json':
+        return jsonify(payload), status
+    body, mimetype, headers = server.encode_payload(payload, encoding)
+    return Response(body, status=status, mimetype=mimetype, headers=headers)
+
+# --- Stats ---
+async def rollup_covered_from():
+    covered_from = await fetch_scalar(
+        select(StatsRollupState.covered_from).where(StatsRollupState.name == server.ROLLUP_STATE_NAME))
+    return as_utc(covered_from) if covered_from is not None else None
+
+async def latest_state_ready():
+    coverage = server.latest_state_coverage
+    if not coverage.ready:
+        coverage.ready = await fetch_scalar(
+            select(StatsRollupState.name).where(StatsRollupState.name == coverage.name)) is not None
+    return coverage.ready
+
+async def period_stats(start_dt, end_dt):
+    """calculate_stats_for_period on the async engine, with the per-source aggregates run concurrently."""
+    raw_ranges, rollup_range = server.split_stats_window(start_dt, end_dt, await rollup_covered_from())
+    statements = server.period_aggregate_statements(raw_ranges, rollup_range, IS_POSTGRESQL)
+    aggregates = server.fold_period_aggregates(
+        await asyncio.gather(*(fetch_all(statement) for statement in statements)), IS_POSTGRESQL)
+    latest_data_per_user = []
+    if aggregates['user']:
+        if server.window_ends_now(end_dt) and await latest_state_ready():
+            latest_data_query = server.latest_state_statement(list(aggregates['user']), start_dt)
+        else:
+            latest_data_query = server.latest_rows_per_user_statement(
+                start_dt, end_dt, raw_ranges, rollup_range, aggregates['user'], IS_POSTGRESQL)
+        latest_rows = await fetch_scalars(latest_data_query)
+        latest_data_per_user = [data.to_dict() for data in latest_rows]
+    return server.summarize_period_stats(aggregates, latest_data_per_user)
+
+async def sketches_cover_all_data():
+    covered_from, oldest_upload = await asyncio.gather(
+        fetch_scalar(select(StatsRollupState.covered_from).where(StatsRollupState.name == server.SKETCH_STATE_NAME)),
+        fetch_scalar(select(func.min(CellData.upload_time))))
+    if covered_from is None:
+        return False
+    return oldest_upload is None or as_utc(oldest_upload) >= as_utc(covered_from)
+
+async def estimate_total(dimension):
+    sketches = server.distinct_sketches
+    today = server.floor_day(datetime.now(timezone.utc))
+    today_registers = fetch_scalars(server.today_sketch_statement(dimension, today))
+    closed = sketches.closed_days(dimension, today)
+    if closed is None:
+        closed_registers, today_registers = await asyncio.gather(
+            fetch_scalars(server.closed_sketch_days_statement(dimension, today)), today_registers)
+        closed = sketches.cache_closed_days(dimension, today, closed_registers)
+    else:
+        today_registers = await today_registers
+    return sketches.combine(closed, today_registers)
+
+async def unique_totals(exact):
+    """Returns (users, devices, unique_counts) as build_web_stats reports them."""
+    if not exact and await sketches_cover_all_data():
+        users, devices = await asyncio.gather(estimate_total('users'), estimate_total('devices'))
+        return users, devices, {'method': 'hyperloglog', 'relative_error': round(HyperLogLog.RELATIVE_ERROR, 4)}
+    if await latest_state_ready():
+        users, devices = await asyncio.gather(fetch_scalar(select(func.count(UserLatestState.user_id))),
+                                              fetch_scalar(select(func.count(DeviceLatestState.user_mac))))
+        return users or 0, devices or 0, {'method': 'exact', 'relative_error': 0}
+    users, devices = await asyncio.gather(
+        fetch_scalar(select(func.count(distinct(CellData.user_id)))),
+        fetch_scalar(select(func.count(distinct(CellData.user_mac)))))
+    return users or 0, devices or 0, {'method': 'exact', 'relative_error': 0}
+
+async def device_page(limit):
+    if await latest_state_ready():
+        rows, has_more = server.split_page(await fetch_all(server.device_state_page_statement(limit)), limit)
+        return server.format_device_page(rows, has_more, {row.user_mac: row.user_ip for row in rows})
+    rows, has_more = server.split_page(await fetch_all(server.device_page_statement(limit)), limit)
+    last_ips = dict(await fetch_all(server.device_last_ip_statement(rows))) if rows else {}
+    return server.format_device_page(rows, has_more, last_ips)
+
+async def build_web_stats(time_period, exact=False):
+    """server.build_web_stats with the period, unique-count and device queries run concurrently."""
+    time_delta = PERIOD_MAPPING.get(time_period, timedelta(hours=1))
+    end_dt = datetime.now(timezone.utc)
+    start_dt = end_dt - time_delta
+    stats, (total_unique_users, total_unique_devices, unique_counts), (all_devices, all_devices_next_cursor) = \
+        await asyncio.gather(period_stats(start_dt, end_dt), unique_totals(exact),
+                             device_page(config['STATS_DEVICE_LIMIT']))
+    return {
+        **stats, 'total_unique_users': total_unique_users,
+        'total_unique_devices': total_unique_devices,
+        'unique_counts': unique_counts,
+        'all_devices': all_devices,
+        'all_devices_next_cursor': all_devices_next_cursor,
+        'stats_time_utc': datetime.now(timezone.utc).isoformat(),
+        'data_window': time_period
+    }
+
+def iter_streamed_points(loop, statement):
+    """Yields signal points from an async server-side cursor, for use from a worker thread.
+
+    Each chunk is fetched on the event loop, so only SERIES_CHUNK_SIZE rows
+    are held at a time and the synchronous downsamplers can re-run the query
+    for every pass they make.
+    """
+    def wait(coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    async def open_stream():
+        conn = await engine.connect()
+        try:
+            return conn, await conn.stream(statement.execution_options(yield_per=server.SERIES_CHUNK_SIZE))
+        except BaseException:
+            await conn.close()
+            raise
+
+    async def close_stream(conn, result):
+        try:
+            await result.close()
+        finally:
+            await conn.close()
+
+    conn, result = wait(open_stream())
+    try:
+        while True:
+            rows = wait(result.fetchmany(server.SERIES_CHUNK_SIZE))
+            if not rows:
+                return
+            for row in rows:
+                yield server.signal_point(row)
+    finally:
+        wait(close_stream(conn, result))
+
+async def sampled_series(criteria, mode, factor, start_ms, end_ms, limit):
+    """Streams a user's series from a server-side cursor and downsamples it.
+
+    Stride sampling is applied while streaming. minmax and LTTB run in a
+    worker thread over iter_streamed_points, re-reading the cursor for each
+    pass rather than collecting the series first.
+    """
+    statement = select(*server.SIGNAL_SERIES_COLUMNS).where(*criteria).order_by(CellData.upload_time)
+    if factor == 1 or mode == 'stride':
+        points = []
+        async with engine.connect() as conn:
+            result = await conn.stream(statement.execution_options(yield_per=server.SERIES_CHUNK_SIZE))
+            index = 0
+            async for row in result:
+                if index % factor == 0:
+                    points.append(server.signal_point(row))
+                index += 1
+        return points
+    loop = asyncio.get_running_loop()
+    return await asyncio.to_thread(server.downsample_series, lambda: iter_streamed_points(loop, statement),
+                                   mode, factor, start_ms, end_ms, limit)
+
+# --- Request Metrics ---
+if config['METRICS_ENABLED']:
+    @app.before_request
+    async def start_request_metrics():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    async def record_request_metrics(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            server.request_latency.observe(time.perf_counter() - started, route, request.method,
+                                           str(response.status_code))
+        return response
+
+# --- Lifecycle ---
+@app.before_serving
+async def start_background_workers():
+    server.start_background_workers()
+
+@app.after_serving
+async def dispose_engine():
+    await engine.dispose()
+
+# --- Routes ---
+@app.route('/register', methods=['POST'])
+async def register_user():
+    data = await request.get_json()
+    if not data:
+        return jsonify({'status': 'error', 'message': 'No JSON data received'}), 400
+
+    name = data.get('name')
+    email = data.get('email')
+    password = data.get('password')
+
+    if not name or not email or not password:
+        return jsonify({'status': 'error', 'message': 'Missing required fields: name, email, and password'}), 400
+
+    if await fetch_all(select(User.id).where(User.email == email).limit(1)):
+        return jsonify({'status': 'error', 'message': 'User with this email already exists'}), 400
+
+    try:
+        password_hash = await server.password_hasher.hash_async(password)
+        async with Session() as session:
+            new_user = User(name=name, email=email, password_hash=password_hash)
+            session.add(new_user)
+            await session.commit()
+        log.info("User registered", extra=log_extra(user_id=new_user.id, email=new_user.email))
+        return jsonify({'status': 'success', 'message': 'Registration successful', 'user_id': new_user.id}), 201
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
+    except Exception as e:
+        log.exception("Error during registration")
+        return jsonify({'status': 'error', 'message': 'Internal server error during registration.'}), 500
+
+@app.route("/login", methods=["POST"])
+async def login_user():
+    try:
+        data = await request.get_json()
+        email = data.get("email")
+        password = data.get("password")
+
+        if not email or not password:
+            return jsonify({"success": False, "message": "Missing email or password"}), 400
+
+        # No connection is held while the password is checked
+        rows = await fetch_all(select(User.id, User.name, User.password_hash).where(User.email == email).limit(1))
+        user = rows[0] if rows else None
+        if user and await server.password_hasher.verify_async(user.password_hash, password):
+            new_hash = None
+            if config['PASSWORD_REHASH_ON_LOGIN'] and await server.password_hasher.needs_rehash_async(user.password_hash):
+                new_hash = await server.password_hasher.hash_async(password)
+            async with Session() as session:
+                if new_hash is not None:
+                    await session.execute(update(User).where(User.id == user.id).values(password_hash=new_hash))
+                    log.info("Rehashed password", extra=log_extra(user_id=user.id))
+                new_token = Token.generate_token(user.id)
+                session.add(new_token)
+                await session.flush()
+                await enforce_token_cap(session, user.id)
+                await session.commit()
+
+            return jsonify({
+                "success": True,
+                "message": "Login successful",
+                "name": user.name,
+                "id": str(user.id),
+                "token": new_token.token,
+                "expires_at": new_token.expires_at.isoformat()
+            }), 200
+        else:
+            return jsonify({"success": False, "message": "Invalid credentials"}), 401
+
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
+    except Exception as e:
+        log.exception("Login error")
+        return jsonify({"success": False, "message": "Internal server error"}), 500
+
+@app.route("/logout", methods=["POST"])
+@token_required
+async def logout():
+    try:
+        token = bearer_token()
+        async with Session() as session:
+            token_record = (await session.execute(select(Token).where(Token.token == token))).scalars().first()
+            token_record.revoke()
+            await session.commit()
+        server.token_cache.invalidate(token)
+
+        return jsonify({"success": True, "message": "Logged out successfully"}), 200
+    except Exception as e:
+        log.exception("Logout error")
+        return jsonify({"success": False, "message": "Error during logout"}), 500
+
+@app.route('/refresh-token', methods=['POST'])
+@token_required
+async def refresh_token():
+    try:
+        old_token = bearer_token()
+        async with Session() as session:
+            new_token = Token.generate_token(g.current_user_id)
+            session.add(new_token)
+            token_record = (await session.execute(select(Token).where(Token.token == old_token))).scalars().first()
+            token_record.revoke()
+            await session.commit()
+        server.token_cache.invalidate(old_token)
+
+        return jsonify({
+            "success": True,
+            "message": "Token refreshed successfully",
+            "token": new_token.token,
+            "expires_at": new_token.expires_at.isoformat()
+        }), 200
+    except Exception as e:
+        log.exception("Token refresh error")
+        return jsonify({"success": False, "message": "Error refreshing token"}), 500
+
+@app.route('/validate-token', methods=['GET'])
+@token_required
+async def validate_token():
+    user_id = g.current_user_id
+    async with Session() as session:
+        user = await session.get(User, user_id)
+
+    return jsonify({
+        "success": True,
+        "message": "Token is valid",
+        "user_id": str(user_id),
+        "email": user.email,
+        "name": user.name
+    }), 200
+
+def duplicate_upload_response():
+    return jsonify({'status': 'success', 'message': 'Duplicate measurement, already stored', 'duplicate': True}), 200
+
+@app.route('/upload', methods=['POST'])
+async def receive_cell_data():
+    data = await request.get_json()
+    if not data:
+        return jsonify({'status': 'error', 'message': 'No JSON data received'}), 400
+    log.debug("Upload received", extra=log_extra(sampled=True, payload=data))
+
+    validation_error = server.validate_measurement(data)
+    if validation_error:
+        return jsonify({'status': 'error', 'message': validation_error}), 400
+
+    user_id, email = await resolve_upload_identity()
+    row = server.build_cell_data_row(data, user_id, email)
+    key = server.upload_key(row)
+    if server.recent_upload_keys.seen(key):
+        server.duplicate_uploads.inc(1, 'recent')
+        return duplicate_upload_response()
+
+    if config['INGEST_MODE'] == 'write_behind':
+        enqueue = server.ingest_queue.enqueue
+        # An fsync per upload would stall the event loop, so it runs on a thread
+        accepted = await asyncio.to_thread(enqueue, row) if config['INGEST_SPOOL_FSYNC'] else enqueue(row)
+        if not accepted:
+            response = jsonify({'status': 'error', 'message': 'Ingest queue is full, retry shortly.'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        server.recent_upload_keys.add([key])
+        return jsonify({'status': 'success', 'message': 'Data accepted for storage', 'duplicate': False}), 202
+
+    try:
+        async with Session() as session:
+            claimed = await session.execute(server.upload_key_claim_statement({key: row}, engine.dialect.name))
+            if claimed.scalar() is None:
+                server.duplicate_uploads.inc(1, 'database')
+                server.recent_upload_keys.add([key])
+                return duplicate_upload_response()
+            new_data = CellData(**row)
+            session.add(new_data)
+            await session.flush()
+            await session.execute(ROLLUP_UPSERT, server.rollup_buckets([row]))
+            for table, states in server.latest_state_batches([dict(row, id=new_data.id)]):
+                await session.execute(LATEST_STATE_UPSERTS[table], states)
+            await session.run_sync(lambda sync_session: server.record_distinct_sketches([row], sync_session))
+            await session.run_sync(lambda sync_session: server.record_quality_sketches([row], sync_session))
+            await session.commit()
+        server.recent_upload_keys.add([key])
+        server.on_cell_rows_committed([row])
+        log.info("Upload stored", extra=log_extra(sampled=True, id=new_data.id, email=email, brand=new_data.device_brand))
+        return jsonify({'status': 'success', 'message': 'Data received and stored', 'duplicate': False}), 201
+
+    except Exception as e:
+        log.exception("Error storing upload", extra=log_extra(email=email))
+        return jsonify({'status': 'error', 'message': 'Internal server error during data storage.'}), 500
+
+@app.route('/api/stats')
+async def get_web_stats():
+    """Provides statistics for the web dashboard based on relative time periods."""
+    try:
+        time_period = request.args.get('period', '1h')
+        exact = request.args.get('exact', 'false').lower() == 'true'
+        period_key = time_period if time_period in PERIOD_MAPPING else '1h'
+        full_stats = await stats_cache.get_or_compute((period_key, exact), lambda: build_web_stats(period_key, exact))
+        if full_stats['data_window'] != time_period:
+            full_stats = {**full_stats, 'data_window': time_period}
+        return jsonify(full_stats), 200
+    except Exception as e:
+        log.exception("Error generating stats")
+        return jsonify({'status': 'error', 'message': "An internal error occurred while generating statistics."}), 500
+
+@app.route('/api/user-stats', methods=['GET'])
+async def get_user_stats():
+    """Provides statistics for a specific user based on a date range, as server.get_user_stats does."""
+    try:
+        options = server.user_stats_options(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    email = options['email']
+    user = await lookup_user_by_email(email)
+    if not user:
+        return jsonify({'status': 'error', 'message': f"No user found with email: {email}"}), 404
+
+    try:
+        start_dt, end_dt = server.user_stats_window(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    try:
+        criteria = server.user_series_criteria(str(user.id), start_dt, end_dt)
+        total_data_points, network_rows, averages = await asyncio.gather(
+            fetch_scalar(select(func.count(CellData.id)).where(*criteria)),
+            fetch_all(select(CellData.network_type, func.count(CellData.id).label('count'))
+                      .where(*criteria).group_by(CellData.network_type)),
+            fetch_all(select(func.avg(CellData.signal_dbm).label('avg_signal'),
+                             func.avg(CellData.snr_db).label('avg_snr')).where(*criteria)))
+
+        if total_data_points == 0:
+            return encode_response(server.empty_user_stats_payload(options['format']), options['encoding'])
+
+        limit = options['limit']
+        downsample_factor = max(1, (total_data_points // limit)) if limit > 0 else 1
+        start_ms = int(start_dt.timestamp() * 1000)
+        end_ms = int(end_dt.timestamp() * 1000)
+        sampled_points = await sampled_series(criteria, options['downsample'], downsample_factor,
+                                              start_ms, end_ms, limit)
+
+        return encode_response(server.user_stats_payload(options, sampled_points, total_data_points,
+                                                         downsample_factor, network_rows, averages[0],
+                                                         start_dt, end_dt), options['encoding'])
+
+    except Exception as e:
+        log.exception("Error generating user stats")
+        return jsonify({'status': 'error', 'message': f"An error occurred while fetching statistics: {str(e)}"}), 500
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    return Response(server.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# --- Main Execution ---
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', '5000'))
+    print(f"Async database URL: {engine.url.render_as_string(hide_password=True)}")
+    print(f"Starting async server - Listening on http://0.0.0.0:{port}")
+    print("For production use: hypercorn async_server:app --bind 0.0.0.0:5000")
+    app.run(host='0.0.0.0', port=port)
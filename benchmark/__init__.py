@@ -0,0 +1,11 @@
+"""Reproducible load and benchmark suite for the Network Cell Analyzer server.
+
+    python -m benchmark generate --database-url sqlite:///bench.db --rows 1000000
+    python -m benchmark run --database-url sqlite:///bench.db --concurrency 8
+    python -m benchmark compare benchmark/results/before.json benchmark/results/after.json
+
+`generate` fills a dedicated database with synthetic measurements, `run`
+drives the endpoints (in-process through the Flask app, or over HTTP with
+--base-url) and writes p50/p95/p99 latency and throughput to a JSON file,
+and `compare` diffs two result files.
+"""
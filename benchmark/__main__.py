@@ -0,0 +1,156 @@
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import click
+
+from benchmark.datagen import bench_email, generate_cell_data
+from benchmark.driver import HttpTarget, InProcessTarget, build_scenarios, login, run_scenario
+
+DEFAULT_PERIODS = ['1m', '5m', '15m', '30m', '1h', '6h', '12h', '24h', '7d', '30d']
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def load_server(database_url):
+    """Imports the server module against database_url (or DATABASE_URL from the environment/.env)."""
+    if database_url:
+        os.environ['DATABASE_URL'] = database_url
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    with contextlib.redirect_stdout(sys.stderr):
+        import server
+    return server
+
+def git_revision():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+@click.group()
+def cli():
+    """Generate synthetic data, drive the server and compare results."""
+
+@cli.command()
+@click.option('--database-url', help='Database to fill (defaults to DATABASE_URL). Use a dedicated one.')
+@click.option('--rows', default=100000, show_default=True, help='Measurements to insert.')
+@click.option('--users', default=200, show_default=True, help='Synthetic users.')
+@click.option('--devices-per-user', default=2, show_default=True, help='MAC addresses per user.')
+@click.option('--cells', default=500, show_default=True, help='Distinct cell ids.')
+@click.option('--days', default=30, show_default=True, help='Rows are spread over this many days up to now.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows per bulk insert/transaction.')
+@click.option('--seed', default=42, show_default=True, help='Random seed; the same seed gives the same rows.')
+def generate(database_url, rows, users, devices_per_user, cells, days, chunk_size, seed):
+    """Fills cell_data with synthetic measurements and rebuilds rollups and sketches."""
+    server = load_server(database_url)
+    with server.app.app_context():
+        inserted = generate_cell_data(server, rows, users, devices_per_user, days, cells, chunk_size, seed,
+                                      progress=lambda message: click.echo(message, err=True))
+    click.echo(f"✅ Inserted {inserted} rows for {users} users over {days} days")
+
+@cli.command()
+@click.option('--database-url', help='Database for the in-process target (defaults to DATABASE_URL).')
+@click.option('--base-url', help='Benchmark a running server over HTTP instead of in-process.')
+@click.option('--concurrency', default=8, show_default=True, help='Concurrent clients per scenario.')
+@click.option('--requests', 'requests_total', default=200, show_default=True, help='Measured requests per scenario.')
+@click.option('--warmup', default=20, show_default=True, help='Unmeasured requests per scenario.')
+@click.option('--scenarios', default='', help='Comma-separated scenario names or prefixes (e.g. "upload,stats").')
+@click.option('--periods', default=','.join(DEFAULT_PERIODS), show_default=True, help='Periods for the stats scenarios.')
+@click.option('--users', default=200, show_default=True, help='Synthetic users to spread requests over.')
+@click.option('--logins', default=10, show_default=True, help='Users to log in as for authenticated requests.')
+@click.option('--cold', is_flag=True, help='Disable the /api/stats response cache (in-process only).')
+@click.option('--seed', default=42, show_default=True, help='Random seed for request parameters.')
+@click.option('--label', default='', help='Free-form label stored with the results.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Results file (default: benchmark/results/<time>-<commit>.json).')
+def run(database_url, base_url, concurrency, requests_total, warmup, scenarios, periods, users, logins,
+        cold, seed, label, output):
+    """Drives the endpoints and reports p50/p95/p99 latency and throughput."""
+    server = None
+    if base_url:
+        target = HttpTarget(base_url)
+    else:
+        server = load_server(database_url)
+        target = InProcessTarget(server.app)
+        if cold:
+            server.stats_cache.ttl_seconds = 0
+
+    commit, dirty = git_revision()
+    meta = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'commit': commit,
+        'dirty': dirty,
+        'label': label,
+        'target': base_url or 'in-process',
+        'concurrency': concurrency,
+        'requests_per_scenario': requests_total,
+        'warmup': warmup,
+        'cold_stats_cache': cold,
+        'seed': seed,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+    if server is not None:
+        with server.app.app_context():
+            meta['database'] = server.db.engine.dialect.name
+            meta['cell_data_rows'] = server.db.session.query(server.func.count(server.CellData.id)).scalar()
+
+    tokens = [login(target, bench_email(index)) for index in range(min(logins, users))]
+    selected = build_scenarios(periods.split(','), users, tokens, seed)
+    if scenarios:
+        prefixes = [name.strip() for name in scenarios.split(',') if name.strip()]
+        selected = {name: make for name, make in selected.items() if any(name.startswith(prefix) for prefix in prefixes)}
+
+    results = {}
+    for name, make_request in selected.items():
+        # Server-side print() noise goes to /dev/null while measuring in-process
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            if warmup:
+                run_scenario(target, make_request, warmup, concurrency, seed)
+            results[name] = run_scenario(target, make_request, requests_total, concurrency, seed)
+        latency = results[name]['latency_ms']
+        click.echo(f"{name:<20} p50={latency['p50']:>9.2f}ms p95={latency['p95']:>9.2f}ms "
+                   f"p99={latency['p99']:>9.2f}ms {results[name]['throughput_rps']:>8.1f} req/s "
+                   f"errors={results[name]['errors']}")
+
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{commit or 'nogit'}{'-dirty' if dirty else ''}.json")
+    with open(output, 'w') as f:
+        json.dump({'meta': meta, 'scenarios': results}, f, indent=2)
+    click.echo(f"✅ Results written to {output}")
+
+def _change(before, after):
+    if before in (None, 0) or after is None:
+        return '    n/a'
+    return f'{(after - before) / before * 100:+7.1f}%'
+
+@cli.command()
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('candidate', type=click.Path(exists=True, dir_okay=False))
+def compare(baseline, candidate):
+    """Shows latency and throughput changes from BASELINE to CANDIDATE results."""
+    with open(baseline) as f:
+        before = json.load(f)
+    with open(candidate) as f:
+        after = json.load(f)
+    click.echo(f"baseline:  {before['meta'].get('commit')} {before['meta'].get('label', '')}")
+    click.echo(f"candidate: {after['meta'].get('commit')} {after['meta'].get('label', '')}")
+    click.echo(f"{'scenario':<20} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>9}")
+    for name, old in before['scenarios'].items():
+        new = after['scenarios'].get(name)
+        if new is None:
+            continue
+        changes = [_change(old['latency_ms'][key], new['latency_ms'][key]) for key in ('p50', 'p95', 'p99')]
+        changes.append(_change(old['throughput_rps'], new['throughput_rps']))
+        click.echo(f"{name:<20} " + ' '.join(f'{change:>9}' for change in changes))
+
+if __name__ == '__main__':
+    cli()
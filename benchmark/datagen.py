@@ -0,0 +1,128 @@
+"""Synthetic cell_data generator.
+
+Rows are spread over users, devices, operators and network types with
+realistic signal/SNR ranges, and written with the server's own bulk insert
+path. Derived tables (rollups and distinct-count sketches) are rebuilt
+afterwards so the stats endpoints behave as they would in production.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+BENCH_EMAIL_DOMAIN = 'bench.local'
+BENCH_PASSWORD = 'benchmark-password'
+
+OPERATORS = [('Alfa', 0.5), ('Touch', 0.45), ('Unknown', 0.05)]
+NETWORK_TYPES = [('LTE', 0.55), ('5G', 0.15), ('3G', 0.2), ('2G', 0.1)]
+DEVICE_BRANDS = ['Samsung', 'Xiaomi', 'Apple', 'Huawei', 'Oppo', 'Google']
+# (signal dBm range, SNR dB range, frequency bands) per network type
+NETWORK_PROFILES = {
+    'LTE': ((-120, -70), (-5, 25), ['B3 1800MHz', 'B7 2600MHz', 'B20 800MHz']),
+    '5G': ((-115, -65), (0, 30), ['n78 3500MHz']),
+    '3G': ((-110, -60), (-10, 15), ['B1 2100MHz']),
+    '2G': ((-105, -55), (-5, 10), ['GSM 900MHz']),
+}
+
+def bench_email(index):
+    return f'user{index}@{BENCH_EMAIL_DOMAIN}'
+
+def _weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+def ensure_bench_users(server, users):
+    """Creates the synthetic users (all sharing BENCH_PASSWORD) and returns their ids in order."""
+    db, User = server.db, server.User
+    existing = {user.email: user.id for user in User.query.filter(User.email.like(f'%@{BENCH_EMAIL_DOMAIN}'))}
+    password_hash = server.generate_password_hash(BENCH_PASSWORD)
+    for index in range(users):
+        email = bench_email(index)
+        if email not in existing:
+            db.session.add(User(name=f'Bench User {index}', email=email, password_hash=password_hash))
+    db.session.commit()
+    existing = {user.email: user.id for user in User.query.filter(User.email.like(f'%@{BENCH_EMAIL_DOMAIN}'))}
+    return [existing[bench_email(index)] for index in range(users)]
+
+def make_devices(rng, user_ids, devices_per_user):
+    """Returns (user_id, email, mac, brand, ip) for every synthetic device."""
+    devices = []
+    for index, user_id in enumerate(user_ids):
+        for _ in range(devices_per_user):
+            mac = ':'.join(f'{rng.randrange(256):02X}' for _ in range(6))
+            ip = f'10.0.{rng.randrange(256)}.{rng.randrange(1, 255)}'
+            devices.append((user_id, bench_email(index), mac, rng.choice(DEVICE_BRANDS), ip))
+    return devices
+
+def make_row(rng, device, upload_time, cells):
+    user_id, email, mac, brand, ip = device
+    network_type = _weighted(rng, NETWORK_TYPES)
+    (signal_low, signal_high), (snr_low, snr_high), bands = NETWORK_PROFILES[network_type]
+    signal = rng.randint(signal_low, signal_high)
+    snr = round(rng.uniform(snr_low, snr_high), 1)
+    return {
+        'user_id': str(user_id),
+        'email': email,
+        'operator': _weighted(rng, OPERATORS),
+        'signal_power': f'{signal} dBm',
+        'snr': f'{snr} dB',
+        'signal_dbm': float(signal),
+        'snr_db': snr,
+        'network_type': network_type,
+        'frequency_band': rng.choice(bands),
+        'cell_id': str(rng.choice(cells)),
+        'client_timestamp': upload_time.strftime('%Y-%m-%d %H:%M:%S'),
+        'user_ip': ip,
+        'user_mac': mac,
+        'device_brand': brand,
+        'upload_time': upload_time,
+    }
+
+def generate_cell_data(server, rows, users, devices_per_user=2, days=30, cells=500,
+                       chunk_size=1000, seed=42, progress=print):
+    """Inserts `rows` synthetic measurements spread over the last `days` days.
+
+    The same seed always produces the same rows. Returns the number inserted.
+    """
+    db = server.db
+    rng = random.Random(seed)
+    db.create_all()
+    user_ids = ensure_bench_users(server, users)
+    devices = make_devices(rng, user_ids, devices_per_user)
+    cell_ids = [rng.randrange(10000, 99999) for _ in range(cells)]
+
+    end = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    span_seconds = (end - start).total_seconds()
+
+    inserted = 0
+    while inserted < rows:
+        count = min(chunk_size, rows - inserted)
+        chunk = []
+        for _ in range(count):
+            upload_time = start + timedelta(seconds=rng.random() * span_seconds)
+            chunk.append(make_row(rng, rng.choice(devices), upload_time, cell_ids))
+        server.bulk_insert_cell_data(chunk)
+        db.session.commit()
+        inserted += count
+        if progress and (inserted // chunk_size) % 100 == 0:
+            progress(f'{inserted}/{rows} rows inserted')
+
+    rebuild_derived_tables(server, start)
+    return inserted
+
+def rebuild_derived_tables(server, since):
+    """Recomputes rollups, sketches, quality sketches and latest state from scratch, since rows were written straight to cell_data."""
+    db = server.db
+    db.session.query(server.CellDataRollup).delete(synchronize_session=False)
+    db.session.query(server.DistinctSketch).delete(synchronize_session=False)
+    db.session.query(server.QualitySketch).delete(synchronize_session=False)
+    db.session.query(server.UserLatestState).delete(synchronize_session=False)
+    db.session.query(server.DeviceLatestState).delete(synchronize_session=False)
+    db.session.query(server.StatsRollupState).delete(synchronize_session=False)
+    db.session.commit()
+    server.ensure_rollup_state()
+    server.ensure_sketch_state()
+    server.ensure_quality_sketch_state()
+    server.rebuild_rollups(since, timedelta(hours=6))
+    server.rebuild_sketches(since)
+    server.rebuild_quality_sketches(since)
+    server.rebuild_latest_state()
@@ -0,0 +1,164 @@
+"""Load driver: runs each scenario at a fixed concurrency and summarises latency.
+
+Scenarios run one after another so every endpoint's numbers are measured in
+isolation. The in-process target calls the Flask app through a test client
+per thread, which measures server work without network noise; the HTTP target
+exercises a running server (gunicorn, reverse proxy and all).
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark.datagen import BENCH_PASSWORD, NETWORK_PROFILES, NETWORK_TYPES, OPERATORS, bench_email
+
+class InProcessTarget:
+    """Sends requests through the Flask app's test client, one client per thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, json=None, headers=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=json, headers=headers)
+        response.close()
+        return response.status_code, response.get_json(silent=True)
+
+class HttpTarget:
+    """Sends requests to a running server, one keep-alive session per thread."""
+
+    def __init__(self, base_url, timeout=30):
+        import requests
+        self._requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method, path, json=None, headers=None):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.request(method, self.base_url + path, json=json, headers=headers, timeout=self.timeout)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body
+
+def login(target, email):
+    status, body = target.request('POST', '/login', json={'email': email, 'password': BENCH_PASSWORD})
+    if status != 200 or not body or 'token' not in body:
+        raise RuntimeError(f"Could not log in as {email} (HTTP {status}); run `python -m benchmark generate` first")
+    return body['token']
+
+def upload_payload(rng):
+    network_type = rng.choices(*zip(*NETWORK_TYPES))[0]
+    (signal_low, signal_high), (snr_low, snr_high), bands = NETWORK_PROFILES[network_type]
+    return {
+        'operator': rng.choices(*zip(*OPERATORS))[0],
+        'signalPower': f'{rng.randint(signal_low, signal_high)} dBm',
+        'snr': f'{round(rng.uniform(snr_low, snr_high), 1)} dB',
+        'networkType': network_type,
+        'frequencyBand': rng.choice(bands),
+        'cellId': str(rng.randrange(10000, 99999)),
+        'clientTimestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'ipAddress': '10.0.0.1',
+        'macAddress': 'AA:BB:CC:DD:EE:FF',
+        'deviceBrand': 'Samsung',
+    }
+
+def build_scenarios(periods, users, tokens, seed):
+    """Returns {name: make_request(rng) -> (method, path, json, headers)}."""
+    def pick_user(rng):
+        index = rng.randrange(users)
+        return bench_email(index), tokens[index % len(tokens)]
+
+    def upload(rng):
+        _, token = pick_user(rng)
+        return 'POST', '/upload', upload_payload(rng), {'Authorization': f'Bearer {token}'}
+
+    def user_stats(rng):
+        email, token = pick_user(rng)
+        return 'GET', f'/api/user-stats?email={email}', None, {'Authorization': f'Bearer {token}'}
+
+    def server_user_stats(rng):
+        email, _ = pick_user(rng)
+        return 'GET', f'/api/server-user-stats?email={email}&period={rng.choice(periods)}', None, None
+
+    scenarios = {'upload': upload}
+    for period in periods:
+        scenarios[f'stats:{period}'] = lambda rng, period=period: ('GET', f'/api/stats?period={period}', None, None)
+    scenarios['user-stats'] = user_stats
+    scenarios['server-user-stats'] = server_user_stats
+    return scenarios
+
+def percentile(sorted_values, fraction):
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def summarise(latencies, status_counts, errors, elapsed):
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    return {
+        'requests': len(latencies_ms),
+        'errors': errors,
+        'status_counts': dict(sorted(status_counts.items())),
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies_ms) / elapsed, 2) if elapsed > 0 else None,
+        'latency_ms': {
+            'p50': _round(percentile(latencies_ms, 0.50)),
+            'p95': _round(percentile(latencies_ms, 0.95)),
+            'p99': _round(percentile(latencies_ms, 0.99)),
+            'mean': _round(sum(latencies_ms) / len(latencies_ms)) if latencies_ms else None,
+            'max': _round(latencies_ms[-1]) if latencies_ms else None,
+        },
+    }
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+def run_scenario(target, make_request, requests_total, concurrency, seed):
+    """Issues requests_total requests from `concurrency` threads and summarises them.
+
+    A request counts as an error on a transport exception or any 5xx status.
+    """
+    lock = threading.Lock()
+    latencies = []
+    status_counts = {}
+    errors = 0
+    remaining = requests_total
+
+    def worker(worker_index):
+        nonlocal errors, remaining
+        rng = random.Random(seed * 1000 + worker_index)
+        while True:
+            with lock:
+                if remaining <= 0:
+                    return
+                remaining -= 1
+            method, path, payload, headers = make_request(rng)
+            started = time.perf_counter()
+            try:
+                status, _ = target.request(method, path, json=payload, headers=headers)
+            except Exception:
+                status = None
+            latency = time.perf_counter() - started
+            with lock:
+                latencies.append(latency)
+                status_key = str(status) if status is not None else 'exception'
+                status_counts[status_key] = status_counts.get(status_key, 0) + 1
+                if status is None or status >= 500:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker, index) for index in range(concurrency)]:
+            future.result()
+    return summarise(latencies, status_counts, errors, time.perf_counter() - started)
@@ -0,0 +1,18 @@
+"""Password KDF calls run by the hashing pool's worker processes.
+
+Kept apart from server.py so forkserver/spawn workers unpickle their jobs
+by importing only this module and werkzeug, not the whole application
+(with its startup output and log listener thread).
+"""
+import time
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+def timed_kdf(function_name, *args):
+    """Runs a werkzeug KDF and reports when it started and how long it took."""
+    started_wall = time.time()
+    started = time.perf_counter()
+    function = generate_password_hash if function_name == 'generate' else check_password_hash
+    result = function(*args)
+    return started_wall, time.perf_counter() - started, result
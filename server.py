@@ -1,16 +1,63 @@
 import os
+import asyncio
+import atexit
+import base64
+import contextvars
+import csv
+import glob
+import io
+import gzip
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
+import queue
+import random
+import re
 import secrets
+import struct
+import sys
+import time
+import uuid
+from collections import OrderedDict, namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager
 from functools import wraps
-from flask import Flask, request, jsonify, render_template, g
+from logging.handlers import QueueHandler, QueueListener
+from flask import Flask, request, jsonify, render_template, g, Response, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
 from sqlalchemy.sql import text
-from sqlalchemy import desc, func, distinct, cast, Float
+from sqlalchemy import desc, func, distinct, cast, Float, inspect, select, union_all, or_, and_, literal_column, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.exc import IntegrityError, TimeoutError as SQLAlchemyTimeoutError
 from dotenv import load_dotenv
+import click
 import traceback
 import webbrowser
 import threading
-from werkzeug.security import generate_password_hash, check_password_hash
+try:
+    import fcntl
+except ImportError:  # Windows: spool files are not locked between processes
+    fcntl = None
+try:
+    import msgpack
+except ImportError:  # encoding=msgpack is unavailable
+    msgpack = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet exports are unavailable
+    pa = pq = None
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+from password_kdf import timed_kdf
 
 # --- Load Environment Variables ---
 print(f"Current Working Directory: {os.getcwd()}")
@@ -30,7 +77,7 @@ if not db_url:
 else:
     print("Successfully loaded DATABASE_URL from environment.")
     if not db_url.startswith("postgresql"):
-        print("WARN: DATABASE_URL does not appear to be a PostgreSQL URL. Features like regexp_replace might fail.")
+        print("WARN: DATABASE_URL does not appear to be a PostgreSQL URL. Bulk COPY ingest will fall back to INSERT.")
     else:
         try:
             import psycopg2
@@ -41,19 +88,608 @@ else:
 app.config['SQLALCHEMY_DATABASE_URI'] = db_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30, 'pool_recycle': 1800}
-db = SQLAlchemy(app)
+app.config['DATABASE_READ_URL'] = os.getenv('DATABASE_READ_URL', '')  # read replica for analytics; empty reads from the primary
+app.config['READ_POOL_SIZE'] = int(os.getenv('READ_POOL_SIZE', '10'))
+app.config['READ_MAX_OVERFLOW'] = int(os.getenv('READ_MAX_OVERFLOW', '10'))
+app.config['READ_REPLICA_MAX_LAG'] = float(os.getenv('READ_REPLICA_MAX_LAG', '30'))  # seconds; 0 never falls back for lag
+app.config['READ_REPLICA_CHECK_INTERVAL'] = float(os.getenv('READ_REPLICA_CHECK_INTERVAL', '5'))
+app.config['UPLOAD_BATCH_MAX_SIZE'] = int(os.getenv('UPLOAD_BATCH_MAX_SIZE', '1000'))
+app.config['IDENTITY_CACHE_SIZE'] = int(os.getenv('IDENTITY_CACHE_SIZE', '10000'))
+app.config['IDENTITY_CACHE_TTL'] = float(os.getenv('IDENTITY_CACHE_TTL', '60'))
+app.config['STATS_CACHE_TTL'] = float(os.getenv('STATS_CACHE_TTL', '5'))
+app.config['STATS_PREWARM_INTERVAL'] = float(os.getenv('STATS_PREWARM_INTERVAL', '0'))  # 0 disables prewarming
+app.config['EXPORT_CHUNK_SIZE'] = int(os.getenv('EXPORT_CHUNK_SIZE', '5000'))  # rows per fetch, CSV chunk and Parquet row group
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))  # 0 hashes in the request thread
+# Keep this well below the request threads per process: jobs over the limit get a 503, queued ones hold a thread
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.getenv('PASSWORD_HASH_MAX_PENDING', str(4 * max(1, app.config['PASSWORD_HASH_WORKERS']))))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')  # e.g. 'scrypt:65536:8:1' or 'pbkdf2:sha256:600000'
+app.config['PASSWORD_REHASH_ON_LOGIN'] = os.getenv('PASSWORD_REHASH_ON_LOGIN', 'true').lower() == 'true'
+app.config['TOKEN_SWEEP_INTERVAL'] = float(os.getenv('TOKEN_SWEEP_INTERVAL', '300'))  # 0 disables the sweeper
+app.config['TOKEN_SWEEP_BATCH_SIZE'] = int(os.getenv('TOKEN_SWEEP_BATCH_SIZE', '1000'))
+app.config['TOKEN_SWEEP_GRACE_HOURS'] = float(os.getenv('TOKEN_SWEEP_GRACE_HOURS', '24'))
+app.config['TOKEN_MAX_PER_USER'] = int(os.getenv('TOKEN_MAX_PER_USER', '0'))  # 0 means unlimited
+app.config['STATS_DEVICE_LIMIT'] = int(os.getenv('STATS_DEVICE_LIMIT', '100'))  # devices inlined in /api/stats; the rest via /api/devices
+app.config['DETECTOR_MAX_KEYS'] = int(os.getenv('DETECTOR_MAX_KEYS', '20000'))
+app.config['DETECTOR_FAST_ALPHA'] = float(os.getenv('DETECTOR_FAST_ALPHA', '0.3'))
+app.config['DETECTOR_SLOW_ALPHA'] = float(os.getenv('DETECTOR_SLOW_ALPHA', '0.02'))
+app.config['DETECTOR_MIN_DROP_DB'] = float(os.getenv('DETECTOR_MIN_DROP_DB', '6'))
+app.config['DETECTOR_SIGMA'] = float(os.getenv('DETECTOR_SIGMA', '2'))
+app.config['DETECTOR_WARMUP'] = int(os.getenv('DETECTOR_WARMUP', '20'))
+app.config['DETECTOR_SUSTAIN'] = int(os.getenv('DETECTOR_SUSTAIN', '5'))
+app.config['UPLOAD_DEDUP_CACHE_SIZE'] = int(os.getenv('UPLOAD_DEDUP_CACHE_SIZE', '100000'))  # 0 disables the in-memory pre-filter
+app.config['UPLOAD_KEY_RETENTION_HOURS'] = float(os.getenv('UPLOAD_KEY_RETENTION_HOURS', '168'))  # 0 keeps keys forever
+app.config['UPLOAD_KEY_SWEEP_INTERVAL'] = float(os.getenv('UPLOAD_KEY_SWEEP_INTERVAL', '3600'))
+app.config['SKETCH_SHARDS'] = int(os.getenv('SKETCH_SHARDS', '8'))  # rows per sketch that ingest transactions spread their writes over
+app.config['INGEST_MODE'] = os.getenv('INGEST_MODE', 'sync')  # 'sync' or 'write_behind'
+app.config['INGEST_QUEUE_MAX'] = int(os.getenv('INGEST_QUEUE_MAX', '10000'))
+app.config['INGEST_BATCH_SIZE'] = int(os.getenv('INGEST_BATCH_SIZE', '500'))
+app.config['INGEST_FLUSH_INTERVAL'] = float(os.getenv('INGEST_FLUSH_INTERVAL', '1'))
+app.config['INGEST_SPOOL_DIR'] = os.getenv('INGEST_SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool'))
+app.config['INGEST_SPOOL_FSYNC'] = os.getenv('INGEST_SPOOL_FSYNC', 'false').lower() == 'true'
+app.config['LIVE_FEED_INTERVAL'] = float(os.getenv('LIVE_FEED_INTERVAL', '5'))  # 0 disables /api/stream
+app.config['LIVE_FEED_QUIET_SECONDS'] = float(os.getenv('LIVE_FEED_QUIET_SECONDS', '300'))
+app.config['LIVE_FEED_MAX_ROWS'] = int(os.getenv('LIVE_FEED_MAX_ROWS', '200'))
+app.config['LIVE_FEED_MAX_SUBSCRIBERS'] = int(os.getenv('LIVE_FEED_MAX_SUBSCRIBERS', '32'))  # open streams per process
+app.config['CELL_DATA_PARTITIONING'] = os.getenv('CELL_DATA_PARTITIONING', 'none')  # 'none', 'daily' or 'monthly' (PostgreSQL only)
+app.config['PARTITION_PREMAKE'] = int(os.getenv('PARTITION_PREMAKE', '3'))  # partitions created ahead of the current one
+app.config['PARTITION_MAINTENANCE_INTERVAL'] = float(os.getenv('PARTITION_MAINTENANCE_INTERVAL', '3600'))
+app.config['CELL_DATA_RETENTION_DAYS'] = int(os.getenv('CELL_DATA_RETENTION_DAYS', '0'))  # 0 keeps everything
+app.config['CELL_DATA_RETENTION_ACTION'] = os.getenv('CELL_DATA_RETENTION_ACTION', 'detach')  # 'detach' or 'drop'
+app.config['ASYNC_DATABASE_URL'] = os.getenv('ASYNC_DATABASE_URL', '')  # async_server.py; derived from DATABASE_URL if empty
+app.config['ASYNC_POOL_SIZE'] = int(os.getenv('ASYNC_POOL_SIZE', '20'))
+app.config['ASYNC_MAX_OVERFLOW'] = int(os.getenv('ASYNC_MAX_OVERFLOW', '10'))
+app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'INFO')
+app.config['LOG_ROUTE_LEVELS'] = os.getenv('LOG_ROUTE_LEVELS', '')  # e.g. '/upload=WARNING,/api/stats=DEBUG'
+app.config['LOG_UPLOAD_SAMPLE_RATE'] = float(os.getenv('LOG_UPLOAD_SAMPLE_RATE', '1'))  # share of per-upload records kept
+app.config['LOG_QUEUE_SIZE'] = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+app.config['METRICS_MAX_STATEMENTS'] = int(os.getenv('METRICS_MAX_STATEMENTS', '500'))
+app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', '500'))  # 0 disables the slow statement log
+app.config['SQL_PROFILE_ENABLED'] = os.getenv('SQL_PROFILE_ENABLED', 'false').lower() == 'true'  # exposes SQL text and plans
+app.config['SLOW_QUERY_EXPLAIN'] = os.getenv('SLOW_QUERY_EXPLAIN', 'off')  # 'off', 'plan' or 'analyze' (PostgreSQL only)
+
+# --- Instrumentation ---
+# Prometheus text-format metrics for request latency, SQL statements and the
+# connection pool, exposed on /metrics. Engine events are registered on the
+# Engine class, so every engine the app creates is covered.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SQL_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\?")
+SQL_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+SQL_VALUES_LIST = re.compile(r"(\([^()]*\))(?:\s*,\s*\([^()]*\))+")
+EXPLAIN_COOLDOWN_SECONDS = 300
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(label_names, label_values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Histogram:
+    """Bucketed observations per label combination, rendered as a Prometheus histogram."""
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [count per bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, label_values, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.label_names, label_values, [("le", "+Inf")])} {series[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, label_values)} {series[-2]}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, label_values)} {series[-1]}')
+        return lines
+
+class Counter:
+    """Monotonic totals per label combination, rendered as a Prometheus counter."""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            snapshot = dict(self._values)
+        for label_values, value in sorted(snapshot.items()):
+            lines.append(f'{self.name}{_format_labels(self.label_names, label_values)} {value}')
+        return lines
+
+class Gauge:
+    """A value read from a callback at scrape time; None means "not available"."""
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            value = None
+        if value is None:
+            return []
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge', f'{self.name} {value}']
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+request_latency = metrics.register(Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request.', ('route', 'method', 'status')))
+request_query_count = metrics.register(Histogram(
+    'http_request_queries', 'SQL statements executed per request.', ('route',), QUERY_COUNT_BUCKETS))
+request_query_time = metrics.register(Histogram(
+    'http_request_query_seconds', 'Time spent in SQL statements per request.', ('route',)))
+statement_latency = metrics.register(Histogram(
+    'db_statement_duration_seconds', 'SQL statement execution time by route and statement fingerprint '
+    '(see /api/sql-profile for the statement text).', ('route', 'statement')))
+slow_statement_count = metrics.register(Counter(
+    'db_slow_statements_total', 'Statements slower than SLOW_QUERY_MS.', ('route',)))
+pool_checkout_wait = metrics.register(Histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection.'))
+pool_checkout_timeouts = metrics.register(Counter(
+    'db_pool_checkout_timeouts_total', 'Checkouts that gave up after pool_timeout.'))
+
+def metrics_route_label():
+    """The URL rule of the current request, 'unmatched' for 404s, 'background' outside requests."""
+    if not has_request_context():
+        return 'background'
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def statement_fingerprint(statement):
+    """Returns (fingerprint, normalized SQL) so statements differing only in bound values group together."""
+    normalized = SQL_PLACEHOLDER.sub('?', ' '.join(statement.split()))
+    normalized = SQL_PLACEHOLDER_LIST.sub('(?)', normalized)
+    normalized = SQL_VALUES_LIST.sub(r'\1, ...', normalized)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12], normalized
+
+class StatementProfile:
+    """Per-route totals for each statement fingerprint, plus a log of slow statements.
+
+    The number of fingerprints is capped so unusual dynamic SQL cannot grow the
+    metrics without bound; statements past the cap are counted as 'other'.
+    """
+
+    def __init__(self, max_statements, slow_log_size=100):
+        self.max_statements = max_statements
+        self._texts = {}
+        self._totals = {}  # (route, fingerprint) -> [count, total_seconds, max_seconds]
+        self._last_explained = {}
+        self.slow_log = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def record(self, route, statement, seconds):
+        fingerprint, normalized = statement_fingerprint(statement)
+        with self._lock:
+            if fingerprint not in self._texts:
+                if len(self._texts) >= self.max_statements:
+                    fingerprint, normalized = 'other', 'statements beyond METRICS_MAX_STATEMENTS'
+                self._texts.setdefault(fingerprint, normalized)
+            totals = self._totals.setdefault((route, fingerprint), [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+        statement_latency.observe(seconds, route, fingerprint)
+        return fingerprint
+
+    def should_explain(self, fingerprint):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_explained.get(fingerprint, -EXPLAIN_COOLDOWN_SECONDS) < EXPLAIN_COOLDOWN_SECONDS:
+                return False
+            self._last_explained[fingerprint] = now
+            return True
+
+    def log_slow(self, entry):
+        with self._lock:
+            self.slow_log.append(entry)
+
+    def top(self, limit=20, route=None):
+        with self._lock:
+            rows = [
+                {'route': key_route, 'statement': fingerprint, 'sql': self._texts.get(fingerprint),
+                 'count': count, 'total_ms': round(total * 1000, 3),
+                 'mean_ms': round(total * 1000 / count, 3), 'max_ms': round(maximum * 1000, 3)}
+                for (key_route, fingerprint), (count, total, maximum) in self._totals.items()
+                if route is None or key_route == route
+            ]
+        rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return rows[:limit]
+
+    def slow_statements(self):
+        with self._lock:
+            return list(self.slow_log)
+
+statement_profile = StatementProfile(app.config['METRICS_MAX_STATEMENTS'])
+
+# Slow statements are EXPLAINed by a background thread on its own connection,
+# never on the request's connection: a failed EXPLAIN there would abort the
+# request's transaction, and ANALYZE would run the slow query again in-line.
+EXPLAIN_QUEUE_SIZE = 32
+explain_queue = queue.Queue(EXPLAIN_QUEUE_SIZE)
+
+def explain_statement(engine, statement, parameters):
+    """Captures the plan of a slow SELECT in a read-only transaction that is always rolled back."""
+    analyze = 'ANALYZE, ' if app.config['SLOW_QUERY_EXPLAIN'] == 'analyze' else ''
+    with engine.connect() as conn:
+        try:
+            conn.exec_driver_sql('SET TRANSACTION READ ONLY')
+            result = conn.exec_driver_sql(f'EXPLAIN ({analyze}BUFFERS, FORMAT TEXT) {statement}', parameters)
+            return [row[0] for row in result]
+        finally:
+            conn.rollback()
+
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+def record_statement_timing(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    route = metrics_route_label()
+    fingerprint = statement_profile.record(route, statement, elapsed)
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        g.query_seconds = g.get('query_seconds', 0.0) + elapsed
+
+    threshold_ms = app.config['SLOW_QUERY_MS']
+    if threshold_ms <= 0 or elapsed * 1000 < threshold_ms:
+        return
+    slow_statement_count.inc(1, route)
+    entry = {'route': route, 'statement': fingerprint, 'duration_ms': round(elapsed * 1000, 3),
+             'sql': ' '.join(statement.split())[:2000],
+             'at': datetime.now(timezone.utc).isoformat(), 'plan': None}
+    if (app.config['SLOW_QUERY_EXPLAIN'] in ('plan', 'analyze') and conn.dialect.name == 'postgresql'
+            and not executemany and statement.lstrip().upper().startswith('SELECT')
+            and statement_profile.should_explain(fingerprint)):
+        try:
+            explain_queue.put_nowait((entry, conn.engine, statement, parameters))
+            entry['plan'] = ['EXPLAIN pending']
+        except queue.Full:
+            entry['plan'] = ['EXPLAIN skipped: too many slow statements waiting']
+    statement_profile.log_slow(entry)
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a free connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except SQLAlchemyTimeoutError:
+            pool_checkout_timeouts.inc()
+            raise
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - started)
+
+def _pool_stat(name):
+    pool = db.engine.pool
+    reader = getattr(pool, name, None)
+    return reader() if callable(reader) else None
+
+metrics.register(Gauge('db_pool_size', 'Connections the pool keeps open.', lambda: _pool_stat('size')))
+metrics.register(Gauge('db_pool_checked_out', 'Connections currently checked out.', lambda: _pool_stat('checkedout')))
+metrics.register(Gauge('db_pool_overflow', 'Connections open beyond pool_size (negative while below it).', lambda: _pool_stat('overflow')))
+
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.query_count = 0
+    g.query_seconds = 0.0
+
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = metrics_route_label()
+        request_latency.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+        request_query_count.observe(g.get('query_count', 0), route)
+        request_query_time.observe(g.get('query_seconds', 0.0), route)
+    return response
+
+if app.config['METRICS_ENABLED']:
+    event.listen(Engine, 'before_cursor_execute', start_statement_timer)
+    event.listen(Engine, 'after_cursor_execute', record_statement_timing)
+    app.before_request(start_request_metrics)
+    app.after_request(record_request_metrics)
+    if not db_url.startswith('sqlite'):  # in-memory SQLite needs its own pool class
+        app.config['SQLALCHEMY_ENGINE_OPTIONS']['poolclass'] = TimedQueuePool
+
+# --- Structured Logging ---
+# Request and background logs are JSON lines on stdout. The calling thread
+# filters and formats a record and puts it on a bounded queue; the write happens
+# on a listener thread. A record that finds the queue full is dropped and
+# counted rather than blocking the request.
+log_records_dropped = metrics.register(Counter(
+    'log_records_dropped_total', 'Log records discarded because the log queue was full.'))
+
+def parse_log_level(name):
+    level = logging.getLevelName(name.strip().upper())
+    if not isinstance(level, int):
+        raise RuntimeError(f"❌ Unknown log level '{name}'. Use DEBUG, INFO, WARNING, ERROR or CRITICAL.")
+    return level
+
+def parse_route_levels(spec):
+    """Parses 'RULE=LEVEL,...' (URL rules as in /metrics, e.g. '/upload=WARNING') into {rule: level}."""
+    levels = {}
+    for item in spec.split(','):
+        if item.strip():
+            route, _, level = item.rpartition('=')
+            levels[route.strip()] = parse_log_level(level)
+    return levels
+
+def log_extra(sampled=False, **fields):
+    """The extra= of a log call: structured fields, and sampled=True for per-upload records."""
+    return {'fields': fields, 'sampled': sampled}
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'route': getattr(record, 'route', None),
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class RouteLogFilter(logging.Filter):
+    """Applies the level configured for the current route and samples per-upload records.
+
+    route_label is replaceable so another front end (async_server.py) can
+    report its own routes.
+    """
+
+    def __init__(self, default_level, route_levels, sample_rate):
+        super().__init__()
+        self.default_level = default_level
+        self.route_levels = route_levels
+        self.sample_rate = sample_rate
+        self.route_label = metrics_route_label
+
+    def filter(self, record):
+        route = self.route_label()
+        if record.levelno < self.route_levels.get(route, self.default_level):
+            return False
+        if getattr(record, 'sampled', False) and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return False
+        record.route = route
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: a record that finds the queue full is dropped and counted."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+log = logging.getLogger('networkcellanalyzer')
+log_route_filter = RouteLogFilter(parse_log_level(app.config['LOG_LEVEL']),
+                                  parse_route_levels(app.config['LOG_ROUTE_LEVELS']),
+                                  app.config['LOG_UPLOAD_SAMPLE_RATE'])
+_log_handler = DroppingQueueHandler(queue.Queue(app.config['LOG_QUEUE_SIZE']))
+_log_handler.addFilter(log_route_filter)
+# prepare() formats on the calling thread, so the queued record is plain text
+# and holds no live arguments or traceback
+_log_handler.setFormatter(JsonLogFormatter())
+log.addHandler(_log_handler)
+log.setLevel(min([log_route_filter.default_level, *log_route_filter.route_levels.values()]))
+log.propagate = False
+log_output = logging.StreamHandler(sys.stdout)
+log_listener = QueueListener(_log_handler.queue, log_output)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# --- Read Replica ---
+# With DATABASE_READ_URL set, read-only analytics run on the 'replica' bind
+# with their own pool, so long scans never take connections from ingest.
+READ_REPLICA_BIND = 'replica'
+_reading_replica = contextvars.ContextVar('reading_replica', default=False)
+
+read_db_url = app.config['DATABASE_READ_URL']
+if read_db_url:
+    replica_options = {'url': read_db_url, 'pool_size': app.config['READ_POOL_SIZE'],
+                       'max_overflow': app.config['READ_MAX_OVERFLOW'], 'pool_timeout': 30, 'pool_recycle': 1800}
+    if app.config['METRICS_ENABLED'] and not read_db_url.startswith('sqlite'):
+        replica_options['poolclass'] = TimedQueuePool
+    app.config['SQLALCHEMY_BINDS'] = {READ_REPLICA_BIND: replica_options}
+
+class ReplicaRoutingSession(FlaskSQLAlchemySession):
+    """Sends reads to the replica inside use_read_replica() while the replica is current.
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and _reading_replica.get() and not self._flushing
+                and not getattr(clause, 'is_dml', False) and replica_monitor.usable()):
+            return self._db.engines[READ_REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': ReplicaRoutingSession})
+
+# Seconds the replica is behind. When the standby has replayed everything it
+# received it counts as current, so an idle primary does not look like lag.
+REPLICA_LAG_SQL = text("""
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+""")
+
+def measure_replica_lag():
+    """Replica lag in seconds from PostgreSQL's replay position.
+
+    Other backends have no replication status to read, so an independent
+    copy (e.g. a second SQLite file) only has to be reachable and counts as
+    current.
+    """
+    replica = db.engines[READ_REPLICA_BIND]
+    with replica.connect() as conn:
+        if replica.dialect.name != 'postgresql':
+            conn.execute(text("SELECT 1"))
+            return 0.0
+        lag = conn.execute(REPLICA_LAG_SQL).scalar()
+    return math.inf if lag is None else float(lag)
+
+class ReplicaMonitor:
+    """Decides whether reads may use the replica, re-measuring its lag at most every check_interval.
+
+    Reads fall back to the primary while the replica is unreachable or more
+    than max_lag seconds behind. Only one thread measures at a time; the
+    others use the last result instead of waiting.
+    """
+
+    def __init__(self, enabled, max_lag, check_interval):
+        self.enabled = enabled
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag_seconds = None
+        self.current = False
+        self.last_error = None
+        self._checked_at = None
+        self._check_lock = threading.Lock()
+
+    def usable(self):
+        if not self.enabled:
+            return False
+        if self.max_lag <= 0:
+            return True
+        checked_at = self._checked_at
+        if (checked_at is None or time.monotonic() - checked_at >= self.check_interval) \
+                and self._check_lock.acquire(blocking=False):
+            try:
+                self.check()
+            finally:
+                self._check_lock.release()
+        return self.current
+
+    def check(self):
+        try:
+            lag = measure_replica_lag()
+            self.last_error = None
+        except Exception as e:
+            lag = None
+            self.last_error = str(e)
+        current = lag is not None and lag <= self.max_lag
+        if current != self.current:
+            if current:
+                log.info("Read replica is current again; analytics read from it", extra=log_extra(lag_seconds=round(lag, 3)))
+            else:
+                reason = self.last_error or f"lag {lag:.1f}s exceeds {self.max_lag:g}s"
+                log.warning("Read replica unusable; analytics read from the primary", extra=log_extra(reason=reason))
+        self.lag_seconds = lag
+        self.current = current
+        self._checked_at = time.monotonic()
+
+    def stats(self):
+        return {'enabled': self.enabled, 'current': self.enabled and (self.max_lag <= 0 or self.current),
+                'lag_seconds': None if self.lag_seconds in (None, math.inf) else round(self.lag_seconds, 3),
+                'max_lag_seconds': self.max_lag, 'last_error': self.last_error}
+
+replica_monitor = ReplicaMonitor(bool(read_db_url), app.config['READ_REPLICA_MAX_LAG'],
+                                 app.config['READ_REPLICA_CHECK_INTERVAL'])
+
+read_routing = metrics.register(Counter(
+    'db_read_routing_total', 'Read-only requests by the database that served them.', ('target',)))
+if read_db_url:
+    metrics.register(Gauge('db_replica_lag_seconds', 'Seconds the read replica is behind the primary.',
+                           lambda: replica_monitor.stats()['lag_seconds']))
+    metrics.register(Gauge('db_replica_pool_checked_out', 'Read replica connections currently checked out.',
+                           lambda: db.engines[READ_REPLICA_BIND].pool.checkedout()))
+
+@contextmanager
+def use_read_replica():
+    """Routes this context's reads to the replica while it is usable."""
+    token = _reading_replica.set(True)
+    try:
+        yield
+    finally:
+        _reading_replica.reset(token)
+
+def read_engine():
+    """The engine for read-only work outside the session (e.g. streamed exports)."""
+    return db.engines[READ_REPLICA_BIND] if replica_monitor.usable() else db.engine
+
+def read_only_route(f):
+    """Serves a read-only route from the replica when one is configured and current."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if replica_monitor.enabled:
+            read_routing.inc(1, 'replica' if replica_monitor.usable() else 'primary')
+        with use_read_replica():
+            return f(*args, **kwargs)
+    return decorated
+
+def as_utc(dt):
+    """Returns dt as an aware UTC datetime (SQLite hands back naive values)."""
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
 
 # --- Database Models ---
 
 # Existing model for cell data
 class CellData(db.Model):
     __tablename__ = 'cell_data'
+    # When range-partitioned (see partition_cell_data) the table's key is (id, upload_time)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(80), nullable=False, index=True)
     email = db.Column(db.String(120), nullable=True, index=True)
     operator = db.Column(db.String(120), nullable=True)
     signal_power = db.Column(db.String(50), nullable=True)
     snr = db.Column(db.String(50), nullable=True)
+    # Numeric copies of signal_power/snr, parsed once at ingest (see parse_measurement_value)
+    signal_dbm = db.Column(db.Float, nullable=True)
+    snr_db = db.Column(db.Float, nullable=True)
     network_type = db.Column(db.String(20), nullable=True, index=True)
     frequency_band = db.Column(db.String(100), nullable=True)
     cell_id = db.Column(db.String(50), nullable=True)
@@ -63,6 +699,14 @@ class CellData(db.Model):
     device_brand = db.Column(db.String(50), nullable=True)
     upload_time = db.Column(db.DateTime(timezone=True), server_default=func.now(), index=True)
 
+    __table_args__ = (
+        # Newest-first history per user without sorting (see /api/server-user-stats)
+        db.Index('ix_cell_data_user_id_upload_time', 'user_id', 'upload_time'),
+        # Case-insensitive MAC prefix search; text_pattern_ops lets LIKE 'AB:%' use the index
+        db.Index('ix_cell_data_user_mac_upper', func.upper(user_mac).label('user_mac_upper'),
+                 postgresql_ops={'user_mac_upper': 'text_pattern_ops'}),
+    )
+
     def __repr__(self):
         return f'<CellData ID:{self.id} Email:{self.email} User:{self.user_id} Brand:{self.device_brand}>'
 
@@ -70,12 +714,112 @@ class CellData(db.Model):
         return {
             'id': self.id, 'user_id': self.user_id, 'email': self.email,
             'operator': self.operator, 'signal_power': self.signal_power, 'snr': self.snr,
+            'signal_dbm': self.signal_dbm, 'snr_db': self.snr_db,
+            'network_type': self.network_type, 'frequency_band': self.frequency_band,
+            'cell_id': self.cell_id, 'client_timestamp': self.client_timestamp,
+            'user_ip': self.user_ip, 'user_mac': self.user_mac, 'device_brand': self.device_brand,
+            'upload_time': self.upload_time.isoformat() if self.upload_time else None
+        }
+
+# Idempotency keys of stored measurements (see upload_key). Kept apart from
+# cell_data so the key stays unique when cell_data is partitioned by upload_time.
+class UploadKey(db.Model):
+    __tablename__ = 'upload_keys'
+    key = db.Column(db.String(32), primary_key=True)
+    upload_time = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+# Per-minute aggregates of cell_data, maintained at ingest (see record_rollups)
+class CellDataRollup(db.Model):
+    __tablename__ = 'cell_data_rollup_minute'
+    bucket_start = db.Column(db.DateTime(timezone=True), primary_key=True)
+    network_type = db.Column(db.String(20), primary_key=True)
+    operator = db.Column(db.String(120), primary_key=True)
+    device_brand = db.Column(db.String(50), primary_key=True)
+    user_id = db.Column(db.String(80), primary_key=True)
+    record_count = db.Column(db.BigInteger, nullable=False, default=0)
+    signal_count = db.Column(db.BigInteger, nullable=False, default=0)
+    signal_sum = db.Column(db.Float, nullable=False, default=0.0)
+    signal_sumsq = db.Column(db.Float, nullable=False, default=0.0)
+    snr_count = db.Column(db.BigInteger, nullable=False, default=0)
+    snr_sum = db.Column(db.Float, nullable=False, default=0.0)
+    snr_sumsq = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f'<CellDataRollup {self.bucket_start} {self.network_type}/{self.operator} User:{self.user_id} Count:{self.record_count}>'
+
+# Tracks from which instant the rollup table is complete
+class StatsRollupState(db.Model):
+    __tablename__ = 'stats_rollup_state'
+    name = db.Column(db.String(50), primary_key=True)
+    covered_from = db.Column(db.DateTime(timezone=True), nullable=False)
+
+# Daily HyperLogLog registers for distinct users/devices (see DistinctSketchStore)
+class DistinctSketch(db.Model):
+    __tablename__ = 'distinct_sketches'
+    bucket_start = db.Column(db.DateTime(timezone=True), primary_key=True)
+    dimension = db.Column(db.String(20), primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True, default=0)
+    registers = db.Column(db.LargeBinary, nullable=False)
+
+# Hourly and daily DDSketches of signal/SNR per cell, operator and network type (see QualitySketchStore)
+class QualitySketch(db.Model):
+    __tablename__ = 'quality_sketches'
+    resolution = db.Column(db.String(4), primary_key=True)  # 'hour' or 'day'
+    source = db.Column(db.String(7), primary_key=True)  # 'ingest' or 'rebuild'
+    dimension = db.Column(db.String(20), primary_key=True)
+    bucket_start = db.Column(db.DateTime(timezone=True), primary_key=True)
+    key = db.Column(db.String(120), primary_key=True)
+    metric = db.Column(db.String(10), primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True, default=0)
+    sketch = db.Column(db.LargeBinary, nullable=False)
+
+# Each user's newest cell_data row, upserted at ingest (see record_latest_state)
+class UserLatestState(db.Model):
+    __tablename__ = 'user_latest_state'
+    user_id = db.Column(db.String(80), primary_key=True)
+    cell_data_id = db.Column(db.Integer, nullable=True)  # unknown for rows bulk-loaded with COPY
+    email = db.Column(db.String(120), nullable=True)
+    operator = db.Column(db.String(120), nullable=True)
+    signal_power = db.Column(db.String(50), nullable=True)
+    snr = db.Column(db.String(50), nullable=True)
+    signal_dbm = db.Column(db.Float, nullable=True)
+    snr_db = db.Column(db.Float, nullable=True)
+    network_type = db.Column(db.String(20), nullable=True)
+    frequency_band = db.Column(db.String(100), nullable=True)
+    cell_id = db.Column(db.String(50), nullable=True)
+    client_timestamp = db.Column(db.String(50), nullable=True)
+    user_ip = db.Column(db.String(45), nullable=True)
+    user_mac = db.Column(db.String(17), nullable=True)
+    device_brand = db.Column(db.String(50), nullable=True)
+    upload_time = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+    def to_dict(self):
+        """Same shape as CellData.to_dict for the row this state was taken from."""
+        return {
+            'id': self.cell_data_id, 'user_id': self.user_id, 'email': self.email,
+            'operator': self.operator, 'signal_power': self.signal_power, 'snr': self.snr,
+            'signal_dbm': self.signal_dbm, 'snr_db': self.snr_db,
             'network_type': self.network_type, 'frequency_band': self.frequency_band,
             'cell_id': self.cell_id, 'client_timestamp': self.client_timestamp,
             'user_ip': self.user_ip, 'user_mac': self.user_mac, 'device_brand': self.device_brand,
             'upload_time': self.upload_time.isoformat() if self.upload_time else None
         }
 
+# Each device's (MAC's) last sighting, upserted at ingest (see record_latest_state)
+class DeviceLatestState(db.Model):
+    __tablename__ = 'device_latest_state'
+    user_mac = db.Column(db.String(17), primary_key=True)
+    user_ip = db.Column(db.String(45), nullable=True)
+    user_id = db.Column(db.String(80), nullable=True)
+    upload_time = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        # The device list order (last seen desc, mac), read without sorting
+        db.Index('ix_device_latest_state_last_seen', upload_time.desc(), user_mac),
+        db.Index('ix_device_latest_state_user_mac_upper', func.upper(user_mac).label('user_mac_upper'),
+                 postgresql_ops={'user_mac_upper': 'text_pattern_ops'}),
+    )
+
 # User model for registration
 class User(db.Model):
     __tablename__ = 'users'
@@ -85,6 +829,14 @@ class User(db.Model):
     password_hash = db.Column(db.String(128), nullable=False)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        # Case-insensitive prefix search for the dashboard's user picker
+        db.Index('ix_users_email_lower', func.lower(email).label('email_lower'),
+                 postgresql_ops={'email_lower': 'text_pattern_ops'}),
+        db.Index('ix_users_name_lower', func.lower(name).label('name_lower'),
+                 postgresql_ops={'name_lower': 'text_pattern_ops'}),
+    )
+
     def __repr__(self):
         return f'<User ID:{self.id} Name:{self.name} Email:{self.email}>'
 
@@ -95,8 +847,9 @@ class Token(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     token = db.Column(db.String(64), nullable=False, unique=True, index=True)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
-    expires_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
     is_revoked = db.Column(db.Boolean, default=False)
+    revoked_at = db.Column(db.DateTime(timezone=True), nullable=True, index=True)
 
     # Relationship with User model
     user = db.relationship('User', backref='tokens')
@@ -106,7 +859,11 @@ class Token(db.Model):
 
     def is_valid(self):
         """Check if token is valid (not expired and not revoked)"""
-        return not self.is_revoked and self.expires_at > datetime.now(timezone.utc)
+        return not self.is_revoked and as_utc(self.expires_at) > datetime.now(timezone.utc)
+
+    def revoke(self):
+        self.is_revoked = True
+        self.revoked_at = datetime.now(timezone.utc)
 
     @classmethod
     def generate_token(cls, user_id, expiration_days=30):
@@ -126,6 +883,444 @@ class Token(db.Model):
         
         return new_token
 
+# --- Identity Cache ---
+class LRUCache:
+    """Thread-safe bounded LRU cache with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries), 'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None
+            }
+
+CachedToken = namedtuple('CachedToken', ['user_id', 'email', 'expires_at', 'revoked'])
+CachedUser = namedtuple('CachedUser', ['id', 'name', 'email'])
+
+# Entries are per process: revocations made by another worker are only seen
+# once the TTL lapses, so keep IDENTITY_CACHE_TTL short.
+token_cache = LRUCache(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL'])
+user_email_cache = LRUCache(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL'])
+
+def token_lookup_statement(token_value):
+    return select(Token.user_id, User.email, Token.expires_at, Token.is_revoked) \
+        .outerjoin(User, Token.user_id == User.id).where(Token.token == token_value)
+
+def cache_token_row(token_value, row):
+    """Stores a token_lookup_statement row in token_cache and returns it as a CachedToken."""
+    cached = CachedToken(row.user_id, row.email, as_utc(row.expires_at), bool(row.is_revoked))
+    token_cache.set(token_value, cached)
+    return cached
+
+def lookup_token(token_value):
+    """Returns a CachedToken for the token string, or None if it does not exist."""
+    cached = token_cache.get(token_value)
+    if cached is None:
+        row = db.session.execute(token_lookup_statement(token_value)).first()
+        if not row:
+            return None
+        cached = cache_token_row(token_value, row)
+    return cached
+
+def is_cached_token_valid(cached):
+    return cached is not None and not cached.revoked and cached.expires_at > datetime.now(timezone.utc)
+
+def lookup_user_by_email(email):
+    """Returns a CachedUser for the email, or None if no such user exists."""
+    cached = user_email_cache.get(email)
+    if cached is None:
+        user = User.query.filter_by(email=email).first()
+        if not user:
+            return None
+        cached = CachedUser(user.id, user.name, user.email)
+        user_email_cache.set(email, cached)
+    return cached
+
+# --- Stats Response Cache ---
+class SingleFlightCache:
+    """Keeps computed values fresh for a short window.
+
+    Concurrent misses for the same key wait on the first caller's computation
+    instead of running their own.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.value = None
+            self.error = None
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._values = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def get_or_compute(self, key, compute, force=False):
+        """Returns the fresh value for key, computing it at most once at a time.
+
+        force=True skips the freshness check (used by the prewarmer).
+        """
+        with self._lock:
+            entry = self._values.get(key)
+            if not force and entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            call = self._inflight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._inflight[key] = self._Call()
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = compute()
+            with self._lock:
+                self._values[key] = (time.monotonic() + self.ttl_seconds, call.value)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._values), 'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits, 'misses': self.misses, 'shared': self.shared,
+                'inflight': len(self._inflight)
+            }
+
+stats_cache = SingleFlightCache(app.config['STATS_CACHE_TTL'])
+
+# --- Background Workers ---
+# Loops registered here are started once per process, on the first request,
+# so they run in each gunicorn worker after the fork rather than in the master.
+_background_workers = []
+_background_workers_started = False
+_background_workers_lock = threading.Lock()
+
+def background_worker(f):
+    """Registers f as a daemon loop; f decides itself whether it is enabled."""
+    _background_workers.append(f)
+    return f
+
+def start_background_workers():
+    global _background_workers_started
+    with _background_workers_lock:
+        if _background_workers_started:
+            return
+        _background_workers_started = True
+    for worker in _background_workers:
+        threading.Thread(target=worker, name=worker.__name__, daemon=True).start()
+
+@app.before_request
+def ensure_background_workers():
+    if not _background_workers_started:
+        start_background_workers()
+
+@background_worker
+def slow_statement_explain_loop():
+    """Fills in the plan of slow statements queued by record_statement_timing."""
+    while True:
+        entry, engine, statement, parameters = explain_queue.get()
+        try:
+            entry['plan'] = explain_statement(engine, statement, parameters)
+        except Exception as e:
+            entry['plan'] = [f'EXPLAIN failed: {e}']
+
+# --- Password Hashing Pool ---
+password_hash_queue_time = metrics.register(Histogram(
+    'password_hash_queue_seconds', 'Time a hashing job waited for a free worker process.', ('operation',)))
+password_hash_time = metrics.register(Histogram(
+    'password_hash_seconds', 'Time spent computing a password hash.', ('operation',)))
+password_hash_rejected = metrics.register(Counter(
+    'password_hash_rejected_total', 'Hashing jobs refused because the queue was full or timed out.', ('reason',)))
+
+class PasswordHasherBusy(Exception):
+    """The hashing pool is saturated; the caller should answer 503 with Retry-After."""
+
+def password_hash_prefix(method):
+    """The 'method:params' prefix werkzeug writes for method, with its defaults filled in."""
+    name, *params = method.split(':')
+    if name == 'scrypt':
+        return f"scrypt:{':'.join(params) if params else '32768:8:1'}"
+    if name == 'pbkdf2':
+        hash_name = params[0] if params else 'sha256'
+        iterations = params[1] if len(params) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f"Invalid hash method '{method}'.")
+
+class PasswordHasher:
+    """Runs password hashing in a bounded process pool, away from request threads.
+
+    At most `workers` hashes run at once and at most `max_pending` may be
+    queued or running; beyond that callers get PasswordHasherBusy instead of
+    tying up a request thread, so a login burst cannot starve /upload. The
+    pool is created lazily so each gunicorn worker starts its own after boot.
+    """
+
+    def __init__(self, workers, max_pending, timeout, method):
+        self.workers = workers
+        self.timeout = timeout
+        self.method = method
+        self.method_prefix = password_hash_prefix(method)
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._pending = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Forking a process that already runs threads can copy held locks into the child,
+                # so start workers from a clean interpreter instead
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._executor
+
+    def _submit(self, function_name, *args):
+        """Queues a KDF call, holding a pending slot until the worker process is actually done with it."""
+        if not self._slots.acquire(blocking=False):
+            password_hash_rejected.inc(1, 'queue_full')
+            raise PasswordHasherBusy()
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._get_executor().submit(timed_kdf, function_name, *args)
+        except BaseException:
+            self._release()
+            raise
+        # A timed-out hash keeps running in its process, so its slot is only freed once it finishes
+        future.add_done_callback(lambda _future: self._release())
+        return future
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _run(self, operation, function_name, *args):
+        if self.workers <= 0:
+            started_wall, elapsed, result = timed_kdf(function_name, *args)
+            password_hash_time.observe(elapsed, operation)
+            return result
+        submitted_wall = time.time()
+        future = self._submit(function_name, *args)
+        try:
+            started_wall, elapsed, result = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            password_hash_rejected.inc(1, 'timeout')
+            raise PasswordHasherBusy()
+        password_hash_queue_time.observe(max(0.0, started_wall - submitted_wall), operation)
+        password_hash_time.observe(elapsed, operation)
+        return result
+
+    async def _run_async(self, operation, function_name, *args):
+        """Like _run, but awaits the worker process instead of blocking the event loop."""
+        if self.workers <= 0:
+            started_wall, elapsed, result = await asyncio.to_thread(timed_kdf, function_name, *args)
+            password_hash_time.observe(elapsed, operation)
+            return result
+        submitted_wall = time.time()
+        future = self._submit(function_name, *args)
+        try:
+            started_wall, elapsed, result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            password_hash_rejected.inc(1, 'timeout')
+            raise PasswordHasherBusy()
+        password_hash_queue_time.observe(max(0.0, started_wall - submitted_wall), operation)
+        password_hash_time.observe(elapsed, operation)
+        return result
+
+    def hash(self, password):
+        return self._run('hash', 'generate', password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run('verify', 'check', password_hash, password)
+
+    async def hash_async(self, password):
+        return await self._run_async('hash', 'generate', password, self.method)
+
+    async def verify_async(self, password_hash, password):
+        return await self._run_async('verify', 'check', password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if password_hash was made with a different method or cost than PASSWORD_HASH_METHOD."""
+        return password_hash.split('$', 1)[0] != self.method_prefix
+
+    async def needs_rehash_async(self, password_hash):
+        return self.needs_rehash(password_hash)
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+password_hasher = PasswordHasher(app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_MAX_PENDING'],
+                                 app.config['PASSWORD_HASH_TIMEOUT'], app.config['PASSWORD_HASH_METHOD'])
+metrics.register(Gauge('password_hash_pending', 'Hashing jobs queued or running.', password_hasher.pending))
+
+def password_hasher_busy_response():
+    response = jsonify({'status': 'error', 'message': 'Authentication is busy, retry shortly.'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# --- Token Lifecycle ---
+tokens_swept = metrics.register(Counter(
+    'tokens_swept_total', 'Expired or revoked tokens deleted by the sweeper.', ('reason',)))
+
+def surplus_tokens_statement(user_id):
+    """Selects a user's active tokens beyond the newest TOKEN_MAX_PER_USER, or None if there is no cap."""
+    cap = app.config['TOKEN_MAX_PER_USER']
+    if cap <= 0:
+        return None
+    return select(Token).where(
+        Token.user_id == user_id, Token.is_revoked.isnot(True), Token.expires_at > datetime.now(timezone.utc)
+    ).order_by(desc(Token.created_at), desc(Token.id)).offset(cap)
+
+def revoke_surplus_tokens(surplus):
+    for token_record in surplus:
+        token_record.revoke()
+        token_cache.invalidate(token_record.token)
+    return len(surplus)
+
+def enforce_token_cap(user_id):
+    """Revokes a user's oldest active tokens beyond TOKEN_MAX_PER_USER, in the caller's transaction."""
+    statement = surplus_tokens_statement(user_id)
+    if statement is None:
+        return 0
+    return revoke_surplus_tokens(db.session.execute(statement).scalars().all())
+
+class TokenSweeper:
+    """Deletes expired and revoked tokens in small batches, each in its own transaction.
+
+    A token becomes eligible `grace` after it expired or was revoked, so clock
+    skew and in-flight requests never meet a missing row. Revoked rows from
+    before revoked_at existed are eligible straight away.
+    """
+
+    def __init__(self, batch_size, grace):
+        self.batch_size = batch_size
+        self.grace = grace
+        self.last_run = None
+        self._lock = threading.Lock()
+
+    def _delete_batches(self, condition, reason, progress):
+        deleted = 0
+        while True:
+            batch_ids = select(Token.id).where(condition).order_by(Token.id).limit(self.batch_size)
+            count = db.session.execute(
+                Token.__table__.delete().where(Token.id.in_(batch_ids.scalar_subquery()))
+            ).rowcount
+            db.session.commit()
+            if not count:
+                return deleted
+            deleted += count
+            tokens_swept.inc(count, reason)
+            if progress:
+                progress(f"Token sweep: {deleted} {reason} tokens deleted so far")
+            if count < self.batch_size:
+                return deleted
+
+    def sweep(self, progress=None):
+        """Runs one full sweep and returns its row counts."""
+        started = time.perf_counter()
+        cutoff = datetime.now(timezone.utc) - self.grace
+        expired = self._delete_batches(Token.expires_at < cutoff, 'expired', progress)
+        revoked = self._delete_batches(
+            and_(Token.is_revoked.is_(True), or_(Token.revoked_at.is_(None), Token.revoked_at < cutoff)),
+            'revoked', progress)
+        remaining = db.session.query(func.count(Token.id)).scalar()
+        result = {
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'deleted_expired': expired,
+            'deleted_revoked': revoked,
+            'remaining_tokens': remaining,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+        with self._lock:
+            self.last_run = result
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'batch_size': self.batch_size, 'grace_hours': self.grace.total_seconds() / 3600,
+                    'last_run': self.last_run}
+
+token_sweeper = TokenSweeper(app.config['TOKEN_SWEEP_BATCH_SIZE'],
+                             timedelta(hours=app.config['TOKEN_SWEEP_GRACE_HOURS']))
+
+@background_worker
+def token_sweep_loop():
+    interval = app.config['TOKEN_SWEEP_INTERVAL']
+    if interval <= 0:
+        return
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                result = token_sweeper.sweep()
+                if result['deleted_expired'] or result['deleted_revoked']:
+                    log.info("Token sweep finished", extra=log_extra(**result))
+            except Exception as e:
+                db.session.rollback()
+                log.error("Error sweeping tokens", extra=log_extra(error=str(e)))
+
 # --- Authentication Decorator ---
 def token_required(f):
     @wraps(f)
@@ -142,11 +1337,11 @@ def token_required(f):
             return jsonify({'status': 'error', 'message': 'Authentication token is missing!'}), 401
         
         try:
-            # Find the token in database
-            token_record = Token.query.filter_by(token=token).first()
+            # Find the token in the identity cache (falls back to the database)
+            token_record = lookup_token(token)
             
             # Check if token exists and is valid
-            if not token_record or not token_record.is_valid():
+            if not is_cached_token_valid(token_record):
                 return jsonify({'status': 'error', 'message': 'Invalid or expired token!'}), 401
             
             # Store user ID in request context
@@ -154,127 +1349,2289 @@ def token_required(f):
             
             return f(*args, **kwargs)
         except Exception as e:
-            print(f"❌ Error validating token: {e}")
+            log.error("Error validating token", extra=log_extra(error=str(e)))
             return jsonify({'status': 'error', 'message': 'Token authentication failed'}), 401
     
     return decorated
 
-# --- Helper Function for Period-Based Stats ---
-def calculate_stats_for_period(start_dt, end_dt):
-    """Calculates statistics for data within a specific time window."""
-    period_stats = {}
-    is_postgresql = db.engine.dialect.name == 'postgresql'
-    base_query = CellData.query.filter(
-        CellData.upload_time >= start_dt, CellData.upload_time < end_dt
-    )
-    period_stats['active_user_count'] = base_query.distinct(CellData.user_id).count()
+# --- Ingest Helpers ---
+
+# Maps CellData columns to the field names sent by the Android client
+UPLOAD_FIELD_MAP = {
+    'operator': 'operator',
+    'signal_power': 'signalPower',
+    'snr': 'snr',
+    'network_type': 'networkType',
+    'frequency_band': 'frequencyBand',
+    'cell_id': 'cellId',
+    'client_timestamp': 'clientTimestamp',
+    'user_ip': 'ipAddress',
+    'user_mac': 'macAddress',
+    'device_brand': 'deviceBrand',
+}
+
+def resolve_upload_identity():
+    """Returns (user_id, email) for the optional Bearer token, or the guest identity."""
+    user_id = None
+    email = None
+
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        token = auth_header.split(' ')[1]
+        token_record = lookup_token(token)
+        if is_cached_token_valid(token_record):
+            user_id = str(token_record.user_id)
+            email = token_record.email
+
+    # If no valid token, mark as guest
+    if not user_id:
+        user_id = "guest"
+        email = "guest@example.com"
+
+    return user_id, email
+
+def validate_measurement(data):
+    """Returns an error message for an invalid upload payload, or None if it can be stored."""
+    if not isinstance(data, dict) or not data:
+        return 'No JSON data received'
+    if not data.get('clientTimestamp'):
+        return "Missing required field: clientTimestamp"
+    for column_name, field_name in UPLOAD_FIELD_MAP.items():
+        value = data.get(field_name)
+        max_length = CellData.__table__.c[column_name].type.length
+        if value is not None and max_length and len(str(value)) > max_length:
+            return f"Field '{field_name}' exceeds {max_length} characters"
+    return None
+
+NUMERIC_VALUE_PATTERN = re.compile(r'-?\d+\.?\d*')
+
+def parse_measurement_value(raw_value):
+    """Extracts the first number from a raw reading such as '-95 dBm', or None."""
+    if raw_value is None:
+        return None
+    match = NUMERIC_VALUE_PATTERN.search(str(raw_value))
+    if not match:
+        return None
+    try:
+        return float(match.group(0))
+    except ValueError:
+        return None
+
+def measurement_value(numeric_value, raw_value):
+    """Prefers the parsed column and only re-parses rows the backfill has not reached."""
+    if numeric_value is not None:
+        return numeric_value
+    return parse_measurement_value(raw_value)
+
+def build_cell_data_row(data, user_id, email):
+    """Converts an upload payload into a dict of CellData column values."""
+    row = {'user_id': user_id, 'email': email}
+    for column_name, field_name in UPLOAD_FIELD_MAP.items():
+        value = data.get(field_name)
+        row[column_name] = str(value) if value is not None else None
+    row['signal_dbm'] = parse_measurement_value(row['signal_power'])
+    row['snr_db'] = parse_measurement_value(row['snr'])
+    # Stamped here rather than by the database so the row and its rollup bucket agree
+    row['upload_time'] = datetime.now(timezone.utc)
+    return row
+
+def _copy_text_value(value):
+    """Escapes a value for PostgreSQL COPY text format."""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def bulk_insert_cell_data(rows):
+    """Writes all rows in the current transaction with a single statement.
+
+    PostgreSQL uses COPY FROM STDIN on the session's own connection; other
+    dialects fall back to one multi-row INSERT. The caller commits.
+    """
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    if db.engine.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(_copy_text_value(row[col]) for col in columns) + '\n')
+        buffer.seek(0)
+        raw_connection = db.session.connection().connection
+        with raw_connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY cell_data ({', '.join(columns)}) FROM STDIN", buffer)
+    else:
+        db.session.execute(CellData.__table__.insert().values(rows))
+
+# --- Upload Deduplication ---
+# The Android client re-posts on a timer and after network errors, so the same
+# measurement can arrive several times. Each one gets an idempotency key, and
+# a row is only stored if its key could be claimed in upload_keys.
+UPLOAD_KEY_SWEEP_BATCH_SIZE = 5000
+
+duplicate_uploads = metrics.register(Counter(
+    'duplicate_uploads_total', 'Replayed measurements that were not stored again.', ('stage',)))
+
+def upload_key(row):
+    """Idempotency key of a measurement: its sender, client timestamp and cell.
+
+    Guests all share one user_id, so they are told apart by MAC address.
+    """
+    sender = row['user_id'] if row['user_id'] != 'guest' else f"mac:{(row.get('user_mac') or '').upper()}"
+    material = '\x1f'.join((sender, row.get('client_timestamp') or '', row.get('cell_id') or ''))
+    return hashlib.blake2b(material.encode('utf-8'), digest_size=16).hexdigest()
+
+def keyed_upload_rows(rows):
+    """Maps each upload key to its first row, dropping replays within the same batch."""
+    keyed = {}
+    for row in rows:
+        keyed.setdefault(upload_key(row), row)
+    return keyed
+
+def upload_key_claim_statement(keyed, dialect):
+    """INSERT .. ON CONFLICT DO NOTHING RETURNING key for the given keys, or None if the dialect lacks it."""
+    if dialect not in ('postgresql', 'sqlite'):
+        return None
+    insert_stmt = (pg_insert if dialect == 'postgresql' else sqlite_insert)(UploadKey)
+    # Sorted so concurrent batches lock overlapping keys in the same order
+    values = [{'key': key, 'upload_time': keyed[key]['upload_time']} for key in sorted(keyed)]
+    return insert_stmt.values(values).on_conflict_do_nothing(index_elements=['key']).returning(UploadKey.key)
+
+def claim_upload_rows(rows):
+    """Claims the rows' upload keys in the caller's transaction; returns only the rows not stored before."""
+    if not rows:
+        return []
+    keyed = keyed_upload_rows(rows)
+    claim_stmt = upload_key_claim_statement(keyed, db.engine.dialect.name)
+    if claim_stmt is not None:
+        claimed = set(db.session.execute(claim_stmt).scalars())
+    else:
+        claimed = set(keyed) - set(db.session.execute(
+            select(UploadKey.key).where(UploadKey.key.in_(list(keyed)))).scalars())
+        if claimed:
+            db.session.execute(UploadKey.__table__.insert(),
+                               [{'key': key, 'upload_time': keyed[key]['upload_time']} for key in sorted(claimed)])
+    if len(rows) > len(claimed):
+        duplicate_uploads.inc(len(rows) - len(claimed), 'database')
+    return [row for key, row in keyed.items() if key in claimed]
+
+class RecentUploadKeys:
+    """Bounded LRU set of upload keys this process stored or queued recently.
+
+    A hit answers a replay without a database round trip; a miss falls
+    through to the unique key in upload_keys, so eviction only costs a query.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, key):
+        if self.max_size <= 0:
+            return False
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, keys):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            for key in keys:
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._keys), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+recent_upload_keys = RecentUploadKeys(app.config['UPLOAD_DEDUP_CACHE_SIZE'])
+
+def prune_upload_keys(cutoff, batch_size=UPLOAD_KEY_SWEEP_BATCH_SIZE):
+    """Deletes upload keys older than cutoff in batches, each in its own transaction."""
+    deleted = 0
+    while True:
+        batch_keys = select(UploadKey.key).where(UploadKey.upload_time < cutoff).limit(batch_size)
+        count = db.session.execute(
+            UploadKey.__table__.delete().where(UploadKey.key.in_(batch_keys.scalar_subquery()))
+        ).rowcount
+        db.session.commit()
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+@background_worker
+def upload_key_sweep_loop():
+    interval = app.config['UPLOAD_KEY_SWEEP_INTERVAL']
+    retention_hours = app.config['UPLOAD_KEY_RETENTION_HOURS']
+    if interval <= 0 or retention_hours <= 0:
+        return
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                deleted = prune_upload_keys(datetime.now(timezone.utc) - timedelta(hours=retention_hours))
+                if deleted:
+                    log.info("Pruned upload keys", extra=log_extra(deleted=deleted, retention_hours=retention_hours))
+            except Exception as e:
+                db.session.rollback()
+                log.error("Error pruning upload keys", extra=log_extra(error=str(e)))
+
+# --- Signal Degradation Detector ---
+class _MetricTrend:
+    """EWMA trend of one metric: a fast 'recent' mean against a slow baseline with variance."""
+    __slots__ = ('count', 'recent', 'baseline', 'variance', 'breach_streak', 'alert_since')
+
+    def __init__(self):
+        self.count = 0
+        self.recent = 0.0
+        self.baseline = 0.0
+        self.variance = 0.0
+        self.breach_streak = 0
+        self.alert_since = None
+
+class SignalDegradationDetector:
+    """Flags sustained signal/SNR drops per cell, operator and network type.
+
+    Each measurement costs O(1): it updates exponentially weighted means and
+    variance for the keys it belongs to. A key is in alert once its recent
+    mean sits below the baseline by more than max(min_drop, sigma * stddev)
+    for `sustain` consecutive measurements, and clears at half that margin;
+    the baseline and variance are frozen from the first breach until then.
+    Keys are kept in LRU order and the least recently seen are evicted past
+    max_keys. State is per process, so each worker reports what it ingested.
+    """
+
+    DIMENSIONS = ('cell_id', 'operator', 'network_type')
+    METRICS = (('signal', 'signal_dbm'), ('snr', 'snr_db'))
+
+    def __init__(self, max_keys, fast_alpha, slow_alpha, min_drop, sigma, warmup, sustain):
+        self.max_keys = max_keys
+        self.fast_alpha = fast_alpha
+        self.slow_alpha = slow_alpha
+        self.min_drop = min_drop
+        self.sigma = sigma
+        self.warmup = warmup
+        self.sustain = sustain
+        self._keys = OrderedDict()
+        self._alerts = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def observe_rows(self, rows):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            for row in rows:
+                for dimension in self.DIMENSIONS:
+                    value = row.get(dimension)
+                    if value is not None:
+                        self._observe(dimension, value, row, now)
+
+    def _observe(self, dimension, value, row, now):
+        key = (dimension, value)
+        trends = self._keys.get(key)
+        if trends is None:
+            trends = self._keys[key] = {metric: _MetricTrend() for metric, _ in self.METRICS}
+            while len(self._keys) > self.max_keys:
+                evicted_key, _ = self._keys.popitem(last=False)
+                for metric, _ in self.METRICS:
+                    self._alerts.pop(evicted_key + (metric,), None)
+                self.evictions += 1
+        else:
+            self._keys.move_to_end(key)
+        for metric, column in self.METRICS:
+            sample = row.get(column)
+            if sample is not None:
+                self._update(key + (metric,), trends[metric], sample, now)
+
+    def _update(self, alert_key, trend, sample, now):
+        if trend.count == 0:
+            trend.recent = trend.baseline = sample
+        else:
+            trend.recent += self.fast_alpha * (sample - trend.recent)
+            # While a drop builds up or is alerted the baseline stays put; otherwise a long
+            # outage would become the new normal and clear its own alert
+            if trend.count < self.warmup or (trend.breach_streak == 0 and trend.alert_since is None):
+                diff = sample - trend.baseline
+                increment = self.slow_alpha * diff
+                trend.baseline += increment
+                trend.variance = (1 - self.slow_alpha) * (trend.variance + diff * increment)
+        trend.count += 1
+        if trend.count < self.warmup:
+            return
+
+        margin = max(self.min_drop, self.sigma * math.sqrt(trend.variance))
+        drop = trend.baseline - trend.recent
+        if drop > margin:
+            trend.breach_streak += 1
+            if trend.breach_streak >= self.sustain and trend.alert_since is None:
+                trend.alert_since = now
+        else:
+            trend.breach_streak = 0
+            if trend.alert_since is not None and drop < margin / 2:
+                trend.alert_since = None
+                self._alerts.pop(alert_key, None)
+        if trend.alert_since is not None:
+            self._alerts[alert_key] = trend
+
+    def active_alerts(self):
+        with self._lock:
+            return [
+                {
+                    'dimension': dimension, 'key': value, 'metric': metric,
+                    'baseline': round(trend.baseline, 2), 'current': round(trend.recent, 2),
+                    'drop': round(trend.baseline - trend.recent, 2),
+                    'samples': trend.count, 'since': trend.alert_since.isoformat()
+                }
+                for (dimension, value, metric), trend in self._alerts.items()
+            ]
+
+    def stats(self):
+        with self._lock:
+            return {'tracked_keys': len(self._keys), 'max_keys': self.max_keys,
+                    'active_alerts': len(self._alerts), 'evictions': self.evictions}
+
+degradation_detector = SignalDegradationDetector(
+    app.config['DETECTOR_MAX_KEYS'], app.config['DETECTOR_FAST_ALPHA'], app.config['DETECTOR_SLOW_ALPHA'],
+    app.config['DETECTOR_MIN_DROP_DB'], app.config['DETECTOR_SIGMA'], app.config['DETECTOR_WARMUP'],
+    app.config['DETECTOR_SUSTAIN']
+)
+
+# --- Distinct-Count Sketches ---
+class HyperLogLog:
+    """HyperLogLog distinct counter; merging two sketches is an element-wise max."""
+    PRECISION = 12
+    REGISTER_COUNT = 1 << PRECISION
+    RELATIVE_ERROR = 1.04 / math.sqrt(REGISTER_COUNT)
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers) if registers else bytearray(self.REGISTER_COUNT)
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.PRECISION)
+        remainder = hashed & ((1 << (64 - self.PRECISION)) - 1)
+        rank = (64 - self.PRECISION) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        other_registers = other.registers if isinstance(other, HyperLogLog) else other
+        self.registers = bytearray(map(max, self.registers, other_registers))
+        return self
+
+    def estimate(self):
+        m = self.REGISTER_COUNT
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw_estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw_estimate <= 2.5 * m and zeros:
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw_estimate))
+
+def floor_day(dt):
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+SKETCH_STATE_NAME = 'distinct_sketch_day'
+
+class DistinctSketchStore:
+    """Keeps daily HyperLogLog sketches of user ids and MAC addresses.
+
+    Ingest merges each batch's sketches into distinct_sketches in its own
+    transaction, as it does rollups, so a committed row is never missing
+    from the sketches. Every day is split over SKETCH_SHARDS rows, each
+    transaction writing one at random, so concurrent uploads rarely wait on
+    the same row lock. Totals merge every stored row, with the days before
+    today cached in memory, so a lookup only reads today's rows.
+    """
+
+    DIMENSIONS = {'users': 'user_id', 'devices': 'user_mac'}
+
+    def __init__(self):
+        self._closed_days = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def sketch_rows(cls, rows):
+        """Sketches rows into {(day, dimension): HyperLogLog}."""
+        sketches = {}
+        for row in rows:
+            day = floor_day(as_utc(row['upload_time']))
+            for dimension, column in cls.DIMENSIONS.items():
+                value = row.get(column)
+                if value is not None:
+                    sketch = sketches.get((day, dimension))
+                    if sketch is None:
+                        sketch = sketches[(day, dimension)] = HyperLogLog()
+                    sketch.add(value)
+        return sketches
+
+    def invalidate_closed_days(self, before=None):
+        """Drops cached merges that include a day before `before` (all of them by default)."""
+        with self._lock:
+            self._closed_days = {dim: cached for dim, cached in self._closed_days.items()
+                                 if before is not None and before >= cached[0]}
+
+    def closed_days(self, dimension, today):
+        """The cached merge of every stored day before today, or None if it has to be (re)loaded."""
+        with self._lock:
+            cached = self._closed_days.get(dimension)
+        return cached[1] if cached is not None and cached[0] == today else None
+
+    def cache_closed_days(self, dimension, today, registers):
+        """Merges the registers of every stored day before today and caches the result."""
+        closed = HyperLogLog()
+        for day_registers in registers:
+            closed.merge(day_registers)
+        with self._lock:
+            self._closed_days[dimension] = (today, closed)
+        return closed
+
+    @staticmethod
+    def combine(closed, today_registers):
+        """Estimates the all-time total from the closed days and today's stored rows."""
+        total = HyperLogLog(closed.registers)
+        for registers in today_registers:
+            total.merge(registers)
+        return total.estimate()
+
+    def estimate_total(self, dimension):
+        today = floor_day(datetime.now(timezone.utc))
+        closed = self.closed_days(dimension, today)
+        if closed is None:
+            closed = self.cache_closed_days(dimension, today, db.session.execute(
+                closed_sketch_days_statement(dimension, today)).scalars())
+        return self.combine(closed, db.session.execute(today_sketch_statement(dimension, today)).scalars())
+
+def closed_sketch_days_statement(dimension, today):
+    return select(DistinctSketch.registers).where(
+        DistinctSketch.dimension == dimension, DistinctSketch.bucket_start < today)
+
+def today_sketch_statement(dimension, today):
+    return select(DistinctSketch.registers).where(
+        DistinctSketch.dimension == dimension, DistinctSketch.bucket_start == today)
+
+def merge_sketch_into_db(day, dimension, sketch, shard=0, session=db.session):
+    """Merges a sketch into its stored row, creating the row if needed."""
+    identity = {'bucket_start': day, 'dimension': dimension, 'shard': shard}
+    stored = session.query(DistinctSketch).filter_by(**identity).with_for_update().first()
+    if stored is None:
+        try:
+            with session.begin_nested():
+                session.add(DistinctSketch(**identity, registers=bytes(sketch.registers)))
+            return
+        except IntegrityError:
+            # Another worker created the row first; merge into it instead
+            stored = session.query(DistinctSketch).filter_by(**identity).with_for_update().one()
+    stored.registers = bytes(HyperLogLog(stored.registers).merge(sketch).registers)
+
+def record_distinct_sketches(rows, session=db.session):
+    """Merges rows into the daily distinct-count sketches in the caller's transaction."""
+    sketches = DistinctSketchStore.sketch_rows(rows)
+    if not sketches:
+        return
+    shard = random.randrange(max(1, app.config['SKETCH_SHARDS']))
+    for (day, dimension), sketch in sorted(sketches.items()):
+        merge_sketch_into_db(day, dimension, sketch, shard, session)
+    # A late row for an earlier day changes what this worker cached for the closed days
+    distinct_sketches.invalidate_closed_days(before=min(day for day, _ in sketches))
+
+distinct_sketches = DistinctSketchStore()
+
+def sketches_cover_all_data():
+    """True once the sketches include every cell_data row (see `flask rebuild-sketches`)."""
+    state = db.session.get(StatsRollupState, SKETCH_STATE_NAME)
+    if state is None:
+        return False
+    oldest_upload = db.session.query(func.min(CellData.upload_time)).scalar()
+    return oldest_upload is None or as_utc(oldest_upload) >= as_utc(state.covered_from)
+
+def ensure_sketch_state():
+    """Starts sketch coverage at the next day boundary if it was never initialised."""
+    if db.session.get(StatsRollupState, SKETCH_STATE_NAME) is None:
+        db.session.add(StatsRollupState(name=SKETCH_STATE_NAME,
+                                        covered_from=floor_day(datetime.now(timezone.utc)) + timedelta(days=1)))
+        db.session.commit()
+
+def rebuild_sketches(since):
+    """Extends sketch coverage backwards to `since`, one committed day at a time."""
+    since = floor_day(since)
+    state = db.session.get(StatsRollupState, SKETCH_STATE_NAME)
+    day_end = as_utc(state.covered_from) if state else floor_day(datetime.now(timezone.utc)) + timedelta(days=1)
+    while day_end > since:
+        day_start = day_end - timedelta(days=1)
+        for dimension, column_name in DistinctSketchStore.DIMENSIONS.items():
+            column = getattr(CellData, column_name)
+            sketch = HyperLogLog()
+            values = db.session.query(column).filter(
+                CellData.upload_time >= day_start, CellData.upload_time < day_end, column.isnot(None)
+            ).distinct().yield_per(10000)
+            for (value,) in values:
+                sketch.add(value)
+            merge_sketch_into_db(day_start, dimension, sketch)
+        state = db.session.get(StatsRollupState, SKETCH_STATE_NAME)
+        if state is None:
+            db.session.add(StatsRollupState(name=SKETCH_STATE_NAME, covered_from=day_start))
+        else:
+            state.covered_from = day_start
+        db.session.commit()
+        print(f"Sketches rebuilt for {day_start.date().isoformat()}")
+        day_end = day_start
+
+# --- Signal Quality Sketches ---
+class DDSketch:
+    """Mergeable quantile sketch with a relative-error guarantee (DDSketch).
+
+    A value x is counted in bucket ceil(log_gamma(|x|)), so any quantile is
+    returned within RELATIVE_ACCURACY of the true value (about 1 dB at
+    -100 dBm). Negative and positive values have separate stores. When a
+    store passes MAX_BINS its buckets nearest zero are collapsed into one,
+    which bounds memory per key. Merging adds bucket counts.
+    """
+    RELATIVE_ACCURACY = 0.01
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    LOG_GAMMA = math.log(GAMMA)
+    MIN_MAGNITUDE = 1e-3  # smaller magnitudes are counted as zero
+    MAX_BINS = 512
+    _HEADER = struct.Struct('<BdddQII')
+    _VERSION = 1
+
+    def __init__(self):
+        self.negative = {}
+        self.positive = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @classmethod
+    def _index(cls, magnitude):
+        return math.ceil(math.log(magnitude) / cls.LOG_GAMMA)
+
+    @classmethod
+    def _value(cls, index):
+        return 2 * cls.GAMMA ** index / (cls.GAMMA + 1)
+
+    def add(self, value):
+        if value > self.MIN_MAGNITUDE:
+            store = self.positive
+        elif value < -self.MIN_MAGNITUDE:
+            store = self.negative
+        else:
+            store = None
+            self.zero_count += 1
+        if store is not None:
+            index = self._index(abs(value))
+            store[index] = store.get(index, 0) + 1
+            if len(store) > self.MAX_BINS:
+                self._collapse(store)
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def _collapse(self, store):
+        indexes = sorted(store)
+        excess = indexes[:len(indexes) - self.MAX_BINS + 1]
+        target = indexes[len(excess)]
+        store[target] += sum(store.pop(index) for index in excess)
+
+    def merge(self, other):
+        for store, other_store in ((self.negative, other.negative), (self.positive, other.positive)):
+            for index, bucket_count in other_store.items():
+                store[index] = store.get(index, 0) + bucket_count
+            if len(store) > self.MAX_BINS:
+                self._collapse(store)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def _buckets(self):
+        """Yields (representative value, count) in ascending value order."""
+        for index in sorted(self.negative, reverse=True):
+            yield -self._value(index), self.negative[index]
+        if self.zero_count:
+            yield 0.0, self.zero_count
+        for index in sorted(self.positive):
+            yield self._value(index), self.positive[index]
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for value, bucket_count in self._buckets():
+            seen += bucket_count
+            if seen > rank:
+                return min(self.max, max(self.min, value))
+        return self.max
+
+    def histogram(self, bin_width):
+        """Counts per fixed-width bin, each bucket assigned by its representative value."""
+        bins = {}
+        for value, bucket_count in self._buckets():
+            start = math.floor(min(self.max, max(self.min, value)) / bin_width) * bin_width
+            bins[start] = bins.get(start, 0) + bucket_count
+        return [{'start': start, 'end': start + bin_width, 'count': bins[start]} for start in sorted(bins)]
+
+    def to_bytes(self):
+        parts = [self._HEADER.pack(self._VERSION, self.sum, self.min, self.max, self.zero_count,
+                                   len(self.negative), len(self.positive))]
+        for store in (self.negative, self.positive):
+            parts.append(struct.pack(f'<{len(store)}i', *store.keys()))
+            parts.append(struct.pack(f'<{len(store)}Q', *store.values()))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls()
+        _, sketch.sum, sketch.min, sketch.max, sketch.zero_count, negative_bins, positive_bins = \
+            cls._HEADER.unpack_from(data)
+        offset = cls._HEADER.size
+        for store, bins in ((sketch.negative, negative_bins), (sketch.positive, positive_bins)):
+            indexes = struct.unpack_from(f'<{bins}i', data, offset)
+            offset += 4 * bins
+            counts = struct.unpack_from(f'<{bins}Q', data, offset)
+            offset += 8 * bins
+            store.update(zip(indexes, counts))
+        sketch.count = sketch.zero_count + sum(sketch.negative.values()) + sum(sketch.positive.values())
+        return sketch
+
+def floor_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+QUALITY_RESOLUTIONS = {'hour': (floor_hour, timedelta(hours=1)), 'day': (floor_day, timedelta(days=1))}
+QUALITY_INGEST_STATE_NAME = 'quality_sketch_ingest'
+QUALITY_STATE_NAME = 'quality_sketch_day'
+QUALITY_QUANTILES = (0.05, 0.5, 0.95)
+
+class QualitySketchStore:
+    """Keeps hourly and daily DDSketches of signal and SNR per cell, operator and network type.
+
+    Ingest adds each batch's sketches onto the stored rows in its own
+    transaction, spread over SKETCH_SHARDS rows like the distinct-count
+    sketches. Rows written at ingest (source 'ingest') are only read from
+    the hour ingest coverage began; earlier hours are rebuilt from cell_data
+    (source 'rebuild'), so the two never overlap and a rebuild can safely
+    overwrite its own rows.
+    """
+
+    DIMENSIONS = ('cell_id', 'operator', 'network_type')
+    METRICS = (('signal', 'signal_dbm'), ('snr', 'snr_db'))
+
+    @classmethod
+    def sketch_rows(cls, rows, sketches=None):
+        """Adds rows to {(resolution, bucket, dimension, key, metric): DDSketch} and returns it."""
+        sketches = {} if sketches is None else sketches
+        for row in rows:
+            upload_time = as_utc(row['upload_time'])
+            for dimension in cls.DIMENSIONS:
+                key = row.get(dimension)
+                if key is None:
+                    continue
+                for metric, column in cls.METRICS:
+                    value = row.get(column)
+                    if value is None:
+                        continue
+                    for resolution, (floor, _) in QUALITY_RESOLUTIONS.items():
+                        sketch_key = (resolution, floor(upload_time), dimension, str(key), metric)
+                        sketch = sketches.get(sketch_key)
+                        if sketch is None:
+                            sketch = sketches[sketch_key] = DDSketch()
+                        sketch.add(value)
+        return sketches
+
+def write_quality_sketches(sketches, source, shard=0, session=db.session):
+    """Merges {(resolution, bucket, dimension, key, metric): DDSketch} into quality_sketches."""
+    for (resolution, bucket_start, dimension, key, metric), sketch in sorted(sketches.items()):
+        identity = {'resolution': resolution, 'source': source, 'dimension': dimension,
+                    'bucket_start': bucket_start, 'key': key, 'metric': metric, 'shard': shard}
+        stored = session.query(QualitySketch).filter_by(**identity).with_for_update().first()
+        if stored is None:
+            try:
+                with session.begin_nested():
+                    session.add(QualitySketch(**identity, sketch=sketch.to_bytes()))
+                continue
+            except IntegrityError:
+                # Another worker created the row first; merge into it instead
+                stored = session.query(QualitySketch).filter_by(**identity).with_for_update().one()
+        stored.sketch = DDSketch.from_bytes(stored.sketch).merge(sketch).to_bytes()
+
+def record_quality_sketches(rows, session=db.session):
+    """Adds rows to the hourly and daily quality sketches in the caller's transaction."""
+    sketches = QualitySketchStore.sketch_rows(rows)
+    if sketches:
+        write_quality_sketches(sketches, 'ingest', random.randrange(max(1, app.config['SKETCH_SHARDS'])), session)
+
+def ensure_quality_sketch_state():
+    """Starts ingest-built quality sketches at an hour boundary if never initialised.
+
+    An empty database is covered from the current hour; otherwise coverage
+    starts at the next hour, as rows already stored this hour were never
+    sketched, and `rebuild_quality_sketches` covers everything before it.
+    """
+    if db.session.get(StatsRollupState, QUALITY_INGEST_STATE_NAME) is None:
+        ingest_from = floor_hour(datetime.now(timezone.utc))
+        if db.session.query(CellData.id).first() is not None:
+            ingest_from += timedelta(hours=1)
+        db.session.add(StatsRollupState(name=QUALITY_INGEST_STATE_NAME, covered_from=ingest_from))
+        db.session.add(StatsRollupState(name=QUALITY_STATE_NAME, covered_from=ingest_from))
+        db.session.commit()
+
+def rebuild_quality_sketches(since):
+    """Extends quality sketch coverage backwards to `since`, one committed day at a time.
+
+    The day ingest coverage began in is rebuilt up to that hour only, and
+    not before the hour has started, so no row is missed or counted twice.
+    """
+    since = floor_day(since)
+    ensure_quality_sketch_state()
+    day_end = as_utc(db.session.get(StatsRollupState, QUALITY_STATE_NAME).covered_from)
+    if day_end > datetime.now(timezone.utc):
+        print(f"NOTE: Ingest sketches start at {day_end.isoformat()}; run this again after that.")
+        return
+    columns = {'upload_time', *QualitySketchStore.DIMENSIONS, *(column for _, column in QualitySketchStore.METRICS)}
+    while day_end > since:
+        day_start = floor_day(day_end)
+        if day_start == day_end:
+            day_start -= timedelta(days=1)
+        db.session.query(QualitySketch).filter(
+            QualitySketch.source == 'rebuild', QualitySketch.bucket_start >= day_start,
+            QualitySketch.bucket_start < day_end
+        ).delete(synchronize_session=False)
+        raw_rows = db.session.query(*(getattr(CellData, column) for column in sorted(columns))).filter(
+            CellData.upload_time >= day_start, CellData.upload_time < day_end).yield_per(10000)
+        sketches = QualitySketchStore.sketch_rows(row._asdict() for row in raw_rows)
+        if day_end - day_start < timedelta(days=1):
+            # A partial day is always read by the hour (see quality_sketch_ranges)
+            sketches = {sketch_key: sketch for sketch_key, sketch in sketches.items() if sketch_key[0] == 'hour'}
+        write_quality_sketches(sketches, 'rebuild')
+        db.session.get(StatsRollupState, QUALITY_STATE_NAME).covered_from = day_start
+        db.session.commit()
+        print(f"Quality sketches rebuilt for {day_start.date().isoformat()}")
+        day_end = day_start
+
+def quality_sketch_ranges(start_dt, end_dt, covered_from, ingest_from):
+    """Splits a window into (resolution, source, range start, range end) sketch reads.
+
+    Whole days come from daily sketches, the partial days at either edge
+    and the day ingest coverage began in from hourly ones; the window is
+    widened to whole hours. Returns the reads and the effective start,
+    which is never before covered_from.
+    """
+    start_dt = floor_hour(max(start_dt, covered_from))
+    if start_dt >= end_dt:
+        return [], start_dt
+    first_day = floor_day(start_dt)
+    if first_day < start_dt:
+        first_day += timedelta(days=1)
+    last_day = floor_day(end_dt)
+    if first_day < last_day:
+        pieces = [('hour', start_dt, first_day), ('day', first_day, last_day), ('hour', last_day, end_dt)]
+        ingest_day = floor_day(ingest_from)
+        if first_day <= ingest_day < last_day and ingest_day < ingest_from:
+            # Neither source has that whole day
+            pieces[1:2] = [('day', first_day, ingest_day), ('hour', ingest_day, ingest_day + timedelta(days=1)),
+                           ('day', ingest_day + timedelta(days=1), last_day)]
+    else:
+        pieces = [('hour', start_dt, end_dt)]
+    ranges = []
+    for resolution, lo, hi in pieces:
+        for source, source_lo, source_hi in (('rebuild', lo, min(hi, ingest_from)), ('ingest', max(lo, ingest_from), hi)):
+            if source_lo < source_hi:
+                ranges.append((resolution, source, source_lo, source_hi))
+    return ranges, start_dt
+
+def cell_quality(dimension, start_dt, end_dt, key=None):
+    """Merges the stored sketches of a window into {key: {metric: DDSketch}}; returns it with the effective start."""
+    ingest_state = db.session.get(StatsRollupState, QUALITY_INGEST_STATE_NAME)
+    covered_state = db.session.get(StatsRollupState, QUALITY_STATE_NAME)
+    if ingest_state is None or covered_state is None:
+        return {}, None
+    ranges, effective_start = quality_sketch_ranges(start_dt, end_dt, as_utc(covered_state.covered_from),
+                                                    as_utc(ingest_state.covered_from))
+    merged = {}
+    if not ranges:
+        return merged, effective_start
+    query = db.session.query(QualitySketch.key, QualitySketch.metric, QualitySketch.sketch).filter(
+        QualitySketch.dimension == dimension,
+        or_(*(and_(QualitySketch.resolution == resolution, QualitySketch.source == source,
+                   QualitySketch.bucket_start >= lo, QualitySketch.bucket_start < hi)
+              for resolution, source, lo, hi in ranges)))
+    if key is not None:
+        query = query.filter(QualitySketch.key == key)
+    for row in query.yield_per(1000):
+        sketch = DDSketch.from_bytes(row.sketch)
+        metrics = merged.setdefault(row.key, {})
+        if row.metric in metrics:
+            metrics[row.metric].merge(sketch)
+        else:
+            metrics[row.metric] = sketch
+    return merged, effective_start
+
+def summarize_quality_sketch(sketch, quantiles, bin_width):
+    return {
+        'count': sketch.count,
+        'min': sketch.min, 'max': sketch.max,
+        'mean': round(sketch.sum / sketch.count, 2),
+        'quantiles': {f"p{q * 100:g}": round(sketch.quantile(q), 2) for q in quantiles},
+        'histogram': sketch.histogram(bin_width)
+    }
+
+# --- Stats Rollups ---
+ROLLUP_BUCKET = timedelta(minutes=1)
+ROLLUP_STATE_NAME = 'cell_data_minute'
+ROLLUP_KEY_COLUMNS = ['bucket_start', 'network_type', 'operator', 'device_brand', 'user_id']
+ROLLUP_SUM_COLUMNS = ['record_count', 'signal_count', 'signal_sum', 'signal_sumsq',
+                      'snr_count', 'snr_sum', 'snr_sumsq']
+
+def floor_minute(dt):
+    return dt.replace(second=0, microsecond=0)
+
+def ceil_minute(dt):
+    floored = floor_minute(dt)
+    return floored if floored == dt else floored + ROLLUP_BUCKET
+
+def upsert_increment_statement(table, dialect, key_columns, increment_columns):
+    """INSERT .. ON CONFLICT that adds increment_columns onto an existing row, or None if the dialect lacks it."""
+    if dialect not in ('postgresql', 'sqlite'):
+        return None
+    insert_stmt = (pg_insert if dialect == 'postgresql' else sqlite_insert)(table)
+    return insert_stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={col: table.c[col] + insert_stmt.excluded[col] for col in increment_columns}
+    )
+
+def upsert_increment(table, rows, key_columns, increment_columns):
+    """Inserts rows, adding increment_columns onto any existing row with the same key."""
+    if not rows:
+        return
+    # A stable order keeps concurrent batches from deadlocking on the same keys
+    rows = sorted(rows, key=lambda r: tuple(str(r[c]) for c in key_columns))
+    upsert_stmt = upsert_increment_statement(table, db.engine.dialect.name, key_columns, increment_columns)
+    if upsert_stmt is not None:
+        db.session.execute(upsert_stmt, rows)
+        return
+    for row in rows:
+        key_filter = and_(*(table.c[col] == row[col] for col in key_columns))
+        updated = db.session.execute(table.update().where(key_filter).values(
+            {col: table.c[col] + row[col] for col in increment_columns}))
+        if updated.rowcount == 0:
+            db.session.execute(table.insert().values(row))
+
+def rollup_buckets(rows):
+    """Sums cell_data rows into per-minute rollup rows, one per ROLLUP_KEY_COLUMNS key."""
+    buckets = {}
+    for row in rows:
+        key = (
+            floor_minute(row['upload_time']),
+            'Unknown' if row.get('network_type') is None else row['network_type'],
+            'Unknown' if row.get('operator') is None else row['operator'],
+            'Unknown' if row.get('device_brand') is None else row['device_brand'],
+            row['user_id'],
+        )
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = dict(zip(ROLLUP_KEY_COLUMNS, key), **{col: 0 for col in ROLLUP_SUM_COLUMNS})
+        bucket['record_count'] += 1
+        signal_dbm = row.get('signal_dbm')
+        if signal_dbm is not None:
+            bucket['signal_count'] += 1
+            bucket['signal_sum'] += signal_dbm
+            bucket['signal_sumsq'] += signal_dbm * signal_dbm
+        snr_db = row.get('snr_db')
+        if snr_db is not None:
+            bucket['snr_count'] += 1
+            bucket['snr_sum'] += snr_db
+            bucket['snr_sumsq'] += snr_db * snr_db
+    return list(buckets.values())
+
+def record_rollups(rows):
+    """Folds cell_data rows into the per-minute rollup table in the caller's transaction."""
+    upsert_increment(CellDataRollup.__table__, rollup_buckets(rows), ROLLUP_KEY_COLUMNS, ROLLUP_SUM_COLUMNS)
+
+def rollup_covered_from():
+    """Returns the instant from which rollups are complete, or None if they must not be used."""
+    state = db.session.get(StatsRollupState, ROLLUP_STATE_NAME)
+    return as_utc(state.covered_from) if state else None
+
+def ensure_rollup_state():
+    """Starts rollup coverage at the next minute boundary if it was never initialised."""
+    if rollup_covered_from() is None:
+        db.session.add(StatsRollupState(name=ROLLUP_STATE_NAME,
+                                        covered_from=floor_minute(datetime.now(timezone.utc)) + ROLLUP_BUCKET))
+        db.session.commit()
+
+def rebuild_rollups(since, chunk=timedelta(hours=1)):
+    """Extends rollup coverage backwards to `since` from raw cell_data.
+
+    Works newest-first in chunks, committing each chunk together with the new
+    coverage start, so an interrupted run simply resumes where it stopped.
+    """
+    since = floor_minute(since)
+    chunk_end = rollup_covered_from() or floor_minute(datetime.now(timezone.utc))
+    while chunk_end > since:
+        chunk_start = max(since, chunk_end - chunk)
+        db.session.query(CellDataRollup).filter(
+            CellDataRollup.bucket_start >= chunk_start, CellDataRollup.bucket_start < chunk_end
+        ).delete(synchronize_session=False)
+        raw_rows = db.session.query(
+            CellData.upload_time, CellData.network_type, CellData.operator, CellData.device_brand,
+            CellData.user_id, CellData.signal_dbm, CellData.snr_db
+        ).filter(CellData.upload_time >= chunk_start, CellData.upload_time < chunk_end).yield_per(5000)
+        record_rollups([row._asdict() for row in raw_rows])
+
+        state = db.session.get(StatsRollupState, ROLLUP_STATE_NAME)
+        if state is None:
+            db.session.add(StatsRollupState(name=ROLLUP_STATE_NAME, covered_from=chunk_start))
+        else:
+            state.covered_from = chunk_start
+        db.session.commit()
+        print(f"Rollups rebuilt for {chunk_start.isoformat()} - {chunk_end.isoformat()}")
+        chunk_end = chunk_start
+
+def split_stats_window(start_dt, end_dt, covered_from):
+    """Splits [start_dt, end_dt) into raw-row edge ranges and one whole-minute rollup range.
+
+    covered_from is rollup_covered_from(); None means rollups must not be used.
+    """
+    rollup_start = ceil_minute(start_dt)
+    if covered_from is not None:
+        rollup_start = max(rollup_start, covered_from)
+    rollup_end = floor_minute(end_dt)
+    if covered_from is None or rollup_start >= rollup_end:
+        return [(start_dt, end_dt)], None
+    raw_ranges = [(a, b) for a, b in ((start_dt, rollup_start), (rollup_end, end_dt)) if a < b]
+    return raw_ranges, (rollup_start, rollup_end)
+
+def _raw_ranges_filter(raw_ranges):
+    return or_(*(and_(CellData.upload_time >= a, CellData.upload_time < b) for a, b in raw_ranges))
+
+def _rollup_range_filter(rollup_range):
+    return and_(CellDataRollup.bucket_start >= rollup_range[0], CellDataRollup.bucket_start < rollup_range[1])
+
+def _add_to_aggregates(aggregates, dimension, key, row):
+    entry = aggregates[dimension].get(key)
+    if entry is None:
+        entry = aggregates[dimension][key] = {
+            'record_count': 0, 'signal_count': 0, 'signal_sum': 0.0,
+            'snr_count': 0, 'snr_sum': 0.0, 'lower_bound': None
+        }
+    entry['record_count'] += int(row.record_count or 0)
+    entry['signal_count'] += int(row.signal_count or 0)
+    entry['signal_sum'] += float(row.signal_sum or 0.0)
+    entry['snr_count'] += int(row.snr_count or 0)
+    entry['snr_sum'] += float(row.snr_sum or 0.0)
+    lower_bound = as_utc(row.lower_bound) if isinstance(row.lower_bound, datetime) else row.lower_bound
+    if lower_bound is not None and (entry['lower_bound'] is None or lower_bound > entry['lower_bound']):
+        entry['lower_bound'] = lower_bound
+
+def period_aggregate_statements(raw_ranges, rollup_range, is_postgresql):
+    """Builds one aggregate query per source (raw edge rows, rollup buckets) for a window.
+
+    On PostgreSQL each is a single GROUPING SETS query. Other dialects group by
+    all three keys at once and fold the rows in Python. `lower_bound` per user
+    is the latest upload time (raw) or bucket start (rollups) seen, used to
+    find the latest row. The queries are independent of each other.
+    """
+    unknown = literal_column("'Unknown'")
+    sources = []
+    if raw_ranges:
+        sources.append((
+            func.coalesce(CellData.network_type, unknown), func.coalesce(CellData.operator, unknown),
+            CellData.user_id,
+            [func.count(CellData.id), func.count(CellData.signal_dbm), func.sum(CellData.signal_dbm),
+             func.count(CellData.snr_db), func.sum(CellData.snr_db), func.max(CellData.upload_time)],
+            _raw_ranges_filter(raw_ranges)
+        ))
+    if rollup_range:
+        sources.append((
+            CellDataRollup.network_type, CellDataRollup.operator, CellDataRollup.user_id,
+            [func.sum(CellDataRollup.record_count), func.sum(CellDataRollup.signal_count),
+             func.sum(CellDataRollup.signal_sum), func.sum(CellDataRollup.snr_count),
+             func.sum(CellDataRollup.snr_sum), func.max(CellDataRollup.bucket_start)],
+            _rollup_range_filter(rollup_range)
+        ))
+
+    statements = []
+    measure_labels = ['record_count', 'signal_count', 'signal_sum', 'snr_count', 'snr_sum', 'lower_bound']
+    for network_col, operator_col, user_col, measures, window_filter in sources:
+        query = select(
+            network_col.label('network_type'), operator_col.label('operator'), user_col.label('user_id'),
+            *(measure.label(label) for measure, label in zip(measures, measure_labels))
+        ).where(window_filter)
+        if is_postgresql:
+            # One scan; each row belongs to exactly one grouping set and the other keys are NULL
+            statements.append(query.group_by(func.grouping_sets(network_col, operator_col, user_col)))
+        else:
+            statements.append(query.group_by(network_col, operator_col, user_col))
+    return statements
+
+def fold_period_aggregates(results, is_postgresql):
+    """Folds the rows of each period_aggregate_statements query into per-network, per-operator and per-user totals."""
+    aggregates = {'network': {}, 'operator': {}, 'user': {}}
+    for rows in results:
+        for row in rows:
+            if not is_postgresql:
+                _add_to_aggregates(aggregates, 'network', row.network_type, row)
+                _add_to_aggregates(aggregates, 'operator', row.operator, row)
+                _add_to_aggregates(aggregates, 'user', row.user_id, row)
+            elif row.user_id is not None:
+                _add_to_aggregates(aggregates, 'user', row.user_id, row)
+            elif row.network_type is not None:
+                _add_to_aggregates(aggregates, 'network', row.network_type, row)
+            else:
+                _add_to_aggregates(aggregates, 'operator', row.operator, row)
+    return aggregates
+
+def period_aggregates(raw_ranges, rollup_range):
+    """Collects per-network, per-operator and per-user totals for a window in one pass per source."""
+    is_postgresql = db.engine.dialect.name == 'postgresql'
+    statements = period_aggregate_statements(raw_ranges, rollup_range, is_postgresql)
+    return fold_period_aggregates([db.session.execute(statement).all() for statement in statements], is_postgresql)
+
+def latest_rows_per_user_statement(start_dt, end_dt, raw_ranges, rollup_range, user_aggregates, is_postgresql):
+    """Builds the latest-row-per-user query, scanning only each user's last active minute.
+
+    A user's last rollup bucket (or their last raw edge row) is a lower bound
+    for their latest upload, so the raw scan is limited to rows at or after it.
+    On PostgreSQL the bounds already computed by period_aggregates are passed
+    in as arrays; elsewhere they are recomputed in a subquery.
+    """
+    if is_postgresql:
+        user_ids = list(user_aggregates.keys())
+        lower_bounds = [entry['lower_bound'] for entry in user_aggregates.values()]
+        return select(CellData).from_statement(text("""
+            SELECT cell_data.*
+            FROM cell_data
+            JOIN (
+                SELECT c.user_id, MAX(c.upload_time) AS latest_time
+                FROM unnest(CAST(:user_ids AS TEXT[]), CAST(:lower_bounds AS TIMESTAMPTZ[])) AS b(user_id, lower_bound)
+                JOIN cell_data c ON c.user_id = b.user_id
+                 AND c.upload_time >= b.lower_bound
+                 AND c.upload_time >= :start AND c.upload_time < :end
+                GROUP BY c.user_id
+            ) latest ON cell_data.user_id = latest.user_id AND cell_data.upload_time = latest.latest_time
+            ORDER BY cell_data.upload_time DESC
+        """).bindparams(user_ids=user_ids, lower_bounds=lower_bounds, start=start_dt, end=end_dt))
+
+    bound_selects = []
+    if raw_ranges:
+        bound_selects.append(select(
+            CellData.user_id.label('user_id'), func.max(CellData.upload_time).label('lower_bound')
+        ).where(_raw_ranges_filter(raw_ranges)).group_by(CellData.user_id))
+    if rollup_range:
+        bound_selects.append(select(
+            CellDataRollup.user_id.label('user_id'), func.max(CellDataRollup.bucket_start).label('lower_bound')
+        ).where(_rollup_range_filter(rollup_range)).group_by(CellDataRollup.user_id))
+    bounds = (union_all(*bound_selects) if len(bound_selects) > 1 else bound_selects[0]).subquery()
+    user_bounds = select(
+        bounds.c.user_id, func.max(bounds.c.lower_bound).label('lower_bound')
+    ).group_by(bounds.c.user_id).subquery()
+
+    latest_times_subquery = select(
+        CellData.user_id, func.max(CellData.upload_time).label('latest_time')
+    ).join(
+        user_bounds,
+        (CellData.user_id == user_bounds.c.user_id) & (CellData.upload_time >= user_bounds.c.lower_bound)
+    ).where(
+        CellData.upload_time >= start_dt, CellData.upload_time < end_dt
+    ).group_by(CellData.user_id).subquery()
+    return select(CellData).join(
+        latest_times_subquery,
+        (CellData.user_id == latest_times_subquery.c.user_id) &
+        (CellData.upload_time == latest_times_subquery.c.latest_time)
+    ).order_by(desc(CellData.upload_time))
+
+# --- Latest State ---
+# user_latest_state and device_latest_state hold each user's newest row and
+# each MAC's last sighting, so "latest data", the device list and last seen
+# are primary-key reads. Ingest upserts them in the cell_data transaction;
+# an upsert only ever moves a state forward in time, so concurrent writers,
+# write-behind batches and the backfill can apply rows in any order.
+LATEST_STATE_NAME = 'latest_state'
+USER_STATE_COLUMNS = [column.name for column in UserLatestState.__table__.columns if column.name != 'cell_data_id']
+DEVICE_STATE_COLUMNS = [column.name for column in DeviceLatestState.__table__.columns]
+
+def newest_rows_by(rows, key):
+    """Keeps the newest row per key value, skipping rows without one, in key order."""
+    newest = {}
+    for row in rows:
+        value = row.get(key)
+        if value is None:
+            continue
+        current = newest.get(value)
+        if current is None or row['upload_time'] >= current['upload_time']:
+            newest[value] = row
+    # A stable order keeps concurrent batches from deadlocking on the same keys
+    return [newest[value] for value in sorted(newest)]
+
+def latest_state_batches(rows):
+    """Returns [(table, state rows)] to upsert for a batch of cell_data rows."""
+    user_states = [dict({column: row.get(column) for column in USER_STATE_COLUMNS}, cell_data_id=row.get('id'))
+                   for row in newest_rows_by(rows, 'user_id')]
+    device_states = [{column: row.get(column) for column in DEVICE_STATE_COLUMNS}
+                     for row in newest_rows_by(rows, 'user_mac')]
+    return [(table, states) for table, states in ((UserLatestState.__table__, user_states),
+                                                  (DeviceLatestState.__table__, device_states)) if states]
+
+def latest_state_upsert_statement(table, dialect):
+    """INSERT .. ON CONFLICT that replaces a stored state only with a newer one, or None if the dialect lacks it."""
+    if dialect not in ('postgresql', 'sqlite'):
+        return None
+    insert_stmt = (pg_insert if dialect == 'postgresql' else sqlite_insert)(table)
+    return insert_stmt.on_conflict_do_update(
+        index_elements=[column.name for column in table.primary_key.columns],
+        set_={column.name: insert_stmt.excluded[column.name] for column in table.columns if not column.primary_key},
+        where=insert_stmt.excluded.upload_time >= table.c.upload_time
+    )
+
+def record_latest_state(rows):
+    """Upserts the newest user and device state of rows in the caller's transaction."""
+    dialect = db.engine.dialect.name
+    for table, states in latest_state_batches(rows):
+        upsert_stmt = latest_state_upsert_statement(table, dialect)
+        if upsert_stmt is not None:
+            db.session.execute(upsert_stmt, states)
+            continue
+        key_column = list(table.primary_key.columns)[0]
+        for state in states:
+            key_filter = key_column == state[key_column.name]
+            updated = db.session.execute(table.update().where(
+                key_filter, table.c.upload_time <= state['upload_time']).values(state))
+            if updated.rowcount == 0 and db.session.execute(select(key_column).where(key_filter)).first() is None:
+                db.session.execute(table.insert().values(state))
+
+class CoverageMarker:
+    """Remembers once a StatsRollupState marker exists; markers are never removed while serving."""
+
+    def __init__(self, name):
+        self.name = name
+        self.ready = False
+
+    def check(self):
+        if not self.ready:
+            self.ready = db.session.get(StatsRollupState, self.name) is not None
+        return self.ready
+
+latest_state_coverage = CoverageMarker(LATEST_STATE_NAME)
+
+def rebuild_latest_state(batch_size=1000):
+    """Fills the latest-state tables from cell_data, then marks them complete.
+
+    Pages through user ids and MACs in key order, reads the newest row for
+    each page and commits its upserts before reading the next, so ingest
+    only waits on the state rows of one batch at a time. Rows stored
+    meanwhile are upserted by ingest as usual, and the forward-only upsert
+    keeps either from overwriting a newer state.
+    """
+    total = 0
+    for key_column in (CellData.user_id, CellData.user_mac):
+        after = None
+        while True:
+            keys_query = select(key_column).where(key_column.isnot(None))
+            if after is not None:
+                keys_query = keys_query.where(key_column > after)
+            keys = db.session.execute(keys_query.group_by(key_column).order_by(key_column).limit(batch_size)).scalars().all()
+            if not keys:
+                break
+            newest = select(key_column.label('key'), func.max(CellData.upload_time).label('newest_time')) \
+                .where(key_column.in_(keys)).group_by(key_column).subquery()
+            records = db.session.query(*CellData.__table__.columns).join(
+                newest, (key_column == newest.c.key) & (CellData.upload_time == newest.c.newest_time)
+            ).all()
+            record_latest_state([record._asdict() for record in records])
+            db.session.commit()
+            total += len(keys)
+            after = keys[-1]
+    if db.session.get(StatsRollupState, LATEST_STATE_NAME) is None:
+        db.session.add(StatsRollupState(name=LATEST_STATE_NAME, covered_from=datetime.now(timezone.utc)))
+    db.session.commit()
+    return total
+
+def ensure_latest_state():
+    """Marks the latest-state tables complete when there is nothing to backfill."""
+    if db.session.get(StatsRollupState, LATEST_STATE_NAME) is not None:
+        return True
+    if db.session.query(CellData.id).first() is not None:
+        return False
+    db.session.add(StatsRollupState(name=LATEST_STATE_NAME, covered_from=datetime.now(timezone.utc)))
+    db.session.commit()
+    return True
+
+def latest_state_statement(user_ids, start_dt):
+    """Selects the latest state of the given users who uploaded since start_dt, newest first."""
+    return select(UserLatestState).where(
+        UserLatestState.user_id.in_(user_ids), UserLatestState.upload_time >= start_dt
+    ).order_by(desc(UserLatestState.upload_time))
+
+def on_cell_rows_committed(rows):
+    """Feeds committed rows to the in-process streaming consumers."""
+    degradation_detector.observe_rows(rows)
+
+def store_cell_rows(rows):
+    """Bulk-inserts rows not stored before, with their rollups and latest state, in one transaction.
+
+    Returns the rows that were new; replays of stored measurements are dropped.
+    """
+    keys = [upload_key(row) for row in rows]
+    rows = claim_upload_rows(rows)
+    if rows:
+        bulk_insert_cell_data(rows)
+        record_rollups(rows)
+        record_latest_state(rows)
+        record_distinct_sketches(rows)
+        record_quality_sketches(rows)
+    db.session.commit()
+    recent_upload_keys.add(keys)
+    on_cell_rows_committed(rows)
+    return rows
+
+# --- Write-Behind Ingest ---
+class WriteBehindQueue:
+    """Bounded in-memory ingest queue backed by an append-only spool file.
+
+    enqueue() appends the row to this process's spool and returns without
+    touching the database; a writer thread stores rows in batches once
+    `batch_size` are waiting or the oldest is `flush_interval` seconds old.
+    After each committed batch the last stored sequence number is written to
+    a checkpoint file and the spool is rotated: a new file receives only the
+    rows still queued, and the old file and its checkpoint are removed, so
+    the spool stays bounded by the queue. Each spool is named per process
+    start, and spools left behind by dead processes are replayed before this
+    process spools its first row. Delivery is at-least-once: a crash between
+    commit and checkpoint replays a batch.
+    """
+
+    def __init__(self, spool_dir, max_size, batch_size, flush_interval, fsync):
+        self.spool_dir = spool_dir
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._replay_lock = threading.Lock()
+        self._replayed_orphans = False
+        self._spool = None
+        self._spool_path = None
+        self._next_seq = 1
+        self._inflight = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.stored = 0
+        self.replayed = 0
+        self.failed_flushes = 0
+        self.flush_count = 0
+        self.last_flush_ms = None
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def _open_spool(self, lines=()):
+        """Starts a new, locked spool holding lines; the name is unique even if the PID is reused."""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        spool_path = os.path.join(self.spool_dir, f'ingest-spool-{os.getpid()}-{uuid.uuid4().hex[:12]}.jsonl')
+        # Written under a name replay ignores and locked before it is renamed into place
+        spool = open(spool_path + '.tmp', 'w', encoding='utf-8')
+        if fcntl is not None:
+            fcntl.flock(spool.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        spool.writelines(lines)
+        self._sync(spool)
+        os.rename(spool_path + '.tmp', spool_path)
+        self._spool, self._spool_path = spool, spool_path
+
+    def _sync(self, spool):
+        spool.flush()
+        if self.fsync:
+            os.fsync(spool.fileno())
+
+    def enqueue(self, row):
+        """Spools and queues a row; returns False when the queue is full."""
+        with self._condition:
+            if len(self._queue) >= self.max_size:
+                self.rejected += 1
+                return False
+            if self._spool is None:
+                self.replay_orphaned_spools_once()
+                self._open_spool()
+            seq = self._next_seq
+            self._next_seq += 1
+            line = json.dumps({'seq': seq, 'row': dict(row, upload_time=row['upload_time'].isoformat())}) + '\n'
+            self._spool.write(line)
+            self._sync(self._spool)
+            self._queue.append((seq, time.monotonic(), row, line))
+            self.accepted += 1
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify()
+            return True
+
+    def _take_batch(self):
+        with self._condition:
+            while True:
+                if self._queue:
+                    age = time.monotonic() - self._queue[0][1]
+                    if len(self._queue) >= self.batch_size or age >= self.flush_interval:
+                        break
+                    self._condition.wait(self.flush_interval - age)
+                else:
+                    self._condition.wait(self.flush_interval)
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._inflight = len(batch)
+            return batch
+
+    def _write_checkpoint(self, seq):
+        checkpoint_path = self._spool_path + '.ckpt'
+        with open(checkpoint_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(str(seq))
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    def _rotate_spool(self):
+        """Moves the rows still queued to a new spool and removes the old one with its checkpoint."""
+        with self._condition:
+            if self._spool is None:
+                return
+            old_spool, old_path = self._spool, self._spool_path
+            self._open_spool(line for _, _, _, line in self._queue)
+            old_spool.close()
+            for path in (old_path, old_path + '.ckpt'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _flush_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            stored_rows = store_cell_rows([row for _, _, row, _ in batch])
+        except Exception:
+            db.session.rollback()
+            with self._condition:
+                self._queue.extendleft(reversed(batch))
+                self._inflight = 0
+                self.failed_flushes += 1
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._write_checkpoint(batch[-1][0])
+        with self._condition:
+            self._inflight = 0
+            self.stored += len(stored_rows)
+            self.flush_count += 1
+            self.last_flush_ms = round(elapsed_ms, 2)
+            self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+            self.total_flush_ms += elapsed_ms
+        self._rotate_spool()
+
+    def replay_orphaned_spools_once(self):
+        """Replays orphaned spools the first time this is called; a failed replay is retried next time."""
+        with self._replay_lock:
+            if self._replayed_orphans:
+                return
+            with app.app_context():
+                try:
+                    self.replay_orphaned_spools()
+                    self._replayed_orphans = True
+                except Exception:
+                    db.session.rollback()
+                    log.exception("Error replaying ingest spool; its rows stay spooled for the next attempt")
+
+    def replay_orphaned_spools(self):
+        """Stores rows from spool files whose owning process is gone."""
+        for partial_path in glob.glob(os.path.join(self.spool_dir, 'ingest-spool-*.jsonl.tmp')):
+            # A rotation that crashed before its rename; the spool it copied from is still in place
+            with open(partial_path, 'r', encoding='utf-8') as partial:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(partial.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue
+                os.remove(partial_path)
+        for spool_path in glob.glob(os.path.join(self.spool_dir, 'ingest-spool-*.jsonl')):
+            if spool_path == self._spool_path:
+                continue
+            with open(spool_path, 'r', encoding='utf-8') as spool:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(spool.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # still owned by a live worker
+                checkpoint_path = spool_path + '.ckpt'
+                committed_seq = 0
+                if os.path.exists(checkpoint_path):
+                    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                        committed_seq = int(f.read().strip() or 0)
+                rows = []
+                for line in spool:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn final line from the crash
+                    if record['seq'] > committed_seq:
+                        row = record['row']
+                        row['upload_time'] = datetime.fromisoformat(row['upload_time'])
+                        rows.append(row)
+                for start in range(0, len(rows), self.batch_size):
+                    store_cell_rows(rows[start:start + self.batch_size])
+                self.replayed += len(rows)
+                log.info("Replayed spooled rows", extra=log_extra(rows=len(rows), spool=os.path.basename(spool_path)))
+            os.remove(spool_path)
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+
+    def run(self):
+        self.replay_orphaned_spools_once()
+        while True:
+            batch = self._take_batch()
+            with app.app_context():
+                try:
+                    self._flush_batch(batch)
+                except Exception as e:
+                    log.error("Error flushing queued rows, will retry", extra=log_extra(rows=len(batch), error=str(e)))
+                    time.sleep(min(self.flush_interval * 5, 30))
+
+    def stats(self):
+        with self._condition:
+            oldest_age = time.monotonic() - self._queue[0][1] if self._queue else 0.0
+            return {
+                'mode': app.config['INGEST_MODE'],
+                'queue_depth': len(self._queue), 'queue_max': self.max_size,
+                'inflight': self._inflight, 'oldest_age_seconds': round(oldest_age, 3),
+                'accepted': self.accepted, 'rejected_queue_full': self.rejected,
+                'stored': self.stored, 'replayed': self.replayed,
+                'flushes': self.flush_count, 'failed_flushes': self.failed_flushes,
+                'last_flush_ms': self.last_flush_ms, 'max_flush_ms': round(self.max_flush_ms, 2),
+                'avg_flush_ms': round(self.total_flush_ms / self.flush_count, 2) if self.flush_count else None,
+                'spool_bytes': os.path.getsize(self._spool_path) if self._spool_path else 0
+            }
+
+ingest_queue = WriteBehindQueue(
+    app.config['INGEST_SPOOL_DIR'], app.config['INGEST_QUEUE_MAX'], app.config['INGEST_BATCH_SIZE'],
+    app.config['INGEST_FLUSH_INTERVAL'], app.config['INGEST_SPOOL_FSYNC']
+)
+
+@background_worker
+def ingest_writer_loop():
+    if app.config['INGEST_MODE'] == 'write_behind':
+        ingest_queue.run()
+
+# --- cell_data Partitioning ---
+PARTITION_NAME_FORMATS = {'daily': '%Y%m%d', 'monthly': '%Y%m'}
+PARTITION_NAME_PATTERN = re.compile(r'^cell_data_p(\d{8}|\d{6})$')
+CELL_DATA_DEFAULT_PARTITION = 'cell_data_default'
+CELL_DATA_LEGACY_TABLE = 'cell_data_legacy'
+PARTITION_LOCK_KEY = 'cell_data_partitions'
+
+def partitioning_configured():
+    return (app.config['CELL_DATA_PARTITIONING'] in PARTITION_NAME_FORMATS
+            and db.engine.dialect.name == 'postgresql')
+
+def partition_bounds(dt, granularity):
+    """Returns the [start, end) range of the partition that holds dt."""
+    start = floor_day(as_utc(dt).astimezone(timezone.utc))
+    if granularity == 'daily':
+        return start, start + timedelta(days=1)
+    start = start.replace(day=1)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+def partition_name(start, granularity):
+    return f"cell_data_p{start.strftime(PARTITION_NAME_FORMATS[granularity])}"
+
+def partition_range_from_name(name):
+    """Recovers a partition's range from its name; None for anything not created here."""
+    match = PARTITION_NAME_PATTERN.match(name)
+    if not match:
+        return None
+    granularity = 'daily' if len(match.group(1)) == 8 else 'monthly'
+    start = datetime.strptime(match.group(1), PARTITION_NAME_FORMATS[granularity]).replace(tzinfo=timezone.utc)
+    return partition_bounds(start, granularity)
+
+def is_cell_data_partitioned(conn):
+    return conn.execute(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('cell_data')"
+    )).scalar() is True
+
+def list_cell_data_partitions(conn):
+    return [row[0] for row in conn.execute(text("""
+        SELECT child.relname
+          FROM pg_inherits i JOIN pg_class child ON child.oid = i.inhrelid
+         WHERE i.inhparent = 'cell_data'::regclass
+         ORDER BY child.relname
+    """))]
+
+def create_cell_data_partitions(conn, start, end, granularity):
+    """Creates the partitions covering [start, end), skipping ranges already covered.
+
+    Ranges are checked against every existing partition, so switching between
+    daily and monthly never tries to create an overlapping partition.
+    """
+    existing = [bounds for bounds in map(partition_range_from_name, list_cell_data_partitions(conn)) if bounds]
+    created = []
+    current = start
+    while current < end:
+        lower, upper = partition_bounds(current, granularity)
+        if not any(lower < existing_end and existing_start < upper for existing_start, existing_end in existing):
+            name = partition_name(lower, granularity)
+            conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF cell_data "
+                f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+            ))
+            existing.append((lower, upper))
+            created.append(name)
+        current = upper
+    return created
+
+def expire_cell_data_partitions(conn, now):
+    """Detaches (or drops) partitions that ended before the retention cutoff.
+
+    Removing a whole partition is a catalog change: no row-by-row DELETE, no
+    dead tuples for vacuum, and the partition's indexes go with it. Detached
+    partitions stay behind as ordinary tables for archiving. Derived data
+    for the removed range goes in the same transaction (see
+    expire_derived_data).
+    """
+    retention_days = app.config['CELL_DATA_RETENTION_DAYS']
+    if retention_days <= 0:
+        return []
+    cutoff = now - timedelta(days=retention_days)
+    removed = []
+    removed_until = None
+    for name in list_cell_data_partitions(conn):
+        bounds = partition_range_from_name(name)
+        if bounds is None or bounds[1] > cutoff:
+            continue
+        conn.execute(text(f"ALTER TABLE cell_data DETACH PARTITION {name}"))
+        if app.config['CELL_DATA_RETENTION_ACTION'] == 'drop':
+            conn.execute(text(f"DROP TABLE {name}"))
+        removed.append(name)
+        removed_until = bounds[1] if removed_until is None else max(removed_until, bounds[1])
+    if removed:
+        expire_derived_data(conn, removed_until)
+    return removed
+
+# Derived tables keyed by time: (table, time column)
+DERIVED_TIME_TABLES = (
+    ('user_latest_state', 'upload_time'), ('device_latest_state', 'upload_time'),
+    ('cell_data_rollup_minute', 'bucket_start'), ('distinct_sketches', 'bucket_start'),
+    ('quality_sketches', 'bucket_start'), ('upload_keys', 'upload_time'),
+)
+
+def expire_derived_data(conn, until):
+    """Removes derived rows describing cell_data before `until`, the end of the newest removed partition.
+
+    Partitions are removed whole, so every retained row is at or after
+    `until`: a latest state older than that belongs to a user or device with
+    no rows left. Rollups, sketches and upload keys for the range go too, and
+    the coverage markers move up to `until` so readers never fall back to
+    raw rows that no longer exist. Other processes drop their cached
+    closed-day sketch merge at the next day boundary.
+    """
+    for table, column in DERIVED_TIME_TABLES:
+        conn.execute(text(f"DELETE FROM {table} WHERE {column} < :until"), {'until': until})
+    conn.execute(text(
+        "UPDATE stats_rollup_state SET covered_from = :until WHERE name IN :names AND covered_from < :until"
+    ).bindparams(db.bindparam('names', expanding=True)),
+        {'until': until, 'names': [ROLLUP_STATE_NAME, SKETCH_STATE_NAME, QUALITY_STATE_NAME]})
+    distinct_sketches.invalidate_closed_days()
+
+def maintain_cell_data_partitions(now=None):
+    """Creates the next PARTITION_PREMAKE partitions and applies the retention policy.
+
+    Returns (created, removed) partition names. Runs under an advisory lock so
+    several server processes never race to create the same partition.
+    """
+    if not partitioning_configured():
+        return [], []
+    granularity = app.config['CELL_DATA_PARTITIONING']
+    now = now or datetime.now(timezone.utc)
+    ahead_until = partition_bounds(now, granularity)[1]
+    for _ in range(app.config['PARTITION_PREMAKE']):
+        ahead_until = partition_bounds(ahead_until, granularity)[1]
+    with db.engine.begin() as conn:
+        if not is_cell_data_partitioned(conn):
+            return [], []
+        if not conn.execute(text("SELECT pg_try_advisory_xact_lock(hashtext(:key))"), {'key': PARTITION_LOCK_KEY}).scalar():
+            return [], []
+        created = create_cell_data_partitions(conn, partition_bounds(now, granularity)[0], ahead_until, granularity)
+        removed = expire_cell_data_partitions(conn, now)
+    return created, removed
+
+def partition_cell_data():
+    """Converts a plain cell_data table into one range-partitioned on upload_time.
+
+    The old table is renamed to cell_data_legacy and an empty partitioned
+    cell_data with the same columns, defaults and indexes takes its place,
+    together with partitions for the legacy date range and a default partition
+    for anything outside it. Rows are then moved one partition at a time, each
+    in its own transaction, so an interrupted run can simply be restarted.
+    The id sequence moves with the column and new ids carry on from the old ones.
+    """
+    granularity = app.config['CELL_DATA_PARTITIONING']
+    table = CellData.__table__
+    with db.engine.begin() as conn:
+        if not is_cell_data_partitioned(conn):
+            conn.execute(text(f"ALTER TABLE cell_data RENAME TO {CELL_DATA_LEGACY_TABLE}"))
+            conn.execute(text(f"ALTER TABLE {CELL_DATA_LEGACY_TABLE} RENAME CONSTRAINT cell_data_pkey TO {CELL_DATA_LEGACY_TABLE}_pkey"))
+            for index in table.indexes:
+                conn.execute(text(f"ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name.replace('cell_data', CELL_DATA_LEGACY_TABLE, 1)}"))
+            # The partition key is part of the primary key, so it can no longer be NULL
+            conn.execute(text(f"UPDATE {CELL_DATA_LEGACY_TABLE} SET upload_time = now() WHERE upload_time IS NULL"))
+            conn.execute(text(f"""
+                CREATE TABLE cell_data (LIKE {CELL_DATA_LEGACY_TABLE} INCLUDING DEFAULTS)
+                PARTITION BY RANGE (upload_time)
+            """))
+            conn.execute(text("ALTER TABLE cell_data ADD CONSTRAINT cell_data_pkey PRIMARY KEY (id, upload_time)"))
+            for index in table.indexes:
+                index.create(conn)
+            sequence = conn.execute(text(f"SELECT pg_get_serial_sequence('{CELL_DATA_LEGACY_TABLE}', 'id')")).scalar()
+            if sequence:
+                conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY cell_data.id"))
+            conn.execute(text(f"CREATE TABLE {CELL_DATA_DEFAULT_PARTITION} PARTITION OF cell_data DEFAULT"))
+            print("✅ Created partitioned cell_data; existing rows are in cell_data_legacy")
+
+        if not inspect(conn).has_table(CELL_DATA_LEGACY_TABLE):
+            return 0
+        oldest, newest = conn.execute(text(
+            f"SELECT MIN(upload_time), MAX(upload_time) FROM {CELL_DATA_LEGACY_TABLE}"
+        )).one()
+        if oldest is not None:
+            create_cell_data_partitions(conn, oldest, newest + timedelta(microseconds=1), granularity)
+
+    moved_total = 0
+    if oldest is not None:
+        current = partition_bounds(oldest, granularity)[0]
+        while current <= newest:
+            lower, upper = partition_bounds(current, granularity)
+            with db.engine.begin() as conn:
+                moved = conn.execute(text(f"""
+                    WITH moved AS (
+                        DELETE FROM {CELL_DATA_LEGACY_TABLE}
+                         WHERE upload_time >= :lower AND upload_time < :upper
+                        RETURNING *
+                    )
+                    INSERT INTO cell_data SELECT * FROM moved
+                """), {'lower': lower, 'upper': upper}).rowcount
+            moved_total += moved
+            if moved:
+                print(f"✅ Moved {moved} rows into {partition_name(lower, granularity)}")
+            current = upper
+
+    with db.engine.begin() as conn:
+        moved_total += conn.execute(text(f"""
+            WITH moved AS (DELETE FROM {CELL_DATA_LEGACY_TABLE} RETURNING *)
+            INSERT INTO cell_data SELECT * FROM moved
+        """)).rowcount
+        conn.execute(text(f"DROP TABLE {CELL_DATA_LEGACY_TABLE}"))
+    return moved_total
+
+@background_worker
+def partition_maintenance_loop():
+    interval = app.config['PARTITION_MAINTENANCE_INTERVAL']
+    if interval <= 0 or app.config['CELL_DATA_PARTITIONING'] not in PARTITION_NAME_FORMATS:
+        return
+    while True:
+        with app.app_context():
+            try:
+                created, removed = maintain_cell_data_partitions()
+                if created:
+                    log.info("Created cell_data partitions", extra=log_extra(partitions=created))
+                if removed:
+                    log.info("Retention removed cell_data partitions", extra=log_extra(partitions=removed))
+            except Exception as e:
+                log.error("Error maintaining cell_data partitions", extra=log_extra(error=str(e)))
+        time.sleep(interval)
+
+# --- Helper Function for Period-Based Stats ---
+def calculate_stats_for_period(start_dt, end_dt):
+    """Calculates statistics for data within a specific time window.
+
+    Whole minutes covered by the rollup table are read from it; raw cell_data
+    is only scanned for the partial minutes at either edge of the window. All
+    counts and averages come from a single aggregate pass per source, followed
+    by one query for each user's latest row: primary-key reads of
+    user_latest_state for windows ending now, a scan of cell_data otherwise.
+    """
+    raw_ranges, rollup_range = split_stats_window(start_dt, end_dt, rollup_covered_from())
+    aggregates = period_aggregates(raw_ranges, rollup_range)
+
+    # --- Latest Data ---
+    latest_data_per_user = []
+    if aggregates['user']:
+        if window_ends_now(end_dt) and latest_state_coverage.check():
+            latest_data_query = latest_state_statement(list(aggregates['user']), start_dt)
+        else:
+            latest_data_query = latest_rows_per_user_statement(start_dt, end_dt, raw_ranges, rollup_range,
+                                                               aggregates['user'], db.engine.dialect.name == 'postgresql')
+        latest_data_per_user = [data.to_dict() for data in db.session.execute(latest_data_query).scalars()]
+    return summarize_period_stats(aggregates, latest_data_per_user)
+
+def window_ends_now(end_dt):
+    """True if no row can have been stored after end_dt, so a user's latest state is their latest row in the window."""
+    return end_dt >= datetime.now(timezone.utc) - timedelta(seconds=1)
+
+def summarize_period_stats(aggregates, latest_data_per_user):
+    """Turns period_aggregates totals and each user's latest row into the period part of /api/stats."""
+    period_stats = {'active_user_count': len(aggregates['user']), 'latest_data': latest_data_per_user}
+
+    # --- Distributions ---
+    network_distribution = {}
+    operator_distribution = {}
+    device_brand_distribution = {}
+    for data_dict in latest_data_per_user:
+        net_type = data_dict.get('network_type') or 'Unknown'
+        operator = data_dict.get('operator') or 'Unknown'
+        brand = data_dict.get('device_brand') or 'Unknown'
+        network_distribution[net_type] = network_distribution.get(net_type, 0) + 1
+        operator_distribution[operator] = operator_distribution.get(operator, 0) + 1
+        device_brand_distribution[brand] = device_brand_distribution.get(brand, 0) + 1
+    period_stats['network_distribution'] = network_distribution
+    period_stats['operator_distribution'] = operator_distribution
+    period_stats['device_brand_distribution'] = device_brand_distribution
+
+    # --- Averages & Connectivity % ---
+    avg_signal_by_network = {}
+    avg_snr_by_network = {}
+    avg_signal_per_device = {}
+    operator_connectivity = {}
+    network_connectivity = {}
+    total_records = sum(entry['record_count'] for entry in aggregates['operator'].values())
+
+    if total_records > 0:
+        operator_connectivity = {op: round((entry['record_count'] / total_records) * 100, 1)
+                                 for op, entry in aggregates['operator'].items()}
+        network_connectivity = {net: round((entry['record_count'] / total_records) * 100, 1)
+                                for net, entry in aggregates['network'].items()}
+        for net, entry in aggregates['network'].items():
+            if entry['signal_count']:
+                avg_signal_by_network[net or 'Unknown'] = entry['signal_sum'] / entry['signal_count']
+            if entry['snr_count']:
+                avg_snr_by_network[net or 'Unknown'] = entry['snr_sum'] / entry['snr_count']
+        for user_id, entry in aggregates['user'].items():
+            if entry['signal_count']:
+                avg_signal_per_device[user_id] = entry['signal_sum'] / entry['signal_count']
+
+    period_stats['avg_signal_by_network'] = avg_signal_by_network
+    period_stats['avg_snr_by_network'] = avg_snr_by_network
+    period_stats['avg_signal_per_device'] = avg_signal_per_device
+    period_stats['operator_connectivity'] = operator_connectivity
+    period_stats['network_connectivity'] = network_connectivity
+    return period_stats
+
+# --- Time-Series Downsampling ---
+DOWNSAMPLE_MODES = ('lttb', 'minmax', 'stride')
+SERIES_CHUNK_SIZE = 2000
+
+SIGNAL_SERIES_COLUMNS = (CellData.upload_time, CellData.signal_dbm, CellData.signal_power, CellData.network_type,
+                         CellData.snr_db, CellData.snr)
+
+def signal_point(row):
+    """Converts a SIGNAL_SERIES_COLUMNS row into (timestamp_ms, signal_dbm, network_type, snr_db)."""
+    return (int(as_utc(row.upload_time).timestamp() * 1000),
+            measurement_value(row.signal_dbm, row.signal_power), row.network_type,
+            measurement_value(row.snr_db, row.snr))
+
+def iter_signal_series(query):
+    """Streams (timestamp_ms, signal_dbm, network_type, snr_db) from a server-side cursor, oldest first."""
+    rows = query.with_entities(*SIGNAL_SERIES_COLUMNS).order_by(CellData.upload_time).yield_per(SERIES_CHUNK_SIZE)
+    for row in rows:
+        yield signal_point(row)
+
+def _time_bucket(timestamp, start_ms, span_ms, bucket_count):
+    return min(bucket_count - 1, max(0, int((timestamp - start_ms) * bucket_count / span_ms)))
+
+def downsample_stride(points, factor):
+    """Keeps every `factor`-th point (the original behaviour); drops peaks between them."""
+    return [point for index, point in enumerate(points) if index % factor == 0]
+
+def downsample_minmax(points, start_ms, end_ms, limit):
+    """Keeps the lowest and highest signal point of each of limit/2 time buckets."""
+    bucket_count = max(1, limit // 2)
+    span_ms = max(1, end_ms - start_ms)
+    buckets = {}
+    for point in points:
+        if point[1] is None:
+            continue
+        bucket = _time_bucket(point[0], start_ms, span_ms, bucket_count)
+        low_high = buckets.get(bucket)
+        if low_high is None:
+            buckets[bucket] = [point, point]
+        elif point[1] < low_high[0][1]:
+            low_high[0] = point
+        elif point[1] > low_high[1][1]:
+            low_high[1] = point
+    sampled = []
+    for bucket in sorted(buckets):
+        low, high = buckets[bucket]
+        sampled.extend(sorted({low, high}, key=lambda point: point[0]))
+    return sampled
+
+def downsample_lttb(make_points, start_ms, end_ms, limit):
+    """Largest-Triangle-Three-Buckets over time buckets, in two streaming passes.
+
+    The first pass keeps only a running sum per bucket (for the next-bucket
+    average LTTB needs); the second keeps the best candidate of the current
+    bucket. Memory is O(limit) however many rows the range holds.
+    """
+    bucket_count = max(1, limit - 2)
+    span_ms = max(1, end_ms - start_ms)
+    sums = {}
+    first_point = last_point = None
+    point_count = 0
+    for point in make_points():
+        if point[1] is None:
+            continue
+        if first_point is None:
+            first_point = point
+        last_point = point
+        point_count += 1
+        bucket = _time_bucket(point[0], start_ms, span_ms, bucket_count)
+        total = sums.setdefault(bucket, [0.0, 0.0, 0])
+        total[0] += point[0]
+        total[1] += point[1]
+        total[2] += 1
+    if first_point is None:
+        return []
+    if point_count == 1:
+        return [first_point]
+
+    ordered_buckets = sorted(sums)
+    next_average = {}
+    for bucket, following in zip(ordered_buckets, ordered_buckets[1:] + [None]):
+        if following is None:
+            next_average[bucket] = (last_point[0], last_point[1])
+        else:
+            x_sum, y_sum, count = sums[following]
+            next_average[bucket] = (x_sum / count, y_sum / count)
+
+    sampled = [first_point]
+    current_bucket = best_point = None
+    best_area = -1.0
+    position = -1
+    for point in make_points():
+        if point[1] is None:
+            continue
+        position += 1
+        if position == 0 or position == point_count - 1:
+            continue
+        bucket = _time_bucket(point[0], start_ms, span_ms, bucket_count)
+        if bucket != current_bucket:
+            if best_point is not None:
+                sampled.append(best_point)
+            current_bucket, best_point, best_area = bucket, None, -1.0
+        anchor = sampled[-1]
+        average_x, average_y = next_average[bucket]
+        area = abs((anchor[0] - average_x) * (point[1] - anchor[1]) -
+                   (anchor[0] - point[0]) * (average_y - anchor[1]))
+        if area > best_area:
+            best_point, best_area = point, area
+    if best_point is not None:
+        sampled.append(best_point)
+    sampled.append(last_point)
+    return sampled
+
+def downsample_series(make_points, mode, factor, start_ms, end_ms, limit):
+    """Applies the requested downsampling; make_points returns a fresh oldest-first iterable of points."""
+    if factor == 1 or mode == 'stride':
+        return downsample_stride(make_points(), factor)
+    if mode == 'minmax':
+        return downsample_minmax(make_points(), start_ms, end_ms, limit)
+    return downsample_lttb(make_points, start_ms, end_ms, limit)
+
+# --- Compact Series Responses ---
+NETWORK_TYPE_CODES = {
+    "LTE": 4, "5G": 5, "3G": 3, "2G": 2, "WIFI": 6, "UNKNOWN": 0
+}
+RESPONSE_FORMATS = ('points', 'columnar')
+RESPONSE_ENCODINGS = ('json', 'gzip', 'msgpack')
+
+def build_columnar_series(points):
+    """Transposes (timestamp, signal, network, snr) points into parallel arrays.
+
+    Points are already downsampled to at most `limit`, so the columns are
+    built directly from them.
+    """
+    if not points:
+        return {'timestamps': [], 'signal': [], 'snr': [], 'networkCode': []}
+    timestamps, signals, networks, snrs = zip(*points)
+    return {
+        'timestamps': list(timestamps),
+        'signal': list(signals),
+        'snr': list(snrs),
+        'networkCode': [NETWORK_TYPE_CODES.get(net or "UNKNOWN", 0) for net in networks]
+    }
+
+def encode_payload(payload, encoding):
+    """Returns (body, mimetype, headers) for a gzip or msgpack response."""
+    if encoding == 'msgpack':
+        return msgpack.packb(payload, use_bin_type=True), 'application/x-msgpack', {}
+    return (gzip.compress(app.json.dumps(payload).encode('utf-8'), compresslevel=6), 'application/json',
+            {'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+
+def encode_response(payload, encoding, status=200):
+    """Serialises payload as JSON, gzip-compressed JSON or MessagePack."""
+    if encoding == 'json':
+        return jsonify(payload), status
+    body, mimetype, headers = encode_payload(payload, encoding)
+    response = Response(body, status=status, mimetype=mimetype)
+    response.headers.update(headers)
+    return response
+
+# --- User Stats ---
+# Shared by /api/user-stats here and in async_server.py, so both serve the same contract.
+def user_stats_options(args):
+    """Reads the /api/user-stats query parameters; raises ValueError with a client message."""
+    options = {
+        'email': args.get('email'),
+        'limit': args.get('limit', 1000, type=int),
+        'downsample': args.get('downsample', 'lttb'),
+        'format': args.get('format', 'points'),
+        'encoding': args.get('encoding', 'json'),
+    }
+    if not options['email']:
+        raise ValueError("Missing 'email' query parameter.")
+    if options['downsample'] not in DOWNSAMPLE_MODES:
+        raise ValueError(f"Invalid 'downsample' mode. Use one of: {', '.join(DOWNSAMPLE_MODES)}.")
+    if options['format'] not in RESPONSE_FORMATS:
+        raise ValueError(f"Invalid 'format'. Use one of: {', '.join(RESPONSE_FORMATS)}.")
+    if options['encoding'] not in RESPONSE_ENCODINGS:
+        raise ValueError(f"Invalid 'encoding'. Use one of: {', '.join(RESPONSE_ENCODINGS)}.")
+    if options['encoding'] == 'msgpack' and msgpack is None:
+        raise ValueError("MessagePack encoding requires the 'msgpack' package on the server.")
+    return options
+
+def user_stats_window(args):
+    """Returns the UTC (start, end) of a /api/user-stats request; raises ValueError for malformed dates."""
+    start_date_str = args.get('start_date')
+    end_date_str = args.get('end_date')
+    if not start_date_str or not end_date_str:
+        end_dt = datetime.now(timezone.utc)
+        return end_dt - timedelta(hours=1), end_dt
+    offset = timedelta(hours=3)
+    try:
+        start_dt = datetime.strptime(start_date_str, '%Y-%m-%d %H:%M:%S') - offset
+        end_dt = datetime.strptime(end_date_str, '%Y-%m-%d %H:%M:%S') - offset
+    except ValueError:
+        raise ValueError("Invalid date format. Use YYYY-MM-DD HH:MM:SS.")
+    return start_dt.replace(tzinfo=timezone.utc), end_dt.replace(tzinfo=timezone.utc)
+
+def user_series_criteria(user_id, start_dt, end_dt):
+    return (CellData.user_id == user_id, CellData.upload_time >= start_dt, CellData.upload_time <= end_dt)
+
+def network_distribution_percentages(network_stats):
+    """Turns per-network row counts into percentages (1 decimal, entries under 0.5% dropped)."""
+    total_count = sum(network_stats.values())
+    network_distribution = {}
+    if total_count > 0:
+        raw_distribution = {
+            k: max(0, v / total_count * 100)
+            for k, v in network_stats.items()
+        }
+
+        total_percentage = sum(raw_distribution.values())
+        if total_percentage > 0:
+            network_distribution = {
+                k: round((v / total_percentage) * 100, 1)
+                for k, v in raw_distribution.items()
+            }
+
+        network_distribution = {
+            k: v for k, v in network_distribution.items() if v >= 0.5
+        }
+
+        if network_distribution and sum(network_distribution.values()) != 100:
+            total = sum(network_distribution.values())
+            network_distribution = {
+                k: round((v / total) * 100, 1)
+                for k, v in network_distribution.items()
+            }
+    return network_distribution
+
+def empty_user_stats_payload(response_format):
+    empty_data = build_columnar_series([]) if response_format == 'columnar' else {
+        'signalData': [],
+        'networkData': []
+    }
+    return {
+        'status': 'success',
+        'message': 'No data found for this user in the specified time range',
+        'data': {**empty_data, 'summary': {}}
+    }
+
+def user_stats_payload(options, sampled_points, total_data_points, downsample_factor, network_rows, averages,
+                       start_dt, end_dt):
+    """Builds the /api/user-stats payload from the downsampled points and the aggregate query results."""
+    network_stats = {}
+    for row in network_rows:
+        network_type = row.network_type or "UNKNOWN"
+        network_stats[network_type] = row.count
+
+    signal_data = []
+    network_data = []
+    columnar_series = None
+
+    if options['format'] == 'columnar':
+        columnar_series = build_columnar_series(sampled_points)
+        sampled_signal_points = sum(1 for value in columnar_series['signal'] if value is not None)
+    else:
+        for timestamp, signal_value, network_type, _ in sampled_points:
+            if signal_value is not None:
+                signal_data.append({
+                    'timestamp': timestamp,
+                    'signalStrength': signal_value
+                })
+
+            net_type = network_type or "UNKNOWN"
+            net_val = NETWORK_TYPE_CODES.get(net_type, 0)
+            network_data.append({
+                'timestamp': timestamp,
+                'networkType': net_type,
+                'networkTypeValue': net_val
+            })
+        sampled_signal_points = len(signal_data)
+
+    summary = {
+        'dataPoints': total_data_points,
+        'networkDistribution': network_distribution_percentages(network_stats),
+        'sampledPoints': sampled_signal_points,
+        'downsampleFactor': downsample_factor,
+        'downsampleMode': options['downsample'] if downsample_factor > 1 else 'none'
+    }
+    summary['avgSignalStrength'] = float(averages.avg_signal) if averages.avg_signal is not None else None
+    summary['avgSnr'] = float(averages.avg_snr) if averages.avg_snr is not None else None
+
+    time_range = {
+        'start': start_dt.isoformat(),
+        'end': end_dt.isoformat()
+    }
+    if columnar_series is not None:
+        return {
+            'status': 'success',
+            'data': {
+                'format': 'columnar',
+                **columnar_series,
+                'networkCodes': NETWORK_TYPE_CODES,
+                'summary': summary,
+                'timeRange': time_range
+            }
+        }
+    return {
+        'status': 'success',
+        'data': {
+            'signalData': signal_data,
+            'networkData': network_data,
+            'summary': summary,
+            'timeRange': time_range
+        }
+    }
+
+# --- Keyset Pagination ---
+# Pages continue from the sort key of the previous page's last row, so each
+# page costs the same however deep the client has scrolled. Cursors are the
+# base64 of that key and carry no meaning for clients.
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 500
+
+def encode_cursor(*values):
+    key = [as_utc(value).isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, *types):
+    """Unpacks a cursor into values of the given types; raises ValueError if it is malformed."""
+    key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    if not isinstance(key, list) or len(key) != len(types):
+        raise ValueError('cursor does not match this listing')
+    return [datetime.fromisoformat(value) if value_type is datetime else value_type(value)
+            for value, value_type in zip(key, types)]
+
+def page_args(default_limit=PAGE_SIZE_DEFAULT, *types):
+    """Reads ?limit= and ?cursor= for a listing keyed by `types`; raises ValueError with a client message."""
+    limit = request.args.get('limit', default_limit, type=int)
+    if limit is None or not 1 <= limit <= PAGE_SIZE_MAX:
+        raise ValueError(f"'limit' must be between 1 and {PAGE_SIZE_MAX}.")
+    cursor = request.args.get('cursor')
+    if not cursor:
+        return limit, None
+    try:
+        return limit, decode_cursor(cursor, *types)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid 'cursor'.")
+
+def prefix_pattern(prefix):
+    """LIKE pattern matching values that start with prefix (wildcards in prefix are literal)."""
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def split_page(rows, limit):
+    """Trims the look-ahead row fetched to detect another page; returns (rows, has_more)."""
+    return rows[:limit], len(rows) > limit
+
+def device_page_statement(limit, after=None, prefix=None):
+    """Selects limit + 1 devices (MACs) with their last_seen, ordered by (last_seen desc, mac).
+
+    The ordering keeps devices seen at the same instant paging deterministically;
+    the extra row tells split_page whether another page follows.
+    """
+    last_seen = func.max(CellData.upload_time)
+    query = select(CellData.user_mac, last_seen.label('last_seen')).where(CellData.user_mac.isnot(None))
+    if prefix:
+        query = query.where(func.upper(CellData.user_mac).like(prefix_pattern(prefix.upper()), escape='\\'))
+    query = query.group_by(CellData.user_mac)
+    if after is not None:
+        after_seen, after_mac = after
+        query = query.having(or_(last_seen < after_seen, and_(last_seen == after_seen, CellData.user_mac > after_mac)))
+    return query.order_by(desc('last_seen'), CellData.user_mac).limit(limit + 1)
+
+def device_last_ip_statement(rows):
+    """Selects (mac, ip) of the last upload of each device on a page."""
+    return select(CellData.user_mac, CellData.user_ip).where(
+        tuple_(CellData.user_mac, CellData.upload_time).in_([(row.user_mac, row.last_seen) for row in rows]))
 
-    # --- Latest Data ---
-    latest_data_per_user = []
-    if period_stats['active_user_count'] > 0:
-        latest_times_subquery = base_query.with_entities(
-            CellData.user_id, func.max(CellData.upload_time).label('latest_time')
-        ).group_by(CellData.user_id).subquery()
-        latest_data_query = db.session.query(CellData).join(
-            latest_times_subquery,
-            (CellData.user_id == latest_times_subquery.c.user_id) &
-            (CellData.upload_time == latest_times_subquery.c.latest_time)
-        ).order_by(desc(CellData.upload_time))
-        latest_data_per_user = [data.to_dict() for data in latest_data_query.all()]
-    period_stats['latest_data'] = latest_data_per_user
+def format_device_page(rows, has_more, last_ips):
+    """Returns (devices, next_cursor) for the /api/devices and /api/stats payloads."""
+    devices = [
+        {'mac': row.user_mac, 'ip': last_ips.get(row.user_mac),
+         'last_seen': as_utc(row.last_seen).isoformat() if row.last_seen else None}
+        for row in rows
+    ]
+    next_cursor = encode_cursor(rows[-1].last_seen, rows[-1].user_mac) if has_more else None
+    return devices, next_cursor
 
-    # --- Distributions ---
-    network_distribution = {}
-    operator_distribution = {}
-    device_brand_distribution = {}
-    for data_dict in latest_data_per_user:
-        net_type = data_dict.get('network_type') or 'Unknown'
-        operator = data_dict.get('operator') or 'Unknown'
-        brand = data_dict.get('device_brand') or 'Unknown'
-        network_distribution[net_type] = network_distribution.get(net_type, 0) + 1
-        operator_distribution[operator] = operator_distribution.get(operator, 0) + 1
-        device_brand_distribution[brand] = device_brand_distribution.get(brand, 0) + 1
-    period_stats['network_distribution'] = network_distribution
-    period_stats['operator_distribution'] = operator_distribution
-    period_stats['device_brand_distribution'] = device_brand_distribution
+def device_state_page_statement(limit, after=None, prefix=None):
+    """device_page_statement over device_latest_state: an index range read instead of a GROUP BY over cell_data."""
+    last_seen = DeviceLatestState.upload_time
+    query = select(DeviceLatestState.user_mac, last_seen.label('last_seen'), DeviceLatestState.user_ip)
+    if prefix:
+        query = query.where(func.upper(DeviceLatestState.user_mac).like(prefix_pattern(prefix.upper()), escape='\\'))
+    if after is not None:
+        after_seen, after_mac = after
+        query = query.where(or_(last_seen < after_seen,
+                                and_(last_seen == after_seen, DeviceLatestState.user_mac > after_mac)))
+    return query.order_by(desc(last_seen), DeviceLatestState.user_mac).limit(limit + 1)
 
-    # --- Averages & Connectivity % ---
-    avg_signal_by_network = {}
-    avg_snr_by_network = {}
-    avg_signal_per_device = {}
-    operator_connectivity = {}
-    network_connectivity = {}
-    total_records = base_query.count()
+def device_page(limit, after=None, prefix=None):
+    """One page of devices (MACs), most recently seen first, with each device's last IP."""
+    if latest_state_coverage.check():
+        rows, has_more = split_page(db.session.execute(device_state_page_statement(limit, after, prefix)).all(), limit)
+        return format_device_page(rows, has_more, {row.user_mac: row.user_ip for row in rows})
+    rows, has_more = split_page(db.session.execute(device_page_statement(limit, after, prefix)).all(), limit)
+    # Last IP per device, looked up only for the devices on this page
+    last_ips = dict(db.session.execute(device_last_ip_statement(rows)).all()) if rows else {}
+    return format_device_page(rows, has_more, last_ips)
 
-    if total_records > 0:
-        operators_query = base_query.with_entities(func.coalesce(CellData.operator, 'Unknown').label('operator'),
-                                                   func.count(CellData.id).label('count')).group_by('operator')
-        operator_counts = {row.operator: row.count for row in operators_query.all()}
-        [operator_connectivity.update({op: round((cnt / total_records) * 100, 1)})
-         for op, cnt in operator_counts.items()]
-        networks_query = base_query.with_entities(func.coalesce(CellData.network_type, 'Unknown').label('network'),
-                                                  func.count(CellData.id).label('count')).group_by('network')
-        network_counts = {row.network: row.count for row in networks_query.all()}
-        [network_connectivity.update({net: round((cnt / total_records) * 100, 1)})
-         for net, cnt in network_counts.items()]
+# --- Bulk Export ---
+EXPORT_FORMATS = ('csv', 'parquet')
 
-        if is_postgresql:
-            # Use raw SQL for better control over signal power calculation
-            signal_net_query = db.session.execute(text("""
-                SELECT network_type,
-                       AVG(CAST(regexp_replace(signal_power, '[^0-9\\-.]', '', 'g') AS FLOAT)) AS avg_signal
-                FROM cell_data
-                WHERE signal_power IS NOT NULL
-                  AND signal_power ~ '[-]?[0-9]+\\.?[0-9]*'
-                  AND upload_time >= :start AND upload_time < :end
-                GROUP BY network_type
-            """), {'start': start_dt, 'end': end_dt}).fetchall()
-
-            for row in signal_net_query:
-                if row.avg_signal is not None:
-                    avg_signal_by_network[row.network_type or 'Unknown'] = float(row.avg_signal)
-
-            # Debug output
-            print(f"Debug - avg_signal_by_network: {avg_signal_by_network}")
-
-            # Query for avg SNR by network using raw SQL
-            snr_net_query = db.session.execute(text("""
-                SELECT network_type,
-                       AVG(CAST(regexp_replace(snr, '[^0-9\\-.]', '', 'g') AS FLOAT)) AS avg_snr
-                FROM cell_data
-                WHERE snr IS NOT NULL
-                  AND snr ~ '[-]?[0-9]+\\.?[0-9]*'
-                  AND upload_time >= :start AND upload_time < :end
-                GROUP BY network_type
-            """), {'start': start_dt, 'end': end_dt}).fetchall()
-
-            for row in snr_net_query:
-                if row.avg_snr is not None:
-                    avg_snr_by_network[row.network_type or 'Unknown'] = float(row.avg_snr)
-
-            # Use the same raw SQL approach for avg signal per device
-            signal_dev_query = db.session.execute(text("""
-                SELECT user_id,
-                       AVG(CAST(regexp_replace(signal_power, '[^0-9\\-.]', '', 'g') AS FLOAT)) AS avg_signal
-                FROM cell_data
-                WHERE signal_power IS NOT NULL
-                  AND signal_power ~ '[-]?[0-9]+\\.?[0-9]*'
-                  AND upload_time >= :start AND upload_time < :end
-                GROUP BY user_id
-            """), {'start': start_dt, 'end': end_dt}).fetchall()
-
-            for row in signal_dev_query:
-                if row.avg_signal is not None:
-                    avg_signal_per_device[row.user_id] = float(row.avg_signal)
-        else:
-            print(f"WARN: Skipping Signal/SNR average calculation for period {start_dt}-{end_dt} - requires PostgreSQL.")
+def export_chunks(engine, start_dt, end_dt, user_id=None, operator=None, chunk_size=5000):
+    """Yields lists of cell_data rows (as dicts) in upload order.
 
-    period_stats['avg_signal_by_network'] = avg_signal_by_network
-    period_stats['avg_snr_by_network'] = avg_snr_by_network
-    period_stats['avg_signal_per_device'] = avg_signal_per_device
-    period_stats['operator_connectivity'] = operator_connectivity
-    period_stats['network_connectivity'] = network_connectivity
-    return period_stats
+    Each chunk is read on its own connection checkout through a server-side
+    cursor and continues after the previous chunk's (upload_time, id), so a
+    long export holds a pooled connection only while a chunk is being read,
+    never while the client is receiving it.
+    """
+    table = CellData.__table__
+    query = select(table).where(table.c.upload_time >= start_dt, table.c.upload_time < end_dt)
+    if user_id is not None:
+        query = query.where(table.c.user_id == user_id)
+    if operator is not None:
+        query = query.where(table.c.operator == operator)
+    query = query.order_by(table.c.upload_time, table.c.id).limit(chunk_size)
+    after = None
+    while True:
+        page = query
+        if after is not None:
+            page = page.where(tuple_(table.c.upload_time, table.c.id) > after)
+        with engine.connect() as conn:
+            result = conn.execution_options(yield_per=chunk_size).execute(page)
+            rows = [dict(row._mapping) for row in result]
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1]['upload_time'], rows[-1]['id'])
+
+def _export_value(value):
+    return as_utc(value).isoformat() if isinstance(value, datetime) else value
+
+def iter_csv_export(chunks):
+    """Encodes row chunks as CSV, one header line then one block per chunk."""
+    columns = [column.name for column in CellData.__table__.columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        for row in rows:
+            writer.writerow([_export_value(row[column]) for column in columns])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+class _DrainableSink:
+    """Write-only file object whose contents are handed out and discarded as they are written."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+def parquet_export_schema():
+    types = {db.Integer: pa.int64(), db.Float: pa.float64(), db.DateTime: pa.timestamp('us', tz='UTC')}
+    fields = []
+    for column in CellData.__table__.columns:
+        arrow_type = next((t for sa_type, t in types.items() if isinstance(column.type, sa_type)), pa.string())
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+def iter_parquet_export(chunks):
+    """Encodes row chunks as Parquet, one row group per chunk, streaming bytes as each group is written."""
+    schema = parquet_export_schema()
+    sink = _DrainableSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    try:
+        for rows in chunks:
+            for row in rows:
+                if row['upload_time'] is not None:
+                    row['upload_time'] = as_utc(row['upload_time'])
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def parse_export_time(value):
+    """Parses an ISO 8601 / 'YYYY-MM-DD HH:MM:SS' timestamp; naive values are taken as UTC."""
+    return as_utc(datetime.fromisoformat(value))
 
 # --- Routes ---
 
@@ -303,17 +3660,18 @@ def register_user():
         return jsonify({'status': 'error', 'message': 'User with this email already exists'}), 400
 
     try:
-        # Hash the password before storing
-        password_hash = generate_password_hash(password)
+        # Hash the password before storing (in the hashing pool, not this thread)
+        password_hash = password_hasher.hash(password)
         new_user = User(name=name, email=email, password_hash=password_hash)
         db.session.add(new_user)
         db.session.commit()
-        print(f"✅ User registered successfully: ID={new_user.id}, Name={new_user.name}, Email={new_user.email}")
+        log.info("User registered", extra=log_extra(user_id=new_user.id, email=new_user.email))
         return jsonify({'status': 'success', 'message': 'Registration successful', 'user_id': new_user.id}), 201
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
     except Exception as e:
         db.session.rollback()
-        print(f"❌ Error during registration: {e}")
-        traceback.print_exc()
+        log.exception("Error during registration")
         return jsonify({'status': 'error', 'message': 'Internal server error during registration.'}), 500
 
 @app.route("/login", methods=["POST"])
@@ -327,10 +3685,16 @@ def login_user():
             return jsonify({"success": False, "message": "Missing email or password"}), 400
 
         user = User.query.filter_by(email=email).first()
-        if user and check_password_hash(user.password_hash, password):
+        if user and password_hasher.verify(user.password_hash, password):
+            # Upgrade the stored hash if PASSWORD_HASH_METHOD has changed since it was made
+            if app.config['PASSWORD_REHASH_ON_LOGIN'] and password_hasher.needs_rehash(user.password_hash):
+                user.password_hash = password_hasher.hash(password)
+                log.info("Rehashed password", extra=log_extra(user_id=user.id))
             # Generate a token
             new_token = Token.generate_token(user.id)
             db.session.add(new_token)
+            db.session.flush()
+            enforce_token_cap(user.id)
             db.session.commit()
             
             return jsonify({
@@ -344,9 +3708,10 @@ def login_user():
         else:
             return jsonify({"success": False, "message": "Invalid credentials"}), 401
 
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
     except Exception as e:
-        print(f"Login error: {e}")
-        traceback.print_exc()
+        log.exception("Login error")
         return jsonify({"success": False, "message": "Internal server error"}), 500
 
 @app.route("/logout", methods=["POST"])
@@ -359,71 +3724,140 @@ def logout():
         
         # Revoke the token
         token_record = Token.query.filter_by(token=token).first()
-        token_record.is_revoked = True
+        token_record.revoke()
         db.session.commit()
+        token_cache.invalidate(token)
         
         return jsonify({"success": True, "message": "Logged out successfully"}), 200
     except Exception as e:
-        print(f"Logout error: {e}")
-        traceback.print_exc()
+        log.exception("Logout error")
         return jsonify({"success": False, "message": "Error during logout"}), 500
 
+def duplicate_upload_response():
+    """200 for a measurement that was already stored, so the client stops retrying it."""
+    return jsonify({'status': 'success', 'message': 'Duplicate measurement, already stored', 'duplicate': True}), 200
+
 @app.route('/upload', methods=['POST'])
 def receive_cell_data():
     data = request.get_json()
     if not data:
         return jsonify({'status': 'error', 'message': 'No JSON data received'}), 400
-    print(f"📡 Received Raw Data: {data}")
+    log.debug("Upload received", extra=log_extra(sampled=True, payload=data))
 
-    client_timestamp = data.get('clientTimestamp')
-    if not client_timestamp:
-        return jsonify({'status': 'error', 'message': "Missing required field: clientTimestamp"}), 400
+    validation_error = validate_measurement(data)
+    if validation_error:
+        return jsonify({'status': 'error', 'message': validation_error}), 400
 
     # --- NEW LOGIC: Try to get user from token, if any ---
-    user_id = None
-    email = None
-
-    auth_header = request.headers.get('Authorization')
-    if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.split(' ')[1]
-        token_record = Token.query.filter_by(token=token).first()
-        if token_record and token_record.is_valid():
-            user_id = str(token_record.user_id)
-            user = User.query.get(token_record.user_id)
-            if user:
-                email = user.email
+    user_id, email = resolve_upload_identity()
+    row = build_cell_data_row(data, user_id, email)
+    key = upload_key(row)
+    if recent_upload_keys.seen(key):
+        duplicate_uploads.inc(1, 'recent')
+        return duplicate_upload_response()
 
-    # If no valid token, mark as guest
-    if not user_id:
-        user_id = "guest"
-        email = "guest@example.com"
+    if app.config['INGEST_MODE'] == 'write_behind':
+        if not ingest_queue.enqueue(row):
+            response = jsonify({'status': 'error', 'message': 'Ingest queue is full, retry shortly.'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        # A replay the pre-filter misses is still dropped when its batch is written
+        recent_upload_keys.add([key])
+        return jsonify({'status': 'success', 'message': 'Data accepted for storage', 'duplicate': False}), 202
 
     try:
-        new_data = CellData(
-            user_id=user_id,
-            email=email,
-            operator=data.get('operator'),
-            signal_power=data.get('signalPower'),
-            snr=data.get('snr'),
-            network_type=data.get('networkType'),
-            frequency_band=data.get('frequencyBand'),
-            cell_id=data.get('cellId'),
-            client_timestamp=data.get('clientTimestamp'),
-            user_ip=data.get('ipAddress'),
-            user_mac=data.get('macAddress'),
-            device_brand=data.get('deviceBrand')
-        )
+        if not claim_upload_rows([row]):
+            db.session.rollback()
+            recent_upload_keys.add([key])
+            return duplicate_upload_response()
+        new_data = CellData(**row)
         db.session.add(new_data)
+        db.session.flush()
+        record_rollups([row])
+        record_latest_state([dict(row, id=new_data.id)])
+        record_distinct_sketches([row])
+        record_quality_sketches([row])
         db.session.commit()
-        print(f"✅ Data stored successfully: ID={new_data.id}, Email={email}, Brand={new_data.device_brand}")
-        return jsonify({'status': 'success', 'message': 'Data received and stored'}), 201
+        recent_upload_keys.add([key])
+        on_cell_rows_committed([row])
+        log.info("Upload stored", extra=log_extra(sampled=True, id=new_data.id, email=email, brand=new_data.device_brand))
+        return jsonify({'status': 'success', 'message': 'Data received and stored', 'duplicate': False}), 201
 
     except Exception as e:
         db.session.rollback()
-        print(f"❌ Error storing data for {email}: {e}")
-        traceback.print_exc()
+        log.exception("Error storing upload", extra=log_extra(email=email))
         return jsonify({'status': 'error', 'message': 'Internal server error during data storage.'}), 500
 
+@app.route('/upload/batch', methods=['POST'])
+def receive_cell_data_batch():
+    """
+    Expects a JSON array of measurements (or {"measurements": [...]}) in the
+    same field format as /upload. The token is resolved once and all valid
+    rows are written in a single bulk insert and commit. The response carries
+    a per-item result so clients only retry the indexes that failed.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('measurements')
+    if not isinstance(data, list) or not data:
+        return jsonify({'status': 'error', 'message': 'Expected a non-empty JSON array of measurements'}), 400
+
+    max_batch_size = app.config['UPLOAD_BATCH_MAX_SIZE']
+    if len(data) > max_batch_size:
+        return jsonify({'status': 'error', 'message': f'Batch exceeds the maximum of {max_batch_size} measurements'}), 413
+
+    user_id, email = resolve_upload_identity()
+
+    results = []
+    rows = []
+    row_results = []
+    for index, item in enumerate(data):
+        validation_error = validate_measurement(item)
+        if validation_error:
+            results.append({'index': index, 'status': 'error', 'message': validation_error})
+            continue
+        row = build_cell_data_row(item, user_id, email)
+        if recent_upload_keys.seen(upload_key(row)):
+            duplicate_uploads.inc(1, 'recent')
+            results.append({'index': index, 'status': 'duplicate'})
+            continue
+        results.append({'index': index, 'status': 'stored'})
+        rows.append(row)
+        row_results.append(results[-1])
+
+    stored = 0
+    if rows:
+        try:
+            new_rows = {id(row) for row in store_cell_rows(rows)}
+            for row, result in zip(rows, row_results):
+                if id(row) not in new_rows:
+                    result['status'] = 'duplicate'
+            stored = len(new_rows)
+            log.info("Batch stored", extra=log_extra(sampled=True, stored=stored, duplicates=len(rows) - stored, email=email))
+        except Exception as e:
+            db.session.rollback()
+            log.exception("Error storing batch", extra=log_extra(email=email, rows=len(rows)))
+            for result in results:
+                if result['status'] == 'stored':
+                    result.update({'status': 'error', 'message': 'Internal server error during data storage.'})
+            # Only the rows that were attempted and rolled back count as failed here
+            return jsonify({'status': 'error', 'stored': 0, 'failed': len(rows), 'results': results}), 500
+
+    failed = sum(1 for result in results if result['status'] == 'error')
+    duplicates = len(results) - failed - stored
+    if failed == len(results):
+        status_code = 400
+    elif failed:
+        status_code = 207
+    else:
+        status_code = 201 if stored else 200
+    return jsonify({
+        'status': 'success' if not failed else ('partial' if failed < len(results) else 'error'),
+        'stored': stored,
+        'duplicates': duplicates,
+        'failed': failed,
+        'results': results
+    }), status_code
 
 @app.route('/refresh-token', methods=['POST'])
 @token_required
@@ -440,9 +3874,10 @@ def refresh_token():
         auth_header = request.headers.get('Authorization')
         old_token = auth_header.split(' ')[1]
         token_record = Token.query.filter_by(token=old_token).first()
-        token_record.is_revoked = True
+        token_record.revoke()
         
         db.session.commit()
+        token_cache.invalidate(old_token)
         
         return jsonify({
             "success": True,
@@ -451,8 +3886,7 @@ def refresh_token():
             "expires_at": new_token.expires_at.isoformat()
         }), 200
     except Exception as e:
-        print(f"Token refresh error: {e}")
-        traceback.print_exc()
+        log.exception("Token refresh error")
         return jsonify({"success": False, "message": "Error refreshing token"}), 500
 
 @app.route('/validate-token', methods=['GET'])
@@ -474,272 +3908,300 @@ def validate_token():
 def index():
     return render_template('index.html')
 
+PERIOD_MAPPING = {
+    '1m': timedelta(minutes=1), '5m': timedelta(minutes=5),
+    '15m': timedelta(minutes=15), '30m': timedelta(minutes=30),
+    '1h': timedelta(hours=1), '6h': timedelta(hours=6),
+    '12h': timedelta(hours=12), '24h': timedelta(hours=24),
+    '7d': timedelta(days=7), '30d': timedelta(days=30)
+}
+
+def build_web_stats(time_period, exact=False):
+    """Computes the full /api/stats payload for one of the PERIOD_MAPPING keys.
+
+    All-time unique users/devices come from the HyperLogLog sketches unless
+    exact is set or the sketches do not yet cover every stored row.
+    """
+    time_delta = PERIOD_MAPPING.get(time_period, timedelta(hours=1))
+    end_dt = datetime.now(timezone.utc)
+    start_dt = end_dt - time_delta
+    period_stats = calculate_stats_for_period(start_dt, end_dt)
+    if not exact and sketches_cover_all_data():
+        total_unique_users = distinct_sketches.estimate_total('users')
+        total_unique_devices = distinct_sketches.estimate_total('devices')
+        unique_counts = {'method': 'hyperloglog', 'relative_error': round(HyperLogLog.RELATIVE_ERROR, 4)}
+    elif latest_state_coverage.check():
+        # One state row per user and per device, so the exact counts are row counts
+        total_unique_users = db.session.query(func.count(UserLatestState.user_id)).scalar() or 0
+        total_unique_devices = db.session.query(func.count(DeviceLatestState.user_mac)).scalar() or 0
+        unique_counts = {'method': 'exact', 'relative_error': 0}
+    else:
+        total_unique_users = db.session.query(func.count(distinct(CellData.user_id))).scalar() or 0
+        total_unique_devices = db.session.query(func.count(distinct(CellData.user_mac))).scalar() or 0
+        unique_counts = {'method': 'exact', 'relative_error': 0}
+    all_devices, all_devices_next_cursor = device_page(app.config['STATS_DEVICE_LIMIT'])
+    return {
+        **period_stats, 'total_unique_users': total_unique_users,
+        'total_unique_devices': total_unique_devices,
+        'unique_counts': unique_counts,
+        'all_devices': all_devices,
+        'all_devices_next_cursor': all_devices_next_cursor,
+        'stats_time_utc': datetime.now(timezone.utc).isoformat(),
+        'data_window': time_period
+    }
+
+@background_worker
+def stats_prewarm_loop():
+    """Recomputes every period on a timer so dashboard requests always hit the cache."""
+    interval = app.config['STATS_PREWARM_INTERVAL']
+    if interval <= 0:
+        return
+    while True:
+        with app.app_context(), use_read_replica():
+            for period in PERIOD_MAPPING:
+                try:
+                    stats_cache.get_or_compute((period, False), lambda p=period: build_web_stats(p), force=True)
+                except Exception as e:
+                    log.error("Error prewarming stats", extra=log_extra(period=period, error=str(e)))
+        time.sleep(interval)
+
+# --- Live Feed (Server-Sent Events) ---
+def format_sse(event, data):
+    return f"event: {event}\ndata: {app.json.dumps(data)}\n\n"
+
+class LiveFeed:
+    """Fans one producer's updates out to every /api/stream subscriber.
+
+    The producer runs once per LIVE_FEED_INTERVAL per process, whatever the
+    number of open dashboards: it polls cell_data for rows with a higher id
+    than the last one seen, refreshes stats (through stats_cache) for each
+    subscribed period, and diffs the device list. Each event is serialised
+    once and queued to subscribers; a subscriber that falls behind loses
+    events rather than slowing the others down. Rows from transactions that
+    commit out of id order can be missed by the measurements event, but the
+    stats event that follows always reflects them.
+
+    A tick sends at most max_rows measurements, the newest ones; when more
+    arrived it skips ahead and flags the event as truncated rather than
+    falling further behind. Each open stream holds a worker thread, so at
+    most max_subscribers are accepted per process.
+    """
+
+    def __init__(self, quiet_seconds, max_rows, max_subscribers, subscriber_queue_size=100):
+        self.quiet_seconds = quiet_seconds
+        self.max_rows = max_rows
+        self.max_subscribers = max_subscribers
+        self.subscriber_queue_size = subscriber_queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._last_id = None
+        self._stats_digests = {}
+        self._device_states = None
+        self.dropped = 0
+        self.rejected = 0
+        self.ticks = 0
+
+    def subscribe(self, period):
+        """Returns a queue of formatted events, or None when max_subscribers streams are already open."""
+        subscriber = queue.Queue(maxsize=self.subscriber_queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            self._subscribers[subscriber] = period
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.pop(subscriber, None)
+
+    def publish(self, event, data, period=None):
+        message = format_sse(event, data)
+        with self._lock:
+            targets = [q for q, p in self._subscribers.items() if period is None or p == period]
+        for subscriber in targets:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                self.dropped += 1
+
+    def tick(self):
+        with self._lock:
+            periods = set(self._subscribers.values())
+        if not periods:
+            self._last_id = None
+            return
+        self.ticks += 1
+
+        # --- New measurements ---
+        if self._last_id is None:
+            self._last_id = db.session.query(func.max(CellData.id)).scalar() or 0
+        new_rows = CellData.query.filter(CellData.id > self._last_id) \
+            .order_by(desc(CellData.id)).limit(self.max_rows + 1).all()
+        if new_rows:
+            truncated = len(new_rows) > self.max_rows
+            new_rows = new_rows[:self.max_rows][::-1]
+            self._last_id = new_rows[-1].id
+            self.publish('measurements', {'rows': [row.to_dict() for row in new_rows], 'truncated': truncated})
+
+        # --- Changed distributions ---
+        all_devices = None
+        for period in periods:
+            stats = stats_cache.get_or_compute((period, False), lambda p=period: build_web_stats(p))
+            all_devices = stats['all_devices']
+            digest = hashlib.sha1(app.json.dumps(
+                {k: v for k, v in stats.items() if k != 'stats_time_utc'}).encode('utf-8')).hexdigest()
+            if self._stats_digests.get(period) != digest:
+                self._stats_digests[period] = digest
+                self.publish('stats', stats, period)
+
+        # --- Devices appearing or going quiet ---
+        # Only the most recently seen page of devices is tracked (STATS_DEVICE_LIMIT)
+        now = datetime.now(timezone.utc)
+        states = {}
+        for device in all_devices or []:
+            last_seen = as_utc(datetime.fromisoformat(device['last_seen'])) if device['last_seen'] else None
+            is_quiet = last_seen is None or (now - last_seen).total_seconds() > self.quiet_seconds
+            states[device['mac']] = 'quiet' if is_quiet else 'active'
+        if self._device_states is not None:
+            appeared = [mac for mac, state in states.items()
+                        if state == 'active' and self._device_states.get(mac) != 'active']
+            quiet = [mac for mac, state in states.items()
+                     if state == 'quiet' and self._device_states.get(mac) == 'active']
+            if appeared or quiet:
+                self.publish('devices', {'appeared': appeared, 'quiet': quiet})
+        self._device_states = states
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers), 'max_subscribers': self.max_subscribers,
+                    'rejected_subscribers': self.rejected, 'ticks': self.ticks, 'dropped_events': self.dropped}
+
+live_feed = LiveFeed(app.config['LIVE_FEED_QUIET_SECONDS'], app.config['LIVE_FEED_MAX_ROWS'],
+                     app.config['LIVE_FEED_MAX_SUBSCRIBERS'])
+
+@background_worker
+def live_feed_loop():
+    interval = app.config['LIVE_FEED_INTERVAL']
+    if interval <= 0:
+        return
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                live_feed.tick()
+            except Exception as e:
+                db.session.rollback()
+                log.error("Error producing live feed update", extra=log_extra(error=str(e)))
+
+@app.route('/api/stream')
+@read_only_route
+def stream_updates():
+    """Server-Sent Events feed of new measurements, stats and device changes for one period."""
+    if app.config['LIVE_FEED_INTERVAL'] <= 0:
+        return jsonify({'status': 'error', 'message': 'Live feed is disabled on this server.'}), 503
+    period = request.args.get('period', '1h')
+    if period not in PERIOD_MAPPING:
+        period = '1h'
+    try:
+        initial_stats = stats_cache.get_or_compute((period, False), lambda: build_web_stats(period))
+    except Exception as e:
+        log.exception("Error generating initial stats for /api/stream")
+        return jsonify({'status': 'error', 'message': "An internal error occurred while generating statistics."}), 500
+    subscriber = live_feed.subscribe(period)
+    if subscriber is None:
+        response = jsonify({'status': 'error', 'message': 'Too many open live feeds, retry shortly.'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    def event_stream():
+        try:
+            yield "retry: 5000\n" + format_sse('stats', initial_stats)
+            while True:
+                try:
+                    yield subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            live_feed.unsubscribe(subscriber)
+
+    return Response(event_stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/stats')
+@read_only_route
 def get_web_stats():
     """Provides statistics for the web dashboard based on relative time periods."""
     try:
         time_period = request.args.get('period', '1h')
-        period_mapping = {
-            '1m': timedelta(minutes=1), '5m': timedelta(minutes=5),
-            '15m': timedelta(minutes=15), '30m': timedelta(minutes=30),
-            '1h': timedelta(hours=1), '6h': timedelta(hours=6),
-            '12h': timedelta(hours=12), '24h': timedelta(hours=24),
-            '7d': timedelta(days=7), '30d': timedelta(days=30)
-        }
-        time_delta = period_mapping.get(time_period, timedelta(hours=1))
-        end_dt = datetime.now(timezone.utc)
-        start_dt = end_dt - time_delta
-        period_stats = calculate_stats_for_period(start_dt, end_dt)
-        total_unique_users = db.session.query(func.count(distinct(CellData.user_id))).scalar() or 0
-        all_devices_query = db.session.query(
-            CellData.user_mac,
-            db.session.query(CellData.user_ip)
-                .filter(CellData.user_mac == CellData.user_mac)
-                .order_by(desc(CellData.upload_time))
-                .limit(1)
-                .scalar_subquery().label('last_ip'),
-            func.max(CellData.upload_time).label('last_seen')
-        ).filter(CellData.user_mac.isnot(None)).group_by(CellData.user_mac).order_by(desc('last_seen'))
-        all_devices = [
-            {'mac': row.user_mac, 'ip': row.last_ip, 'last_seen': row.last_seen.isoformat() if row.last_seen else None}
-            for row in all_devices_query.all()
-        ]
-        full_stats = {
-            **period_stats, 'total_unique_users': total_unique_users,
-            'all_devices': all_devices,
-            'stats_time_utc': datetime.now(timezone.utc).isoformat(),
-            'data_window': time_period
-        }
+        exact = request.args.get('exact', 'false').lower() == 'true'
+        # Unknown periods fall back to 1h, so they share its cache entry
+        period_key = time_period if time_period in PERIOD_MAPPING else '1h'
+        full_stats = stats_cache.get_or_compute((period_key, exact), lambda: build_web_stats(period_key, exact))
+        if full_stats['data_window'] != time_period:
+            full_stats = {**full_stats, 'data_window': time_period}
         return jsonify(full_stats), 200
     except Exception as e:
-        print(f"❌ Error generating stats in /api/stats endpoint: {e}")
-        traceback.print_exc()
-        err_str = str(e).lower()
-        if "no such function: regexp_replace" in err_str or "regular expression support is not available" in err_str:
-            err_msg_for_client = "Error: Stats calculation requires features not available in the current database setup (e.g., SQLite)."
-        else:
-            err_msg_for_client = "An internal error occurred while generating statistics."
-        return jsonify({'status': 'error', 'message': err_msg_for_client}), 500
+        log.exception("Error generating stats")
+        return jsonify({'status': 'error', 'message': "An internal error occurred while generating statistics."}), 500
 
 @app.route('/api/user-stats', methods=['GET'])
+@read_only_route
 def get_user_stats():
     """Provides optimized statistics for a specific user based on a date range (now uses email instead of user ID)."""
-    email = request.args.get('email') 
-    start_date_str = request.args.get('start_date')
-    end_date_str = request.args.get('end_date')
-    limit = request.args.get('limit', 1000, type=int)
-
-    if not email:
-        return jsonify({'status': 'error', 'message': "Missing 'email' query parameter."}), 400
+    try:
+        options = user_stats_options(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
     # 🔍 Find the user ID from the email
-    user = User.query.filter_by(email=email).first()
+    email = options['email']
+    user = lookup_user_by_email(email)
     if not user:
         return jsonify({'status': 'error', 'message': f"No user found with email: {email}"}), 404
 
     user_id = str(user.id)
 
-    offset = timedelta(hours=3)
-
-    if not start_date_str or not end_date_str:
-        end_dt = datetime.now(timezone.utc)
-        start_dt = end_dt - timedelta(hours=1)
-    else:
-        try:
-            start_dt = datetime.strptime(start_date_str, '%Y-%m-%d %H:%M:%S') - offset
-            end_dt = datetime.strptime(end_date_str, '%Y-%m-%d %H:%M:%S') - offset
-            start_dt = start_dt.replace(tzinfo=timezone.utc)
-            end_dt = end_dt.replace(tzinfo=timezone.utc)
-        except ValueError:
-            return jsonify({'status': 'error', 'message': "Invalid date format. Use YYYY-MM-DD HH:MM:SS."}), 400
-
     try:
-        is_postgresql = db.engine.dialect.name == 'postgresql'
+        start_dt, end_dt = user_stats_window(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
-        base_query = CellData.query.filter(
-            CellData.user_id == user_id,
-            CellData.upload_time >= start_dt,
-            CellData.upload_time <= end_dt
-        )
+    try:
+        base_query = CellData.query.filter(*user_series_criteria(user_id, start_dt, end_dt))
 
         total_data_points = base_query.count()
 
         if total_data_points == 0:
-            return jsonify({
-                'status': 'success',
-                'message': 'No data found for this user in the specified time range',
-                'data': {
-                    'signalData': [],
-                    'networkData': [],
-                    'summary': {}
-                }
-            }), 200
+            return encode_response(empty_user_stats_payload(options['format']), options['encoding'])
 
+        limit = options['limit']
         downsample_factor = max(1, (total_data_points // limit)) if limit > 0 else 1
 
-        network_stats = {}
-        network_counts_query = base_query.with_entities(
+        network_rows = base_query.with_entities(
             CellData.network_type,
             func.count(CellData.id).label('count')
         ).group_by(CellData.network_type).all()
 
-        for row in network_counts_query:
-            network_type = row.network_type or "UNKNOWN"
-            network_stats[network_type] = row.count
-
-        total_count = sum(network_stats.values())
-        network_distribution = {}
-        if total_count > 0:
-            raw_distribution = {
-                k: max(0, v / total_count * 100)
-                for k, v in network_stats.items()
-            }
-
-            total_percentage = sum(raw_distribution.values())
-            if total_percentage > 0:
-                network_distribution = {
-                    k: round((v / total_percentage) * 100, 1)
-                    for k, v in raw_distribution.items()
-                }
-
-            network_distribution = {
-                k: v for k, v in network_distribution.items() if v >= 0.5
-            }
-
-            if network_distribution and sum(network_distribution.values()) != 100:
-                total = sum(network_distribution.values())
-                network_distribution = {
-                    k: round((v / total) * 100, 1)
-                    for k, v in network_distribution.items()
-                }
-
-        if downsample_factor > 1:
-            if is_postgresql:
-                sampled_query = db.session.execute(text(f"""
-                    WITH numbered_rows AS (
-                        SELECT 
-                            upload_time, 
-                            signal_power,
-                            snr, 
-                            network_type,
-                            ROW_NUMBER() OVER (ORDER BY upload_time) as row_num
-                        FROM cell_data
-                        WHERE user_id = :user_id 
-                          AND upload_time BETWEEN :start_dt AND :end_dt
-                    )
-                    SELECT 
-                        upload_time, 
-                        signal_power,
-                        snr,
-                        network_type
-                    FROM numbered_rows
-                    WHERE row_num % :downsample = 0
-                    ORDER BY upload_time
-                """), {
-                    'user_id': user_id,
-                    'start_dt': start_dt,
-                    'end_dt': end_dt,
-                    'downsample': downsample_factor
-                }).fetchall()
-            else:
-                all_data = base_query.order_by(CellData.upload_time).all()
-                sampled_query = all_data[::downsample_factor]
-        else:
-            sampled_query = base_query.order_by(CellData.upload_time).all()
-
-        signal_data = []
-        network_data = []
-        snr_values = []
-
-        network_type_map = {
-            "LTE": 4, "5G": 5, "3G": 3, "2G": 2, "WIFI": 6, "UNKNOWN": 0
-        }
-
-        for row in sampled_query:
-            timestamp = int(row.upload_time.timestamp() * 1000) if hasattr(row, 'upload_time') else int(row[0].timestamp() * 1000)
-            signal_power = row.signal_power if hasattr(row, 'signal_power') else row[1]
-            snr = row.snr if hasattr(row, 'snr') else row[2]
-            network_type = row.network_type if hasattr(row, 'network_type') else row[3]
-
-            if signal_power:
-                try:
-                    import re
-                    match = re.search(r'-?\d+\.?\d*', signal_power)
-                    if match:
-                        signal_value = float(match.group(0))
-                        signal_data.append({
-                            'timestamp': timestamp,
-                            'signalStrength': signal_value
-                        })
-                except (ValueError, TypeError):
-                    pass
-
-            net_type = network_type or "UNKNOWN"
-            net_val = network_type_map.get(net_type, 0)
-            network_data.append({
-                'timestamp': timestamp,
-                'networkType': net_type,
-                'networkTypeValue': net_val
-            })
-
-            if snr:
-                try:
-                    import re
-                    match = re.search(r'-?\d+\.?\d*', snr)
-                    if match:
-                        snr_values.append(float(match.group(0)))
-                except (ValueError, TypeError):
-                    pass
-
-        summary = {
-            'dataPoints': total_data_points,
-            'networkDistribution': network_distribution,
-            'sampledPoints': len(signal_data),
-            'downsampleFactor': downsample_factor
-        }
+        start_ms = int(start_dt.timestamp() * 1000)
+        end_ms = int(end_dt.timestamp() * 1000)
+        sampled_points = downsample_series(lambda: iter_signal_series(base_query), options['downsample'],
+                                           downsample_factor, start_ms, end_ms, limit)
 
-        if is_postgresql:
-            avg_signal_query = db.session.execute(text("""
-                SELECT AVG(CAST(regexp_replace(signal_power, '[^-0-9.]', '', 'g') AS FLOAT)) as avg_signal
-                FROM cell_data
-                WHERE user_id = :user_id 
-                  AND upload_time BETWEEN :start_dt AND :end_dt
-                  AND signal_power ~ '[-]?[0-9]+\\.?[0-9]*'
-            """), {'user_id': user_id, 'start_dt': start_dt, 'end_dt': end_dt}).fetchone()
-
-            avg_snr_query = db.session.execute(text("""
-                SELECT AVG(CAST(regexp_replace(snr, '[^-0-9.]', '', 'g') AS FLOAT)) as avg_snr
-                FROM cell_data
-                WHERE user_id = :user_id 
-                  AND upload_time BETWEEN :start_dt AND :end_dt
-                  AND snr ~ '[-]?[0-9]+\\.?[0-9]*'
-            """), {'user_id': user_id, 'start_dt': start_dt, 'end_dt': end_dt}).fetchone()
-
-            summary['avgSignalStrength'] = float(avg_signal_query.avg_signal) if avg_signal_query.avg_signal else None
-            summary['avgSnr'] = float(avg_snr_query.avg_snr) if avg_snr_query.avg_snr else None
-        else:
-            summary['avgSignalStrength'] = sum([s['signalStrength'] for s in signal_data]) / len(signal_data) if signal_data else None
-            summary['avgSnr'] = sum(snr_values) / len(snr_values) if snr_values else None
+        averages = base_query.with_entities(
+            func.avg(CellData.signal_dbm).label('avg_signal'),
+            func.avg(CellData.snr_db).label('avg_snr')
+        ).one()
 
-        return jsonify({
-            'status': 'success',
-            'data': {
-                'signalData': signal_data,
-                'networkData': network_data,
-                'summary': summary,
-                'timeRange': {
-                    'start': start_dt.isoformat(),
-                    'end': end_dt.isoformat()
-                }
-            }
-        }), 200
+        return encode_response(user_stats_payload(options, sampled_points, total_data_points, downsample_factor,
+                                                  network_rows, averages, start_dt, end_dt), options['encoding'])
 
     except Exception as e:
-        print(f"❌ Error generating user stats: {e}")
-        traceback.print_exc()
+        log.exception("Error generating user stats")
         return jsonify({'status': 'error', 'message': f"An error occurred while fetching statistics: {str(e)}"}), 500
 
 @app.route('/api/server-user-stats', methods=['GET'])
+@read_only_route
 def get_user_stats_for_dashboard():
     """Provides user info and connection history for the User Stats dashboard tab."""
     email = request.args.get('email')
@@ -747,38 +4209,46 @@ def get_user_stats_for_dashboard():
     
     if not email:
         return jsonify({'status': 'error', 'message': "Missing 'email' query parameter."}), 400
+    try:
+        limit, after = page_args(100, datetime, int)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     
     # Find the user by email
-    user = User.query.filter_by(email=email).first()
+    user = lookup_user_by_email(email)
     if not user:
         return jsonify({'status': 'error', 'message': f"No user found with email: {email}"}), 404
     
     user_id = str(user.id)
     
     # Map period to time delta
-    period_mapping = {
-        '1m': timedelta(minutes=1), '5m': timedelta(minutes=5),
-        '15m': timedelta(minutes=15), '30m': timedelta(minutes=30),
-        '1h': timedelta(hours=1), '6h': timedelta(hours=6),
-        '12h': timedelta(hours=12), '24h': timedelta(hours=24),
-        '7d': timedelta(days=7), '30d': timedelta(days=30)
-    }
-    time_delta = period_mapping.get(period, timedelta(hours=1))
+    time_delta = PERIOD_MAPPING.get(period, timedelta(hours=1))
     end_dt = datetime.now(timezone.utc)
     start_dt = end_dt - time_delta
     
     try:
         # Get the user's most recent connection data
-        latest_data = CellData.query.filter(
-            CellData.user_id == user_id
-        ).order_by(desc(CellData.upload_time)).first()
+        if latest_state_coverage.check():
+            latest_data = db.session.get(UserLatestState, user_id)
+        else:
+            latest_data = CellData.query.filter(
+                CellData.user_id == user_id
+            ).order_by(desc(CellData.upload_time)).first()
         
-        # Get connection history within the time period
-        connection_history = CellData.query.filter(
+        # Get connection history within the time period, newest first, one page at a time
+        history_query = CellData.query.filter(
             CellData.user_id == user_id,
             CellData.upload_time >= start_dt,
             CellData.upload_time <= end_dt
-        ).order_by(desc(CellData.upload_time)).limit(100).all()
+        )
+        if after is not None:
+            after_time, after_id = after
+            history_query = history_query.filter(or_(
+                CellData.upload_time < after_time,
+                and_(CellData.upload_time == after_time, CellData.id < after_id)
+            ))
+        connection_history, has_more = split_page(
+            history_query.order_by(desc(CellData.upload_time), desc(CellData.id)).limit(limit + 1).all(), limit)
         
         # Format user info for response
         user_info = {
@@ -794,27 +4264,8 @@ def get_user_stats_for_dashboard():
         # Format connection history for response
         history_list = []
         for record in connection_history:
-            # Convert signal power and SNR to numeric values if possible
-            signal_power = None
-            snr = None
-            
-            if record.signal_power:
-                try:
-                    import re
-                    match = re.search(r'-?\d+\.?\d*', record.signal_power)
-                    if match:
-                        signal_power = float(match.group(0))
-                except (ValueError, TypeError):
-                    pass
-            
-            if record.snr:
-                try:
-                    import re
-                    match = re.search(r'-?\d+\.?\d*', record.snr)
-                    if match:
-                        snr = float(match.group(0))
-                except (ValueError, TypeError):
-                    pass
+            signal_power = measurement_value(record.signal_dbm, record.signal_power)
+            snr = measurement_value(record.snr_db, record.snr)
             
             history_list.append({
                 'client_timestamp': record.client_timestamp,
@@ -827,30 +4278,45 @@ def get_user_stats_for_dashboard():
                 'upload_time': record.upload_time.isoformat() if record.upload_time else None
             })
         
-        # Get the latest connection details
-        latest_connection = history_list[0] if history_list else None
+        # Get the latest connection details (only the first page starts with it)
+        latest_connection = history_list[0] if history_list and after is None else None
+        last_record = connection_history[-1] if connection_history else None
         
         return jsonify({
             'userInfo': user_info,
             'connectionHistory': history_list,
-            'latestConnection': latest_connection
+            'latestConnection': latest_connection,
+            'nextCursor': encode_cursor(last_record.upload_time, last_record.id) if has_more else None
         }), 200
         
     except Exception as e:
-        print(f"❌ Error generating user stats for dashboard: {e}")
-        traceback.print_exc()
+        log.exception("Error generating user stats for dashboard")
         return jsonify({'status': 'error', 'message': f"An error occurred while fetching user statistics: {str(e)}"}), 500
 
 @app.route('/api/all-users', methods=['GET'])
+@read_only_route
 def get_all_users():
-    """Provides a list of all users in the system."""
+    """Pages through users ordered by email; ?q= matches an email or name prefix (case-insensitive)."""
+    try:
+        limit, after = page_args(PAGE_SIZE_DEFAULT, str)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    search = (request.args.get('q') or '').strip().lower()
     try:
-        # Query for all users with distinct emails
         users_query = db.session.query(
             User.email, 
             User.id.label('user_id'),
             User.name
-        ).order_by(User.email).all()
+        )
+        if search:
+            pattern = prefix_pattern(search)
+            users_query = users_query.filter(or_(
+                func.lower(User.email).like(pattern, escape='\\'),
+                func.lower(User.name).like(pattern, escape='\\')
+            ))
+        if after is not None:
+            users_query = users_query.filter(User.email > after[0])
+        users, has_more = split_page(users_query.order_by(User.email).limit(limit + 1).all(), limit)
         
         # Format the results
         users_list = [
@@ -858,28 +4324,449 @@ def get_all_users():
                 'email': user.email,
                 'user_id': str(user.user_id),
                 'name': user.name
-            } for user in users_query
+            } for user in users
         ]
         
-        return jsonify(users_list), 200
+        return jsonify({
+            'users': users_list,
+            'next_cursor': encode_cursor(users[-1].email) if has_more else None
+        }), 200
         
     except Exception as e:
-        print(f"❌ Error fetching all users: {e}")
-        traceback.print_exc()
+        log.exception("Error fetching all users")
         return jsonify({'status': 'error', 'message': f"An error occurred while fetching users: {str(e)}"}), 500
 
+@app.route('/api/export', methods=['GET'])
+@token_required
+def export_cell_data():
+    """Streams raw cell_data for [start_date, end_date) as CSV or Parquet; memory use is one chunk."""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'status': 'error', 'message': f"Invalid 'format'. Use one of: {', '.join(EXPORT_FORMATS)}."}), 400
+    if export_format == 'parquet' and pq is None:
+        return jsonify({'status': 'error', 'message': "Parquet export requires the 'pyarrow' package on the server."}), 400
+    if not request.args.get('start_date') or not request.args.get('end_date'):
+        return jsonify({'status': 'error', 'message': "Missing 'start_date' or 'end_date' query parameter."}), 400
+    try:
+        start_dt = parse_export_time(request.args['start_date'])
+        end_dt = parse_export_time(request.args['end_date'])
+    except ValueError:
+        return jsonify({'status': 'error', 'message': "Invalid date format. Use ISO 8601 (UTC), e.g. 2024-05-01T00:00:00."}), 400
+    if end_dt <= start_dt:
+        return jsonify({'status': 'error', 'message': "'end_date' must be after 'start_date'."}), 400
+
+    user_id = None
+    email = request.args.get('email')
+    if email:
+        user = lookup_user_by_email(email)
+        if not user:
+            return jsonify({'status': 'error', 'message': f"No user found with email: {email}"}), 404
+        user_id = str(user.id)
+
+    chunks = export_chunks(read_engine(), start_dt, end_dt, user_id, request.args.get('operator'),
+                           app.config['EXPORT_CHUNK_SIZE'])
+    filename = f"cell_data_{start_dt:%Y%m%dT%H%M%S}_{end_dt:%Y%m%dT%H%M%S}.{export_format}"
+    if export_format == 'parquet':
+        body, mimetype = iter_parquet_export(chunks), 'application/vnd.apache.parquet'
+    else:
+        body, mimetype = iter_csv_export(chunks), 'text/csv'
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@app.route('/api/devices', methods=['GET'])
+@read_only_route
+def get_devices():
+    """Pages through every device (MAC) seen, most recent first; ?q= matches a MAC prefix."""
+    try:
+        limit, after = page_args(PAGE_SIZE_DEFAULT, datetime, str)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    try:
+        devices, next_cursor = device_page(limit, after, (request.args.get('q') or '').strip())
+        return jsonify({'devices': devices, 'next_cursor': next_cursor}), 200
+    except Exception as e:
+        log.exception("Error fetching devices")
+        return jsonify({'status': 'error', 'message': f"An error occurred while fetching devices: {str(e)}"}), 500
+
+@app.route('/api/alerts', methods=['GET'])
+def get_alerts():
+    """Lists active signal/SNR degradation alerts detected on this worker's ingest stream."""
+    dimension = request.args.get('dimension')
+    alerts = degradation_detector.active_alerts()
+    if dimension:
+        alerts = [alert for alert in alerts if alert['dimension'] == dimension]
+    alerts.sort(key=lambda alert: alert['drop'], reverse=True)
+    return jsonify({'alerts': alerts, 'detector': degradation_detector.stats()}), 200
+
+quality_cache = SingleFlightCache(app.config['STATS_CACHE_TTL'])
+
+@app.route('/api/cell-quality', methods=['GET'])
+@read_only_route
+def get_cell_quality():
+    """Signal and SNR percentiles and dBm histograms per cell, operator or network type, from stored sketches."""
+    dimension = request.args.get('dimension', 'cell_id')
+    if dimension not in QualitySketchStore.DIMENSIONS:
+        return jsonify({'status': 'error', 'message': f"Invalid 'dimension'. Use one of: {', '.join(QualitySketchStore.DIMENSIONS)}."}), 400
+    try:
+        quantiles = tuple(sorted({float(q) for q in request.args.get('quantiles', '').split(',') if q.strip()})) or QUALITY_QUANTILES
+        if not all(0 <= q <= 1 for q in quantiles):
+            raise ValueError
+        bin_width = request.args.get('bin_width', 5, type=float)
+        if not bin_width or bin_width <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({'status': 'error', 'message': "'quantiles' must be comma-separated values in [0, 1] and 'bin_width' positive."}), 400
+    limit = request.args.get('limit', 50, type=int)
+    if limit is None or not 1 <= limit <= PAGE_SIZE_MAX:
+        return jsonify({'status': 'error', 'message': f"'limit' must be between 1 and {PAGE_SIZE_MAX}."}), 400
+    now = datetime.now(timezone.utc)
+    if request.args.get('start_date'):
+        try:
+            start_dt = parse_export_time(request.args['start_date'])
+            end_dt = parse_export_time(request.args['end_date']) if request.args.get('end_date') else now
+        except ValueError:
+            return jsonify({'status': 'error', 'message': "Invalid date format. Use ISO 8601 (UTC), e.g. 2024-05-01T00:00:00."}), 400
+    else:
+        start_dt, end_dt = now - PERIOD_MAPPING.get(request.args.get('period', '24h'), timedelta(hours=24)), now
+    # Sketch buckets are whole hours, so the window end is rounded up to the hour that contains it
+    end_dt = floor_hour(end_dt) + (timedelta(hours=1) if end_dt > floor_hour(end_dt) else timedelta())
+    if end_dt <= start_dt:
+        return jsonify({'status': 'error', 'message': "'end_date' must be after 'start_date'."}), 400
+    key = request.args.get('key')
+
+    def compute():
+        merged, effective_start = cell_quality(dimension, start_dt, end_dt, key)
+        ranked = sorted(merged.items(), key=lambda item: (-max(s.count for s in item[1].values()), item[0]))
+        return {
+            'status': 'success',
+            'dimension': dimension,
+            'window': {'start': effective_start.isoformat() if effective_start else None, 'end': end_dt.isoformat()},
+            'relative_accuracy': DDSketch.RELATIVE_ACCURACY,
+            'keys': [
+                {'key': name, **{metric: summarize_quality_sketch(sketch, quantiles, bin_width)
+                                 for metric, sketch in sorted(metrics.items())}}
+                for name, metrics in ranked[:limit]
+            ],
+            'truncated': len(ranked) > limit
+        }
+
+    try:
+        cache_key = (dimension, key, floor_hour(start_dt), end_dt, quantiles, bin_width, limit)
+        return jsonify(quality_cache.get_or_compute(cache_key, compute)), 200
+    except Exception as e:
+        log.exception("Error computing cell quality")
+        return jsonify({'status': 'error', 'message': "An internal error occurred while computing cell quality."}), 500
+
+@app.route('/api/ingest-stats', methods=['GET'])
+def get_ingest_stats():
+    """Exposes write-behind queue depth, flush latency, backpressure and duplicate pre-filter counters."""
+    return jsonify({**ingest_queue.stats(), 'recent_upload_keys': recent_upload_keys.stats()}), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint: request latency, per-statement SQL timing and pool usage."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/sql-profile', methods=['GET'])
+@token_required
+def get_sql_profile():
+    """Statements ranked by total time (optionally for one ?route=), plus recent slow statements and their plans."""
+    # Raw SQL and query plans reveal the schema, so the endpoint is opt-in
+    if not app.config['SQL_PROFILE_ENABLED']:
+        return jsonify({'status': 'error', 'message': 'SQL profiling is disabled on this server.'}), 404
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({
+        'statements': statement_profile.top(limit, request.args.get('route')),
+        'slow_statements': statement_profile.slow_statements(),
+        'slow_query_ms': app.config['SLOW_QUERY_MS']
+    }), 200
+
+@app.route('/api/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """Exposes hit/miss counters for the in-process caches."""
+    return jsonify({
+        'token_cache': token_cache.stats(),
+        'user_email_cache': user_email_cache.stats(),
+        'stats_cache': stats_cache.stats(),
+        'quality_cache': quality_cache.stats(),
+        'token_sweeper': token_sweeper.stats(),
+        'live_feed': live_feed.stats()
+    }), 200
+
+def add_missing_columns():
+    """Adds nullable columns introduced after a table was first created.
+
+    `db.create_all()` never alters existing tables. Adding a nullable column
+    without a default is a catalog-only change on PostgreSQL, so this does
+    not rewrite or lock `cell_data` for long.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            print(f"✅ Added column {table.name}.{column.name} ({column_type})")
+
+def existing_index_names(table_name):
+    """Index names on a table; SQLite is read from its catalog because its inspector skips expression indexes."""
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as conn:
+            return set(conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"
+            ), {'table': table_name}).scalars())
+    return {index['name'] for index in inspect(db.engine).get_indexes(table_name)}
+
+def invalid_index_names(conn, table_name):
+    """Indexes PostgreSQL has not finished building, e.g. after an interrupted CREATE INDEX CONCURRENTLY."""
+    return set(conn.execute(text("""
+        SELECT c.relname
+          FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+         WHERE i.indrelid = to_regclass(:table) AND NOT i.indisvalid
+    """), {'table': table_name}).scalars())
+
+def create_index_concurrently(conn, index):
+    """Builds an index on PostgreSQL without blocking writes; `conn` must be in autocommit mode.
+
+    A partitioned table cannot be indexed concurrently, so each partition is
+    indexed on its own and attached to an index created ON ONLY the parent,
+    which becomes valid once every partition is attached. Leftovers of an
+    interrupted build are dropped and rebuilt, so a rerun finishes the job.
+    """
+    ddl = str(CreateIndex(index).compile(dialect=conn.dialect))
+    unique, columns = re.match(rf'CREATE (UNIQUE )?INDEX {index.name} ON {index.table.name} (.*)$', ddl, re.S).groups()
+    unique = unique or ''
+    if index.table.name != CellData.__tablename__ or not is_cell_data_partitioned(conn):
+        if index.name in invalid_index_names(conn, index.table.name):
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index.name}'))
+        conn.execute(text(f'CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON {index.table.name} {columns}'))
+        return
+    conn.execute(text(f'CREATE {unique}INDEX IF NOT EXISTS {index.name} ON ONLY {index.table.name} {columns}'))
+    for partition in list_cell_data_partitions(conn):
+        partition_index = f'{partition}_{index.name}'
+        if partition_index in invalid_index_names(conn, partition):
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {partition_index}'))
+        conn.execute(text(f'CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} {columns}'))
+        conn.execute(text(f'ALTER INDEX {index.name} ATTACH PARTITION {partition_index}'))
+
+def add_missing_indexes():
+    """Creates indexes declared on models that an existing table does not have yet.
+
+    On PostgreSQL they are built CONCURRENTLY, outside a transaction, since a
+    plain CREATE INDEX blocks every write to the table (uploads, for
+    cell_data) until the build finishes.
+    """
+    inspector = inspect(db.engine)
+    postgresql = db.engine.dialect.name == 'postgresql'
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = existing_index_names(table.name)
+        if postgresql:
+            with db.engine.connect() as conn:
+                existing -= invalid_index_names(conn, table.name)
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if postgresql:
+                with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                    create_index_concurrently(conn, index)
+            else:
+                with db.engine.begin() as conn:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+            print(f"✅ Created index {index.name} on {table.name}")
+
+def backfill_numeric_columns(batch_size=5000, start_id=0, pause_seconds=0.0):
+    """Fills signal_dbm/snr_db for rows stored before they were parsed at ingest.
+
+    Walks cell_data by primary key in short transactions, so only the rows of
+    the current batch are locked. Returns the last id processed; pass it back
+    as start_id to resume an interrupted run.
+    """
+    last_id = start_id
+    total_updated = 0
+    while True:
+        rows = db.session.query(
+            CellData.id, CellData.signal_power, CellData.snr, CellData.signal_dbm, CellData.snr_db
+        ).filter(CellData.id > last_id).order_by(CellData.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = []
+        for row in rows:
+            signal_dbm = row.signal_dbm if row.signal_dbm is not None else parse_measurement_value(row.signal_power)
+            snr_db = row.snr_db if row.snr_db is not None else parse_measurement_value(row.snr)
+            if signal_dbm != row.signal_dbm or snr_db != row.snr_db:
+                updates.append({'id': row.id, 'signal_dbm': signal_dbm, 'snr_db': snr_db})
+        if updates:
+            db.session.execute(db.update(CellData), updates)
+        db.session.commit()
+        total_updated += len(updates)
+        print(f"Backfill progress: last_id={last_id}, updated={total_updated}")
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    return last_id, total_updated
+
+@app.cli.command('backfill-numeric')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per transaction.')
+@click.option('--start-id', default=0, show_default=True, help='Resume after this cell_data id.')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches.')
+def backfill_numeric_command(batch_size, start_id, pause):
+    """Populates signal_dbm/snr_db on existing cell_data rows."""
+    add_missing_columns()
+    last_id, total_updated = backfill_numeric_columns(batch_size, start_id, pause)
+    print(f"✅ Backfill complete: {total_updated} rows updated, last_id={last_id}")
+
+@app.cli.command('rebuild-rollups')
+@click.option('--days', default=30, show_default=True, help='How far back rollups should cover.')
+@click.option('--chunk-minutes', default=60, show_default=True, help='Minutes rebuilt per transaction.')
+def rebuild_rollups_command(days, chunk_minutes):
+    """Builds per-minute rollups for cell_data stored before rollups existed."""
+    db.create_all()
+    rebuild_rollups(datetime.now(timezone.utc) - timedelta(days=days), timedelta(minutes=chunk_minutes))
+    print(f"✅ Rollups cover everything since {rollup_covered_from().isoformat()}")
+
+@app.cli.command('rebuild-sketches')
+@click.option('--days', default=3650, show_default=True, help='How far back the sketches should cover.')
+def rebuild_sketches_command(days):
+    """Builds daily distinct-count sketches for cell_data stored before they existed."""
+    db.create_all()
+    oldest_upload = db.session.query(func.min(CellData.upload_time)).scalar()
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    if oldest_upload is not None:
+        since = max(since, as_utc(oldest_upload))
+    rebuild_sketches(since)
+    print(f"✅ Sketches cover everything since {as_utc(db.session.get(StatsRollupState, SKETCH_STATE_NAME).covered_from).isoformat()}")
+
+@app.cli.command('rebuild-quality-sketches')
+@click.option('--days', default=30, show_default=True, help='How far back the quality sketches should cover.')
+def rebuild_quality_sketches_command(days):
+    """Builds signal/SNR quality sketches for cell_data stored before they existed."""
+    db.create_all()
+    oldest_upload = db.session.query(func.min(CellData.upload_time)).scalar()
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    if oldest_upload is not None:
+        since = max(since, as_utc(oldest_upload))
+    rebuild_quality_sketches(since)
+    print(f"✅ Quality sketches cover everything since {as_utc(db.session.get(StatsRollupState, QUALITY_STATE_NAME).covered_from).isoformat()}")
+
+@app.cli.command('export-cell-data')
+@click.option('--start', 'start_date', required=True, help='Start of the range (ISO 8601, UTC).')
+@click.option('--end', 'end_date', required=True, help='End of the range, exclusive (ISO 8601, UTC).')
+@click.option('--email', help='Only rows uploaded by this user.')
+@click.option('--operator', help='Only rows for this operator.')
+@click.option('--format', 'export_format', type=click.Choice(EXPORT_FORMATS), default='csv', show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), required=True, help='File to write.')
+def export_cell_data_command(start_date, end_date, email, operator, export_format, output):
+    """Streams cell_data for a time range to a CSV or Parquet file."""
+    if export_format == 'parquet' and pq is None:
+        print("❌ Parquet export requires the 'pyarrow' package.")
+        return
+    user_id = None
+    if email:
+        user = lookup_user_by_email(email)
+        if not user:
+            print(f"❌ No user found with email: {email}")
+            return
+        user_id = str(user.id)
+    chunks = export_chunks(db.engine, parse_export_time(start_date), parse_export_time(end_date),
+                           user_id, operator, app.config['EXPORT_CHUNK_SIZE'])
+    encode = iter_parquet_export if export_format == 'parquet' else iter_csv_export
+    written = 0
+    with open(output, 'wb') as f:
+        for data in encode(chunks):
+            f.write(data)
+            written += len(data)
+    print(f"✅ Exported to {output} ({written} bytes)")
+
+@app.cli.command('rebuild-latest-state')
+@click.option('--batch-size', default=1000, show_default=True, help='Users or devices upserted per transaction.')
+def rebuild_latest_state_command(batch_size):
+    """Fills user_latest_state and device_latest_state from existing cell_data."""
+    db.create_all()
+    count = rebuild_latest_state(batch_size)
+    print(f"✅ Latest state rebuilt for {count} users and devices; stats now read it.")
+
+@app.cli.command('sweep-tokens')
+def sweep_tokens_command():
+    """Deletes expired and revoked tokens now, printing progress per batch."""
+    db.create_all()
+    add_missing_columns()
+    add_missing_indexes()
+    result = token_sweeper.sweep(progress=print)
+    print(f"✅ Token sweep complete: {result['deleted_expired']} expired and {result['deleted_revoked']} revoked "
+          f"tokens deleted, {result['remaining_tokens']} remain ({result['duration_ms']} ms)")
+
+@app.cli.command('partition-cell-data')
+def partition_cell_data_command():
+    """Converts cell_data into time-range partitions (CELL_DATA_PARTITIONING=daily|monthly)."""
+    if not partitioning_configured():
+        print("❌ Set CELL_DATA_PARTITIONING to 'daily' or 'monthly' on a PostgreSQL database first.")
+        return
+    db.create_all()
+    moved = partition_cell_data()
+    created, removed = maintain_cell_data_partitions()
+    print(f"✅ cell_data is partitioned: {moved} rows moved, {len(created)} partitions created ahead, {len(removed)} expired")
+
+@app.cli.command('maintain-partitions')
+def maintain_partitions_command():
+    """Creates upcoming cell_data partitions and applies the retention policy."""
+    created, removed = maintain_cell_data_partitions()
+    print(f"✅ Partitions created: {', '.join(created) or 'none'}; removed: {', '.join(removed) or 'none'}")
+
 def create_tables():
     """Creates database tables if they don't exist. Use with caution."""
     with app.app_context():
         print("Attempting to create database tables (if they don't exist)...")
         try:
             db.create_all()
+        except Exception as e:
+            print(f"❌ Error creating/checking tables: {e}")
+            traceback.print_exc()
+            return
+        # Schema catch-up is separate from state setup, so a failed ALTER/CREATE
+        # INDEX cannot leave the rollup, sketch and latest-state paths switched off
+        try:
+            add_missing_columns()
+            add_missing_indexes()
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error adding missing columns/indexes: {e}")
+            traceback.print_exc()
+        try:
+            ensure_rollup_state()
+            ensure_sketch_state()
+            ensure_quality_sketch_state()
+            if not ensure_latest_state():
+                print("NOTE: run `flask rebuild-latest-state` so latest data and devices are read from the state tables.")
+            if partitioning_configured():
+                with db.engine.connect() as conn:
+                    already_partitioned = is_cell_data_partitioned(conn)
+                    has_rows = conn.execute(text("SELECT EXISTS (SELECT 1 FROM cell_data)")).scalar()
+                if not already_partitioned and has_rows:
+                    print("NOTE: cell_data already holds data; run `flask partition-cell-data` to partition it.")
+                else:
+                    if not already_partitioned:
+                        partition_cell_data()
+                    maintain_cell_data_partitions()
+                    print("✅ cell_data is range-partitioned on upload_time.")
             print("✅ Tables checked/created successfully.")
             print("\n" + "=" * 60)
             print("REMINDER 1: If the 'cell_data' table existed BEFORE schema changes")
             print("            (like renaming sinr->snr or adding device_brand),")
             print("            `db.create_all()` DID NOT automatically apply them.")
             print("            Schema changes require manual SQL or a migration tool.")
+            print("            New nullable columns (e.g. signal_dbm/snr_db) were added above;")
+            print("            run `flask backfill-numeric` to populate them for existing rows.")
+            print("            Then run `flask rebuild-rollups` so older windows use rollups,")
+            print("            and `flask rebuild-sketches` so unique counts use HyperLogLog.")
             print("\nREMINDER 2: Ensure 'snr', 'device_brand', and 'tokens' table exist in your DB!")
             print("=" * 60 + "\n")
         except Exception as e:
@@ -895,6 +4782,7 @@ if __name__ == '__main__':
     print("Web API: /api/stats?period=<1m|5m|...>")
     print("App API: /api/app-stats?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD")
     print("Upload: POST /upload")
+    print("Batch Upload: POST /upload/batch")
     print("Registration: POST /register")
     print("(Press CTRL+C to quit)")
 
@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# server.py binds its engine at import time, so the database has to be chosen
+# before any test module imports it. Each run gets a fresh SQLite file.
+TEST_DB_DIR = tempfile.mkdtemp(prefix='networkcellanalyzer-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(TEST_DB_DIR, 'test.db')}"
+os.environ['PASSWORD_HASH_WORKERS'] = '0'  # hash in the test thread, no worker processes
+os.environ['INGEST_MODE'] = 'sync'
+os.environ.pop('DATABASE_READ_URL', None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    """The Flask app with its schema created the way a fresh deployment does it."""
+    server.create_tables()
+    return server.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(client):
+    """Registers a new user and returns the Authorization header of their login."""
+    email = f'{uuid.uuid4().hex[:12]}@example.com'
+    client.post('/register', json={'name': 'Test User', 'email': email, 'password': 'Passw0rd!'})
+    response = client.post('/login', json={'email': email, 'password': 'Passw0rd!'})
+    return {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+
+def measurement(**fields):
+    """An /upload payload with a unique clientTimestamp, so it is never taken for a replay."""
+    payload = {'clientTimestamp': uuid.uuid4().hex, 'operator': 'Alfa', 'signalPower': '-85 dBm',
+               'snr': '12 dB', 'networkType': 'LTE', 'cellId': '1001', 'macAddress': 'AA:BB:CC:00:00:01'}
+    payload.update(fields)
+    return payload
@@ -0,0 +1,35 @@
+import server
+from conftest import measurement
+
+
+def stored_count(client_timestamps):
+    with server.app.app_context():
+        return server.CellData.query.filter(server.CellData.client_timestamp.in_(client_timestamps)).count()
+
+
+def test_batch_stores_all_valid_rows(client, auth_headers):
+    batch = [measurement() for _ in range(5)]
+    response = client.post('/upload/batch', json=batch, headers=auth_headers)
+
+    assert response.status_code == 201
+    body = response.get_json()
+    assert (body['stored'], body['duplicates'], body['failed']) == (5, 0, 0)
+    assert [result['status'] for result in body['results']] == ['stored'] * 5
+    assert stored_count([item['clientTimestamp'] for item in batch]) == 5
+
+
+def test_batch_reports_invalid_items_by_index(client, auth_headers):
+    batch = [measurement(), {'operator': 'Alfa'}, measurement()]
+    response = client.post('/upload/batch', json={'measurements': batch}, headers=auth_headers)
+
+    assert response.status_code == 207
+    body = response.get_json()
+    assert body['status'] == 'partial'
+    assert (body['stored'], body['failed']) == (2, 1)
+    assert body['results'][1] == {'index': 1, 'status': 'error', 'message': 'Missing required field: clientTimestamp'}
+
+
+def test_batch_rejects_empty_and_oversized_bodies(client, app, monkeypatch):
+    assert client.post('/upload/batch', json=[]).status_code == 400
+    monkeypatch.setitem(app.config, 'UPLOAD_BATCH_MAX_SIZE', 2)
+    assert client.post('/upload/batch', json=[measurement() for _ in range(3)]).status_code == 413
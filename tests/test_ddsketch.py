@@ -0,0 +1,80 @@
+import math
+import random
+
+import server
+
+DDSketch = server.DDSketch
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+def sketch_of(values):
+    sketch = DDSketch()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+def exact_quantile(sorted_values, q):
+    return sorted_values[math.floor(q * (len(sorted_values) - 1))]
+
+
+def signal_samples(count, seed):
+    generator = random.Random(seed)
+    return [round(generator.gauss(-90, 12), 1) for _ in range(count)]
+
+
+def assert_within_relative_accuracy(sketch, values):
+    ordered = sorted(values)
+    for q in QUANTILES:
+        expected = exact_quantile(ordered, q)
+        assert abs(sketch.quantile(q) - expected) <= DDSketch.RELATIVE_ACCURACY * abs(expected), q
+
+
+def test_quantiles_are_within_the_relative_accuracy():
+    values = signal_samples(20_000, seed=1)
+    assert_within_relative_accuracy(sketch_of(values), values)
+
+
+def test_mixed_sign_values_and_zero():
+    values = [-20.5, -3.0, 0.0, 0.0, 4.0, 12.5, 30.0] * 50
+    sketch = sketch_of(values)
+    assert_within_relative_accuracy(sketch, values)
+    assert sketch.quantile(0) == -20.5 and sketch.quantile(1) == 30.0
+
+
+def test_merge_matches_a_sketch_of_all_values():
+    first, second = signal_samples(5_000, seed=2), signal_samples(7_000, seed=3)
+    merged = sketch_of(first).merge(sketch_of(second))
+    combined = sketch_of(first + second)
+
+    assert merged.count == combined.count == 12_000
+    assert (merged.min, merged.max) == (combined.min, combined.max)
+    assert [merged.quantile(q) for q in QUANTILES] == [combined.quantile(q) for q in QUANTILES]
+    assert_within_relative_accuracy(merged, first + second)
+
+
+def test_serialization_round_trips():
+    sketch = sketch_of(signal_samples(2_000, seed=4) + [0.0])
+    restored = DDSketch.from_bytes(sketch.to_bytes())
+
+    assert (restored.count, restored.zero_count, restored.min, restored.max) == \
+        (sketch.count, sketch.zero_count, sketch.min, sketch.max)
+    assert restored.sum == sketch.sum
+    assert [restored.quantile(q) for q in QUANTILES] == [sketch.quantile(q) for q in QUANTILES]
+
+
+def test_bins_are_bounded_and_upper_quantiles_stay_accurate():
+    # Nine decades need about 1000 buckets; 512 cover the top 4.5 decades, and
+    # everything below that is collapsed into the lowest kept bucket
+    values = [10 ** (exponent / 200) for exponent in range(-600, 1200)]
+    sketch = sketch_of(values)
+
+    assert len(sketch.positive) <= DDSketch.MAX_BINS
+    ordered = sorted(values)
+    for q in (0.6, 0.9, 0.99):
+        expected = exact_quantile(ordered, q)
+        assert abs(sketch.quantile(q) - expected) <= DDSketch.RELATIVE_ACCURACY * expected
+
+
+def test_empty_sketch_has_no_quantiles():
+    assert DDSketch().quantile(0.5) is None
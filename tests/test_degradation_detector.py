@@ -0,0 +1,61 @@
+import server
+
+
+def make_detector(**overrides):
+    options = dict(max_keys=100, fast_alpha=0.5, slow_alpha=0.02, min_drop=6.0, sigma=3.0, warmup=10, sustain=3)
+    options.update(overrides)
+    return server.SignalDegradationDetector(**options)
+
+
+def rows(signal_dbm, count, cell_id='1001'):
+    return [{'cell_id': cell_id, 'operator': 'Alfa', 'network_type': 'LTE', 'signal_dbm': signal_dbm,
+             'snr_db': 15.0} for _ in range(count)]
+
+
+def signal_alert_keys(detector):
+    return {(alert['dimension'], alert['key']) for alert in detector.active_alerts() if alert['metric'] == 'signal'}
+
+
+def test_sustained_drop_raises_and_recovery_clears_an_alert():
+    detector = make_detector()
+    detector.observe_rows(rows(-80.0, 50))
+    assert detector.active_alerts() == []
+
+    detector.observe_rows(rows(-100.0, 10))
+    assert signal_alert_keys(detector) == {('cell_id', '1001'), ('operator', 'Alfa'), ('network_type', 'LTE')}
+    alert = next(alert for alert in detector.active_alerts() if alert['dimension'] == 'cell_id')
+    assert alert['drop'] > 6.0
+
+    detector.observe_rows(rows(-80.0, 20))
+    assert detector.active_alerts() == []
+
+
+def test_short_dip_does_not_alert():
+    detector = make_detector(sustain=5)
+    detector.observe_rows(rows(-80.0, 50))
+    detector.observe_rows(rows(-100.0, 2))
+    detector.observe_rows(rows(-80.0, 10))
+    assert detector.active_alerts() == []
+
+
+def test_least_recently_seen_keys_are_evicted():
+    detector = make_detector(max_keys=4)
+    for cell in range(4):
+        detector.observe_rows(rows(-80.0, 1, cell_id=str(cell)))
+    stats = detector.stats()
+    assert stats['tracked_keys'] == 4
+    assert stats['evictions'] == 2  # cells 0 and 1; the shared operator and network keys stay recent
+
+
+def test_a_long_outage_stays_alerted_until_the_signal_recovers():
+    detector = make_detector()
+    detector.observe_rows(rows(-80.0, 50))
+
+    # Far longer than 1 / slow_alpha samples, which used to pull the baseline down to the outage
+    detector.observe_rows(rows(-100.0, 1000))
+    assert signal_alert_keys(detector) == {('cell_id', '1001'), ('operator', 'Alfa'), ('network_type', 'LTE')}
+    alert = next(alert for alert in detector.active_alerts() if alert['dimension'] == 'cell_id')
+    assert alert['baseline'] > -81.0 and alert['drop'] > 19.0
+
+    detector.observe_rows(rows(-80.0, 20))
+    assert detector.active_alerts() == []
@@ -0,0 +1,75 @@
+import math
+
+import server
+
+START_MS = 1_700_000_000_000
+
+
+def series(count, step_ms=1_000):
+    """A smooth signal with a single deep fade in the middle, oldest first."""
+    points = []
+    for index in range(count):
+        signal = -80 + 5 * math.sin(index / 50)
+        if index == count // 2:
+            signal = -120.0
+        points.append((START_MS + index * step_ms, round(signal, 2), 'LTE', 10.0))
+    return points
+
+
+def downsample(points, mode, limit):
+    end_ms = points[-1][0] + 1
+    factor = max(1, math.ceil(len(points) / limit))
+    return server.downsample_series(lambda: iter(points), mode, factor, START_MS, end_ms, limit)
+
+
+def test_lttb_keeps_the_limit_the_endpoints_and_the_fade():
+    points = series(10_000)
+    sampled = downsample(points, 'lttb', 200)
+
+    assert len(sampled) <= 200
+    assert sampled[0] == points[0] and sampled[-1] == points[-1]
+    assert [point[0] for point in sampled] == sorted(point[0] for point in sampled)
+    assert min(point[1] for point in sampled) == -120.0
+
+
+def test_lttb_reads_its_input_in_two_passes():
+    points = series(1_000)
+    passes = []
+
+    def make_points():
+        passes.append(1)
+        return iter(points)
+
+    server.downsample_series(make_points, 'lttb', 10, START_MS, points[-1][0] + 1, 100)
+    assert len(passes) == 2
+
+
+def test_minmax_keeps_each_buckets_extremes():
+    points = series(10_000)
+    sampled = downsample(points, 'minmax', 200)
+
+    assert len(sampled) <= 200
+    assert min(point[1] for point in sampled) == -120.0
+    assert max(point[1] for point in sampled) == max(point[1] for point in points)
+    assert [point[0] for point in sampled] == sorted(point[0] for point in sampled)
+
+
+def test_stride_keeps_every_nth_point():
+    points = series(1_000)
+    assert downsample(points, 'stride', 100) == points[::10]
+
+
+def test_short_and_empty_series_are_returned_whole():
+    points = series(5)
+    assert downsample(points, 'lttb', 100) == points
+    assert server.downsample_series(lambda: iter([]), 'lttb', 2, START_MS, START_MS + 1, 100) == []
+    single = points[:1]
+    assert server.downsample_series(lambda: iter(single), 'lttb', 2, START_MS, START_MS + 1, 100) == single
+
+
+def test_points_without_a_signal_are_skipped():
+    points = series(1_000)
+    gappy = [(timestamp, None, network, snr) if index % 3 else (timestamp, signal, network, snr)
+             for index, (timestamp, signal, network, snr) in enumerate(points)]
+    sampled = downsample(gappy, 'lttb', 50)
+    assert sampled and all(point[1] is not None for point in sampled)
@@ -0,0 +1,91 @@
+import server
+from conftest import measurement
+
+HyperLogLog = server.HyperLogLog
+
+
+def sketch_of(values):
+    sketch = HyperLogLog()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+# RELATIVE_ERROR is one standard error; hashing is deterministic, so four of them
+# keeps these fixed inputs comfortably inside the bound without hiding a real bias
+def assert_close(estimate, actual, error_bound=4 * HyperLogLog.RELATIVE_ERROR):
+    assert abs(estimate - actual) <= error_bound * actual, (estimate, actual)
+
+
+def test_estimate_is_within_the_error_bound():
+    for cardinality in (1_000, 20_000, 100_000):
+        assert_close(sketch_of(f'user-{i}' for i in range(cardinality)).estimate(), cardinality)
+
+
+def test_small_sets_are_counted_almost_exactly():
+    assert HyperLogLog().estimate() == 0
+    assert abs(sketch_of(f'AA:{i}' for i in range(40)).estimate() - 40) <= 1
+
+
+def test_repeated_values_count_once():
+    assert sketch_of(['a', 'b', 'a', 'a', 'b']).estimate() == 2
+
+
+def test_merge_estimates_the_union():
+    first = sketch_of(f'user-{i}' for i in range(0, 30_000))
+    second = sketch_of(f'user-{i}' for i in range(20_000, 50_000))
+    assert_close(first.merge(second).estimate(), 50_000)
+
+
+def test_merge_is_idempotent_and_accepts_stored_registers():
+    sketch = sketch_of(f'user-{i}' for i in range(5_000))
+    estimate = sketch.estimate()
+    stored = bytes(sketch.registers)
+
+    assert HyperLogLog(stored).merge(stored).estimate() == estimate
+    assert HyperLogLog().merge(stored).estimate() == estimate
+
+
+def stored_total(dimension):
+    with server.app.app_context():
+        return server.distinct_sketches.estimate_total(dimension)
+
+
+def test_uploads_reach_the_stored_sketches_when_they_commit(client, auth_headers):
+    before = stored_total('devices')
+    for index in range(3):
+        response = client.post('/upload', json=measurement(macAddress=f'5E:7C:00:00:00:{index:02d}'),
+                               headers=auth_headers)
+        assert response.status_code == 201
+    # Nothing waits in memory for a flush, so a crash right now loses nothing
+    assert stored_total('devices') == before + 3
+
+
+def test_a_failed_upload_leaves_the_sketches_unchanged(client, auth_headers, monkeypatch):
+    record_distinct_sketches = server.record_distinct_sketches
+
+    def fail_after_sketching(rows):
+        record_distinct_sketches(rows)
+        raise RuntimeError('commit never happens')
+
+    monkeypatch.setattr(server, 'record_distinct_sketches', fail_after_sketching)
+    before = stored_total('devices')
+    response = client.post('/upload', json=measurement(macAddress='5E:7C:00:00:01:00'), headers=auth_headers)
+    assert response.status_code == 500
+    assert stored_total('devices') == before
+
+
+def test_totals_merge_every_shard(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'SKETCH_SHARDS', 4)
+    rows = [server.build_cell_data_row(measurement(macAddress=f'5E:7C:00:00:02:{index:02d}'), 'guest', 'guest@example.com')
+            for index in range(40)]
+    before = stored_total('devices')
+    with app.app_context():
+        for row in rows:
+            server.record_distinct_sketches([row])
+            server.db.session.commit()
+        today = server.floor_day(server.datetime.now(server.timezone.utc))
+        shards = {shard for (shard,) in server.db.session.query(server.DistinctSketch.shard).filter_by(
+            bucket_start=today, dimension='devices')}
+    assert len(shards) > 1
+    assert abs(stored_total('devices') - (before + 40)) <= 2
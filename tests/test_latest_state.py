@@ -0,0 +1,76 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import server
+from conftest import measurement
+
+NOW = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def cell_row(user_id, mac, minutes, operator='Alfa'):
+    row = server.build_cell_data_row(measurement(operator=operator, macAddress=mac), user_id, f'{user_id}@example.com')
+    row['upload_time'] = NOW + timedelta(minutes=minutes)
+    return row
+
+
+def user_state(user_id):
+    return server.db.session.get(server.UserLatestState, user_id)
+
+
+def device_state(mac):
+    return server.db.session.get(server.DeviceLatestState, mac)
+
+
+def new_user():
+    return f'u-{uuid.uuid4().hex[:10]}'
+
+
+def new_mac():
+    return 'E1:' + ':'.join(uuid.uuid4().hex[i:i + 2] for i in range(0, 10, 2)).upper()
+
+
+def test_upsert_only_moves_state_forward(app):
+    user_id, mac = new_user(), new_mac()
+    with app.app_context():
+        server.record_latest_state([cell_row(user_id, mac, 10, operator='Newer')])
+        server.record_latest_state([cell_row(user_id, mac, 5, operator='Older')])
+        server.db.session.commit()
+        assert user_state(user_id).operator == 'Newer'
+        assert server.as_utc(device_state(mac).upload_time) == NOW + timedelta(minutes=10)
+
+        server.record_latest_state([cell_row(user_id, mac, 20, operator='Newest')])
+        server.db.session.commit()
+        assert user_state(user_id).operator == 'Newest'
+        assert server.as_utc(device_state(mac).upload_time) == NOW + timedelta(minutes=20)
+
+
+def test_newest_row_of_a_batch_wins_whatever_its_position(app):
+    user_id, mac = new_user(), new_mac()
+    with app.app_context():
+        server.record_latest_state([cell_row(user_id, mac, 30, operator='Newest'),
+                                    cell_row(user_id, mac, 1, operator='Oldest')])
+        server.db.session.commit()
+        assert user_state(user_id).operator == 'Newest'
+
+
+def test_rebuild_commits_per_batch_and_keeps_newer_state(app, monkeypatch):
+    users = [new_user() for _ in range(3)]
+    with app.app_context():
+        rows = [cell_row(user_id, new_mac(), minutes, operator=f'{user_id}-{minutes}')
+                for user_id in users for minutes in (1, 2, 3)]
+        server.bulk_insert_cell_data(rows)
+        server.db.session.commit()
+        # The last user already holds a state newer than anything in cell_data, as if ingested mid-rebuild
+        server.record_latest_state([cell_row(users[-1], new_mac(), 60, operator='live')])
+        server.db.session.commit()
+
+        commits = []
+        original_commit = server.db.session.commit
+        monkeypatch.setattr(server.db.session, 'commit', lambda: (commits.append(1), original_commit()))
+        server.rebuild_latest_state(batch_size=2)
+
+        assert [user_state(user_id).operator for user_id in users] == [f'{users[0]}-3', f'{users[1]}-3', 'live']
+        assert all(device_state(row['user_mac']) is not None for row in rows)
+        keys = server.db.session.query(server.CellData.user_id).distinct().count() + \
+            server.db.session.query(server.CellData.user_mac).filter(server.CellData.user_mac.isnot(None)).distinct().count()
+        assert len(commits) >= keys // 2
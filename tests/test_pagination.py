@@ -0,0 +1,45 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+from conftest import measurement
+
+
+def test_cursor_round_trips_its_sort_key():
+    seen = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+    cursor = server.encode_cursor(seen, 'AA:01')
+
+    assert '=' not in cursor
+    assert server.decode_cursor(cursor, datetime, str) == [seen, 'AA:01']
+
+
+def test_cursor_for_another_listing_is_rejected():
+    cursor = server.encode_cursor('someone@example.com')
+    with pytest.raises(ValueError):
+        server.decode_cursor(cursor, datetime, str)
+
+
+def test_devices_page_through_every_match_once(client):
+    macs = {f'D7:00:00:00:00:{index:02X}' for index in range(5)}
+    for mac in macs:
+        client.post('/upload', json=measurement(macAddress=mac))
+
+    collected, cursor = [], None
+    while True:
+        query = {'q': 'D7:', 'limit': 2, **({'cursor': cursor} if cursor else {})}
+        body = client.get('/api/devices', query_string=query).get_json()
+        assert len(body['devices']) <= 2
+        collected.extend(device['mac'] for device in body['devices'])
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+
+    assert sorted(collected) == sorted(macs)
+
+
+def test_bad_cursor_is_a_client_error(client):
+    response = client.get('/api/devices', query_string={'cursor': 'not-a-cursor'})
+
+    assert response.status_code == 400
+    assert response.get_json() == {'status': 'error', 'message': "Invalid 'cursor'."}
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from conftest import measurement
+
+SETUP_DAY = datetime(2020, 3, 4, tzinfo=timezone.utc)
+INGEST_FROM = SETUP_DAY + timedelta(hours=13)
+
+
+@pytest.fixture
+def quality_state(app):
+    """Restores both quality coverage markers after a test moves them."""
+    names = (server.QUALITY_INGEST_STATE_NAME, server.QUALITY_STATE_NAME)
+    with app.app_context():
+        saved = {name: server.db.session.get(server.StatsRollupState, name).covered_from for name in names}
+    yield
+    with app.app_context():
+        for name, covered_from in saved.items():
+            server.db.session.get(server.StatsRollupState, name).covered_from = covered_from
+        server.db.session.commit()
+
+
+def set_quality_state(ingest_from, covered_from):
+    server.db.session.get(server.StatsRollupState, server.QUALITY_INGEST_STATE_NAME).covered_from = ingest_from
+    server.db.session.get(server.StatsRollupState, server.QUALITY_STATE_NAME).covered_from = covered_from
+    server.db.session.commit()
+
+
+def signal_count(cell_id, start_dt, end_dt):
+    merged, _ = server.cell_quality('cell_id', start_dt, end_dt, key=cell_id)
+    return merged[cell_id]['signal'].count if cell_id in merged else 0
+
+
+def test_the_day_ingest_coverage_began_in_is_read_by_the_hour():
+    ranges, start = server.quality_sketch_ranges(
+        SETUP_DAY - timedelta(days=1), SETUP_DAY + timedelta(days=2), SETUP_DAY - timedelta(days=1), INGEST_FROM)
+
+    assert start == SETUP_DAY - timedelta(days=1)
+    assert ranges == [
+        ('day', 'rebuild', SETUP_DAY - timedelta(days=1), SETUP_DAY),
+        ('hour', 'rebuild', SETUP_DAY, INGEST_FROM),
+        ('hour', 'ingest', INGEST_FROM, SETUP_DAY + timedelta(days=1)),
+        ('day', 'ingest', SETUP_DAY + timedelta(days=1), SETUP_DAY + timedelta(days=2)),
+    ]
+
+
+def test_an_upload_right_after_setup_is_read_back(client, auth_headers):
+    # The test database was empty when its tables were created, so ingest coverage began this hour
+    response = client.post('/upload', json=measurement(cellId='fresh-cell'), headers=auth_headers)
+    assert response.status_code == 201
+
+    now = datetime.now(timezone.utc)
+    with server.app.app_context():
+        assert signal_count('fresh-cell', now - timedelta(hours=1), now + timedelta(hours=1)) == 1
+
+
+def test_rebuild_and_ingest_meet_at_the_hour_ingest_began(app, quality_state):
+    def row(upload_time):
+        return dict(server.build_cell_data_row(measurement(cellId='boundary-cell'),
+                                               'guest', 'guest@example.com'), upload_time=upload_time)
+
+    before_setup = [row(SETUP_DAY - timedelta(hours=6)), row(INGEST_FROM - timedelta(minutes=30))]
+    after_setup = [row(INGEST_FROM + timedelta(minutes=30)), row(INGEST_FROM + timedelta(hours=5))]
+    with app.app_context():
+        set_quality_state(INGEST_FROM, INGEST_FROM)
+        server.bulk_insert_cell_data(before_setup + after_setup)
+        server.record_quality_sketches(after_setup)
+        # Stored before ingest coverage began, yet sketched at ingest: must not be counted twice
+        server.record_quality_sketches(before_setup[1:])
+        server.db.session.commit()
+
+        server.rebuild_quality_sketches(SETUP_DAY - timedelta(days=1))
+        assert server.db.session.get(server.StatsRollupState, server.QUALITY_STATE_NAME).covered_from.replace(
+            tzinfo=timezone.utc) == SETUP_DAY - timedelta(days=1)
+
+        window_end = SETUP_DAY + timedelta(days=2)
+        assert signal_count('boundary-cell', SETUP_DAY - timedelta(days=1), window_end) == 4
+        assert signal_count('boundary-cell', SETUP_DAY, window_end) == 3
+        assert signal_count('boundary-cell', INGEST_FROM, window_end) == 2
+
+
+def test_rebuild_waits_for_the_hour_ingest_coverage_begins(app, quality_state, capsys):
+    ingest_from = server.floor_hour(datetime.now(timezone.utc)) + timedelta(hours=1)
+    with app.app_context():
+        set_quality_state(ingest_from, ingest_from)
+        server.rebuild_quality_sketches(ingest_from - timedelta(days=2))
+        covered_from = server.db.session.get(server.StatsRollupState, server.QUALITY_STATE_NAME).covered_from
+    assert covered_from.replace(tzinfo=timezone.utc) == ingest_from
+    assert 'run this again' in capsys.readouterr().out
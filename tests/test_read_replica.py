@@ -0,0 +1,80 @@
+import pytest
+from sqlalchemy import create_engine
+
+import server
+
+REPLICA_ONLY_EMAIL = 'replica-only@example.com'
+
+
+@pytest.fixture
+def replica(app, tmp_path, monkeypatch):
+    """A second SQLite database registered as the 'replica' bind, holding a user the primary lacks."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    server.db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(server.User.__table__.insert().values(
+            name='Replica Only', email=REPLICA_ONLY_EMAIL, password_hash='x'))
+    with app.app_context():
+        monkeypatch.setitem(server.db.engines, server.READ_REPLICA_BIND, engine)
+    monkeypatch.setattr(server, 'read_routing', server.Counter('db_read_routing_total', '', ('target',)))
+    yield engine
+    engine.dispose()
+
+
+def use_monitor(monkeypatch, max_lag=30):
+    monitor = server.ReplicaMonitor(True, max_lag, check_interval=0)
+    monkeypatch.setattr(server, 'replica_monitor', monitor)
+    return monitor
+
+
+def listed_emails(client):
+    body = client.get('/api/all-users', query_string={'q': 'replica-only'}).get_json()
+    return [user['email'] for user in body['users']]
+
+
+def routed(target):
+    return server.read_routing._values.get((target,), 0)
+
+
+def test_reads_use_the_replica_while_it_is_current(client, replica, monkeypatch):
+    monitor = use_monitor(monkeypatch)
+
+    assert listed_emails(client) == [REPLICA_ONLY_EMAIL]
+    assert routed('replica') == 1 and routed('primary') == 0
+    assert monitor.stats()['current'] and monitor.stats()['lag_seconds'] == 0.0
+
+
+def test_reads_fall_back_to_the_primary_when_the_replica_lags(client, replica, monkeypatch):
+    monitor = use_monitor(monkeypatch, max_lag=30)
+    monkeypatch.setattr(server, 'measure_replica_lag', lambda: 120.0)
+
+    assert listed_emails(client) == []
+    assert routed('primary') == 1 and routed('replica') == 0
+    assert not monitor.stats()['current'] and monitor.stats()['lag_seconds'] == 120.0
+
+
+def test_reads_fall_back_to_the_primary_when_the_replica_is_down(client, replica, monkeypatch):
+    monitor = use_monitor(monkeypatch)
+
+    def unreachable():
+        raise ConnectionError('replica unreachable')
+
+    monkeypatch.setattr(server, 'measure_replica_lag', unreachable)
+
+    assert listed_emails(client) == []
+    assert monitor.stats()['last_error'] == 'replica unreachable'
+
+
+def test_writes_inside_a_read_route_go_to_the_primary(app, replica, monkeypatch):
+    use_monitor(monkeypatch)
+    with app.app_context(), server.use_read_replica():
+        user = server.User(name='Primary Write', email='primary-write@example.com', password_hash='x')
+        server.db.session.add(user)
+        server.db.session.commit()
+        assert server.db.session.get_bind(clause=server.select(server.User)) is replica
+
+    with app.app_context():
+        assert server.User.query.filter_by(email='primary-write@example.com').count() == 1
+    with replica.connect() as conn:
+        assert conn.execute(server.select(server.User).where(
+            server.User.email == 'primary-write@example.com')).first() is None
@@ -0,0 +1,25 @@
+from sqlalchemy import inspect, text
+
+import server
+
+
+def test_fresh_database_gets_tables_and_state_markers(app):
+    with app.app_context():
+        tables = set(inspect(server.db.engine).get_table_names())
+        assert set(server.db.metadata.tables) <= tables
+        markers = {state.name for state in server.StatsRollupState.query.all()}
+    assert markers == {server.ROLLUP_STATE_NAME, server.SKETCH_STATE_NAME, server.QUALITY_STATE_NAME,
+                       server.QUALITY_INGEST_STATE_NAME, server.LATEST_STATE_NAME}
+
+
+def test_create_tables_restores_a_missing_expression_index(app):
+    with app.app_context():
+        with server.db.engine.begin() as conn:
+            conn.execute(text('DROP INDEX ix_users_email_lower'))
+        assert 'ix_users_email_lower' not in server.existing_index_names('users')
+
+    server.create_tables()
+
+    with app.app_context():
+        assert 'ix_users_email_lower' in server.existing_index_names('users')
+        assert server.db.session.get(server.StatsRollupState, server.LATEST_STATE_NAME) is not None
@@ -0,0 +1,55 @@
+import server
+from conftest import measurement
+
+
+def stored_rows(client_timestamp):
+    with server.app.app_context():
+        return server.CellData.query.filter_by(client_timestamp=client_timestamp).count()
+
+
+def forget_recent_keys(monkeypatch):
+    """Stands in for a restarted or different worker, whose in-memory pre-filter is empty."""
+    monkeypatch.setattr(server, 'recent_upload_keys', server.RecentUploadKeys(100))
+
+
+def test_replayed_upload_is_acknowledged_once_stored(client, auth_headers):
+    payload = measurement()
+    first = client.post('/upload', json=payload, headers=auth_headers)
+    replay = client.post('/upload', json=payload, headers=auth_headers)
+
+    assert (first.status_code, first.get_json()['duplicate']) == (201, False)
+    assert (replay.status_code, replay.get_json()['duplicate']) == (200, True)
+    assert stored_rows(payload['clientTimestamp']) == 1
+
+
+def test_replay_to_another_worker_is_caught_by_the_unique_key(client, auth_headers, monkeypatch):
+    payload = measurement()
+    client.post('/upload', json=payload, headers=auth_headers)
+    forget_recent_keys(monkeypatch)
+
+    replay = client.post('/upload', json=payload, headers=auth_headers)
+    assert (replay.status_code, replay.get_json()['duplicate']) == (200, True)
+    assert server.recent_upload_keys.stats()['size'] == 1  # later replays stop at the pre-filter
+    assert stored_rows(payload['clientTimestamp']) == 1
+
+
+def test_batch_drops_replays_within_and_across_batches(client, auth_headers, monkeypatch):
+    first, second = measurement(), measurement()
+    response = client.post('/upload/batch', json=[first, second, first], headers=auth_headers)
+    body = response.get_json()
+    assert [result['status'] for result in body['results']] == ['stored', 'stored', 'duplicate']
+    assert (body['stored'], body['duplicates']) == (2, 1)
+
+    forget_recent_keys(monkeypatch)
+    third = measurement()
+    body = client.post('/upload/batch', json=[second, third], headers=auth_headers).get_json()
+    assert [result['status'] for result in body['results']] == ['duplicate', 'stored']
+    assert [stored_rows(item['clientTimestamp']) for item in (first, second, third)] == [1, 1, 1]
+
+
+def test_guests_are_told_apart_by_mac_address(client):
+    client_timestamp = measurement()['clientTimestamp']
+    for mac in ('AA:00:00:00:00:01', 'AA:00:00:00:00:02'):
+        response = client.post('/upload', json=measurement(clientTimestamp=client_timestamp, macAddress=mac))
+        assert response.status_code == 201
+    assert stored_rows(client_timestamp) == 2
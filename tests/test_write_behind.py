@@ -0,0 +1,119 @@
+import json
+import os
+
+import pytest
+
+import server
+from conftest import measurement
+
+
+def make_queue(spool_dir, **overrides):
+    options = dict(max_size=10, batch_size=3, flush_interval=0.01, fsync=False)
+    options.update(overrides)
+    return server.WriteBehindQueue(str(spool_dir), **options)
+
+
+def new_row(**fields):
+    return server.build_cell_data_row(measurement(**fields), 'guest', 'guest@example.com')
+
+
+def stored_timestamps(rows):
+    timestamps = [row['client_timestamp'] for row in rows]
+    return {value for (value,) in server.db.session.query(server.CellData.client_timestamp)
+            .filter(server.CellData.client_timestamp.in_(timestamps))}
+
+
+def spool_lines(queue):
+    with open(queue._spool_path, encoding='utf-8') as spool:
+        return [json.loads(line) for line in spool]
+
+
+def test_enqueue_spools_rows_and_flush_stores_them(app, tmp_path):
+    queue = make_queue(tmp_path)
+    rows = [new_row() for _ in range(3)]
+    assert all(queue.enqueue(row) for row in rows)
+    assert [record['seq'] for record in spool_lines(queue)] == [1, 2, 3]
+
+    with app.app_context():
+        queue._flush_batch(queue._take_batch())
+        assert stored_timestamps(rows) == {row['client_timestamp'] for row in rows}
+    assert (queue.stored, queue.flush_count) == (3, 1)
+    assert spool_lines(queue) == []  # rotated to a spool holding only the rows still queued
+
+
+def test_full_queue_rejects_without_spooling(tmp_path):
+    queue = make_queue(tmp_path, max_size=2)
+    assert queue.enqueue(new_row()) and queue.enqueue(new_row())
+    assert not queue.enqueue(new_row())
+    assert queue.rejected == 1
+    assert len(spool_lines(queue)) == 2
+
+
+def test_failed_flush_requeues_the_batch_in_order(app, tmp_path, monkeypatch):
+    queue = make_queue(tmp_path)
+    rows = [new_row() for _ in range(3)]
+    for row in rows:
+        queue.enqueue(row)
+
+    def unavailable(batch):
+        raise RuntimeError('database unavailable')
+
+    with app.app_context():
+        with monkeypatch.context() as patch:
+            patch.setattr(server, 'store_cell_rows', unavailable)
+            with pytest.raises(RuntimeError):
+                queue._flush_batch(queue._take_batch())
+        assert queue.failed_flushes == 1
+        assert [row for _, _, row, _ in queue._queue] == rows
+        assert len(spool_lines(queue)) == 3  # nothing committed, so nothing may be forgotten
+
+        queue._flush_batch(queue._take_batch())
+        assert stored_timestamps(rows) == {row['client_timestamp'] for row in rows}
+    assert queue.stored == 3
+
+
+def test_orphaned_spool_replays_only_rows_after_its_checkpoint(app, tmp_path):
+    committed, pending = new_row(), new_row()
+    orphan_path = os.path.join(tmp_path, 'ingest-spool-999999.jsonl')
+    with open(orphan_path, 'w', encoding='utf-8') as spool:
+        for seq, row in enumerate((committed, pending), start=1):
+            spool.write(json.dumps({'seq': seq, 'row': dict(row, upload_time=row['upload_time'].isoformat())}) + '\n')
+        spool.write('{"seq": 3, "row": {"trunc')  # torn write from the crash
+    with open(orphan_path + '.ckpt', 'w', encoding='utf-8') as checkpoint:
+        checkpoint.write('1')
+
+    queue = make_queue(tmp_path)
+    with app.app_context():
+        queue.replay_orphaned_spools()
+        assert stored_timestamps([committed, pending]) == {pending['client_timestamp']}
+    assert queue.replayed == 1
+    assert not os.path.exists(orphan_path) and not os.path.exists(orphan_path + '.ckpt')
+
+
+def test_flush_rotates_the_spool_down_to_the_rows_still_queued(app, tmp_path):
+    queue = make_queue(tmp_path, batch_size=2)
+    for _ in range(5):
+        queue.enqueue(new_row())
+    first_spool = queue._spool_path
+
+    with app.app_context():
+        queue._flush_batch(queue._take_batch())
+    assert [record['seq'] for record in spool_lines(queue)] == [3, 4, 5]
+    assert queue._spool_path != first_spool and not os.path.exists(first_spool)
+    assert os.listdir(tmp_path) == [os.path.basename(queue._spool_path)]
+
+
+def test_spool_left_by_a_crashed_process_with_the_same_pid_is_replayed(app, tmp_path):
+    crashed = make_queue(tmp_path)
+    rows = [new_row() for _ in range(2)]
+    for row in rows:
+        crashed.enqueue(row)
+    crashed._spool.close()  # the process dies; its lock goes with it
+
+    restarted = make_queue(tmp_path)
+    restarted.enqueue(new_row())  # replays before spooling anything of its own
+    assert restarted._spool_path != crashed._spool_path
+    assert restarted.replayed == 2
+    with app.app_context():
+        assert stored_timestamps(rows) == {row['client_timestamp'] for row in rows}
+    assert not os.path.exists(crashed._spool_path)